@@ -0,0 +1,77 @@
+"""
+Multi-threaded micro-benchmark: InMemoryCache vs ShardedCache
+
+Each thread runs a read-heavy mix (by default 95% get / 5% set) over a
+shared key set and the aggregate throughput is reported per thread count.
+
+    python benchmarks/cache_bench.py
+    python benchmarks/cache_bench.py --threads 1,2,4,8,16 --ops 200000 --read-ratio 0.99 --max-entries 5000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pycommonlog.cache import InMemoryCache, ShardedCache  # noqa: E402
+
+
+def run(cache, threads, ops_per_thread, keys, read_ratio):
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(seed):
+        rng = random.Random(seed)
+        # Pre-draw the operations so the timed loop measures the cache only
+        plan = [(rng.random() < read_ratio, keys[rng.randrange(len(keys))]) for _ in range(ops_per_thread)]
+        barrier.wait()
+        for is_read, key in plan:
+            if is_read:
+                cache.get(key)
+            else:
+                cache.set(key, key, 60)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return threads * ops_per_thread / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", default="1,2,4,8", help="comma-separated thread counts")
+    parser.add_argument("--ops", type=int, default=100000, help="operations per thread")
+    parser.add_argument("--keys", type=int, default=10000, help="distinct keys")
+    parser.add_argument("--read-ratio", type=float, default=0.95)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--max-entries", type=int, default=None, help="bound both caches (LRU)")
+    args = parser.parse_args()
+
+    keys = [f"commonlog_bench:{i}" for i in range(args.keys)]
+    implementations = [
+        ("InMemoryCache", lambda: InMemoryCache(max_entries=args.max_entries, cleanup_interval=None)),
+        (f"ShardedCache({args.shards})", lambda: ShardedCache(shards=args.shards, max_entries=args.max_entries, cleanup_interval=None)),
+    ]
+
+    free_threaded = not getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}{' (free-threaded)' if free_threaded else ''}, "
+          f"{args.ops} ops/thread, {args.keys} keys, read ratio {args.read_ratio}, max_entries {args.max_entries}")
+    print(f"{'threads':>8}" + "".join(f"{name:>22}" for name, _ in implementations) + f"{'speedup':>10}")
+    for threads in [int(n) for n in args.threads.split(",")]:
+        results = []
+        for _, factory in implementations:
+            cache = factory()
+            for key in keys:
+                cache.set(key, key, 60)
+            results.append(run(cache, threads, args.ops, keys, args.read_ratio))
+        print(f"{threads:>8}" + "".join(f"{ops:>18,.0f} op/s" for ops in results) + f"{results[1] / results[0]:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,53 @@
 commonlog: Unified logging and alerting for Slack/Lark (Python)
 """
 
-from .log_types import SendMethod, AlertLevel, Attachment, Config, Provider, ChannelResolver, DefaultChannelResolver, LarkToken
-from .providers import SlackProvider, LarkProvider
+from .log_types import SendMethod, AlertLevel, Attachment, Config, SendContext, Provider, ChannelResolver, DefaultChannelResolver, LarkToken
+from .providers import SlackProvider, LarkProvider, AsyncSlackProvider, AsyncLarkProvider, HTTPTransport, RateLimitedError, ProviderHTTPError, RetryPolicy, get_retry_stats, get_redis_breaker_states, register_provider
 from .logger import commonlog
+from .async_logger import AsyncCommonlog
+from .handler import CommonlogHandler
+from .dispatcher import BackgroundDispatcher, OverflowPolicy
+from .coalescer import AlertCoalescer
+from .broadcast import BroadcastTarget, BroadcastResult, BroadcastReport, BroadcastError, BroadcastTimeoutError
+from .metrics import enable_metrics, get_metrics_snapshot, render_prometheus, start_prometheus_server, StatsDSink
+from .tracing import enable_tracing
 
 __all__ = [
     "SendMethod",
     "AlertLevel", 
     "Attachment",
     "Config",
+    "SendContext",
     "Provider",
     "ChannelResolver",
     "DefaultChannelResolver",
     "LarkToken",
     "SlackProvider",
     "LarkProvider",
-    "commonlog"
+    "AsyncSlackProvider",
+    "AsyncLarkProvider",
+    "HTTPTransport",
+    "RateLimitedError",
+    "ProviderHTTPError",
+    "RetryPolicy",
+    "get_retry_stats",
+    "get_redis_breaker_states",
+    "register_provider",
+    "commonlog",
+    "AsyncCommonlog",
+    "CommonlogHandler",
+    "BackgroundDispatcher",
+    "OverflowPolicy",
+    "AlertCoalescer",
+    "BroadcastTarget",
+    "BroadcastResult",
+    "BroadcastReport",
+    "BroadcastError",
+    "BroadcastTimeoutError",
+    "enable_metrics",
+    "get_metrics_snapshot",
+    "render_prometheus",
+    "start_prometheus_server",
+    "StatsDSink",
+    "enable_tracing"
 ]
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+Asyncio logger for commonlog
+"""
+import logging
+
+from pycommonlog.providers.registry import create_provider, get_provider
+from pycommonlog.log_types import AlertLevel, debug_log
+from pycommonlog.logger import attach_trace
+from pycommonlog.broadcast import BroadcastReport, BroadcastTarget, broadcast_async
+from pycommonlog.metrics import configure_metrics, metrics_enabled, measure_send_async
+from pycommonlog import tracing
+
+
+class AsyncCommonlog:
+    """
+    Coroutine counterpart of commonlog for asyncio applications.
+
+    send, send_to_channel and custom_send never block the event loop, so
+    concurrent alerts overlap their HTTP and Redis I/O.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        provider_name = config.provider_config.get("provider", "slack")
+        self.provider_name = provider_name
+        self.provider = create_provider(provider_name, asyncio=True)
+        configure_metrics(config)
+        tracing.configure_tracing(config)
+        debug_log(config, "Created async logger with provider: %s, send method: %s, debug: %s", provider_name, config.send_method, config.debug)
+
+    async def broadcast(self, level, message, targets, attachment=None, trace="", timeout=None):
+        """
+        Send one alert to several targets concurrently, see commonlog.broadcast.
+
+        Returns:
+            BroadcastReport with one BroadcastResult per target
+        """
+        debug_log(self.config, "async broadcast called with level: %s, message length: %s, targets: %s", level, len(message), len(targets))
+        if level == AlertLevel.INFO:
+            logging.info(message)
+            return BroadcastReport([])
+        if trace:
+            attachment = attach_trace(attachment, trace)
+        if timeout is None:
+            timeout = self.config.provider_config.get("broadcast_timeout")
+        deliveries = []
+        for target in targets:
+            target = BroadcastTarget.of(target)
+            if target.provider is None or target.provider == self.provider_name:
+                provider = self.provider
+            else:
+                provider = get_provider(target.provider, self.config, asyncio=True)
+            deliveries.append((target, provider, target.channel or self._resolve_channel(level)))
+        return await broadcast_async(deliveries, level, message, attachment, self.config, timeout)
+
+    async def _deliver(self, provider_name, provider, level, message, attachment, channel):
+        attributes = {"commonlog.provider": provider_name, "commonlog.channel": channel, "commonlog.level": level}
+        with tracing.span("commonlog.send", attributes):
+            if metrics_enabled():
+                await measure_send_async(provider_name, provider.send_to_channel, level, message, attachment, self.config, channel)
+            else:
+                await provider.send_to_channel(level, message, attachment, self.config, channel)
+
+    def _resolve_channel(self, level):
+        if self.config.channel_resolver:
+            return self.config.channel_resolver.resolve_channel(level)
+        return self.config.channel
+
+    async def send(self, level, message, attachment=None, trace=""):
+        if level == AlertLevel.INFO:
+            logging.info(message)
+            return
+        try:
+            resolved_channel = self._resolve_channel(level)
+            if trace:
+                attachment = attach_trace(attachment, trace)
+            await self._deliver(self.provider_name, self.provider, level, message, attachment, resolved_channel)
+        except Exception as e:
+            logging.error(f"Failed to send alert: {e}")
+            raise
+
+    async def send_to_channel(self, level, message, attachment=None, trace="", channel=None):
+        debug_log(self.config, "async send_to_channel called with level: %s, message length: %s, channel: %s", level, len(message), channel)
+        if level == AlertLevel.INFO:
+            logging.info(message)
+            return
+        try:
+            target_channel = channel if channel else self._resolve_channel(level)
+            if trace:
+                attachment = attach_trace(attachment, trace)
+            await self._deliver(self.provider_name, self.provider, level, message, attachment, target_channel)
+        except Exception as e:
+            debug_log(self.config, "Provider send_to_channel failed: %s", e)
+            logging.error(f"Failed to send alert: {e}")
+            raise
+
+    async def custom_send(self, provider, level, message, attachment=None, trace="", channel=None):
+        debug_log(self.config, "async custom_send called with custom provider: %s, level: %s, message length: %s", provider, level, len(message))
+        if provider == self.provider_name:
+            custom_provider = self.provider
+        else:
+            custom_provider = get_provider(provider, self.config, asyncio=True)
+        if level == AlertLevel.INFO:
+            logging.info(message)
+            return
+        try:
+            target_channel = channel if channel else self._resolve_channel(level)
+            if trace:
+                attachment = attach_trace(attachment, trace)
+            await self._deliver(provider, custom_provider, level, message, attachment, target_channel)
+        except Exception as e:
+            debug_log(self.config, "Custom provider send failed: %s", e)
+            logging.error(f"Failed to send alert: {e}")
+            raise
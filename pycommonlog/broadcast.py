@@ -0,0 +1,237 @@
+"""
+Multi-target fan-out for commonlog
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+from pycommonlog.log_types import SendContext
+
+DEFAULT_BROADCAST_WORKERS = 8
+
+
+class BroadcastTimeoutError(TimeoutError):
+    """Recorded for targets that had not finished when the deadline passed"""
+
+
+class BroadcastTarget:
+    """
+    One destination of a broadcast: a provider name and a channel.
+
+    provider None means the logger's own provider; channel None means the
+    channel resolved for the alert level.
+    """
+    __slots__ = ("provider", "channel")
+
+    def __init__(self, provider=None, channel=None):
+        self.provider = provider
+        self.channel = channel
+
+    @classmethod
+    def of(cls, target):
+        """Accept a BroadcastTarget, a "#channel" string or a (provider, channel) tuple"""
+        if isinstance(target, cls):
+            return target
+        if isinstance(target, str):
+            return cls(channel=target)
+        provider, channel = target
+        return cls(provider, channel)
+
+    def __eq__(self, other):
+        return isinstance(other, BroadcastTarget) and (self.provider, self.channel) == (other.provider, other.channel)
+
+    def __hash__(self):
+        return hash((self.provider, self.channel))
+
+    def __repr__(self):
+        return f"BroadcastTarget(provider={self.provider!r}, channel={self.channel!r})"
+
+
+class BroadcastResult:
+    """
+    Outcome of a broadcast for one target.
+
+    deferred is set when the provider was rate limited and scheduled a
+    resend: a concurrent.futures.Future that resolves once the alert is
+    actually delivered, or with the error of the last resend.
+    """
+    __slots__ = ("target", "error", "elapsed", "deferred")
+
+    def __init__(self, target, error=None, elapsed=0.0, deferred=None):
+        self.target = target
+        self.error = error
+        self.elapsed = elapsed
+        self.deferred = deferred
+
+    @property
+    def ok(self):
+        """True if the alert was delivered, not merely scheduled for a resend"""
+        return self.error is None and self.deferred is None
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def __repr__(self):
+        if self.error is not None:
+            status = f"error={self.error!r}"
+        else:
+            status = "deferred" if self.deferred is not None else "ok"
+        return f"BroadcastResult({self.target!r}, {status}, elapsed={self.elapsed:.3f})"
+
+
+class BroadcastReport:
+    """
+    Per-target results of a broadcast, in the order the targets were given.
+
+    A failing target never stops the others; inspect failed (or call
+    raise_for_failures()) to act on partial failures. Rate-limited targets
+    whose resend is still pending are listed in deferred, neither succeeded
+    nor failed.
+    """
+
+    def __init__(self, results):
+        self.results = results
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.results)
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if result.failed]
+
+    @property
+    def deferred(self):
+        return [result for result in self.results if not result.failed and result.deferred is not None]
+
+    def raise_for_failures(self):
+        """Raise BroadcastError if any target failed; deferred targets do not count"""
+        if self.failed:
+            raise BroadcastError(self)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return f"BroadcastReport({len(self.succeeded)} succeeded, {len(self.deferred)} deferred, {len(self.failed)} failed)"
+
+
+class BroadcastError(Exception):
+    def __init__(self, report):
+        self.report = report
+        failures = ", ".join(f"{result.target.provider or 'default'}:{result.target.channel}: {result.error}" for result in report.failed)
+        super().__init__(f"Broadcast failed for {len(report.failed)} of {len(report)} targets: {failures}")
+
+
+def _log_failures(report):
+    for result in report.failed:
+        logging.error(f"Failed to send alert to {result.target.provider or 'default'}:{result.target.channel}: {result.error}")
+    for result in report.deferred:
+        logging.warning(f"Alert to {result.target.provider or 'default'}:{result.target.channel} was rate limited, resend scheduled")
+
+
+def _deliver(provider, level, message, attachment, config, channel):
+    """Returns (error or None, elapsed seconds, deferred delivery or None)"""
+    started = time.monotonic()
+    try:
+        deferred = provider.send_to_channel(level, message, attachment, SendContext(config, channel), channel)
+    except Exception as e:
+        return e, time.monotonic() - started, None
+    return None, time.monotonic() - started, deferred
+
+
+def _collect(deliveries, outcomes, timeout, started):
+    results = []
+    for (target, _, _), outcome in zip(deliveries, outcomes):
+        if outcome is None:
+            error = BroadcastTimeoutError(f"Broadcast deadline of {timeout}s exceeded")
+            results.append(BroadcastResult(target, error, time.monotonic() - started))
+        else:
+            results.append(BroadcastResult(target, *outcome))
+    report = BroadcastReport(results)
+    _log_failures(report)
+    return report
+
+
+class Broadcaster:
+    """
+    Sends one alert to several (provider, channel) targets concurrently on a
+    lazily started thread pool, waiting at most timeout seconds overall.
+    """
+
+    def __init__(self, workers=DEFAULT_BROADCAST_WORKERS):
+        self.workers = max(1, int(workers))
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="commonlog-broadcast")
+        return self._executor
+
+    def run(self, deliveries, level, message, attachment, config, timeout=None):
+        """
+        Args:
+            deliveries: [(BroadcastTarget, provider, channel)]
+
+        Returns:
+            BroadcastReport
+        """
+        started = time.monotonic()
+        executor = self._get_executor()
+        futures = [executor.submit(_deliver, provider, level, message, attachment, config, channel) for _, provider, channel in deliveries]
+        concurrent.futures.wait(futures, timeout=timeout)
+        outcomes = []
+        for future in futures:
+            if future.done():
+                outcomes.append(future.result())
+            else:
+                # Not started yet: dropped; already running: left to finish in the background
+                future.cancel()
+                outcomes.append(None)
+        return _collect(deliveries, outcomes, timeout, started)
+
+    def close(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+async def broadcast_async(deliveries, level, message, attachment, config, timeout=None):
+    """
+    asyncio counterpart of Broadcaster.run: one task per target, cancelled
+    if still pending at the deadline.
+    """
+    started = time.monotonic()
+
+    async def deliver(provider, channel):
+        begun = time.monotonic()
+        try:
+            await provider.send_to_channel(level, message, attachment, SendContext(config, channel), channel)
+        except Exception as e:
+            return e, time.monotonic() - begun
+        return None, time.monotonic() - begun
+
+    tasks = [asyncio.ensure_future(deliver(provider, channel)) for _, provider, channel in deliveries]
+    if tasks:
+        await asyncio.wait(tasks, timeout=timeout)
+    pending = [task for task in tasks if not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    outcomes = [None if task in pending else task.result() for task in tasks]
+    return _collect(deliveries, outcomes, timeout, started)
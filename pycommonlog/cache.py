@@ -1,22 +1,171 @@
 """
 Caching utilities for commonlog providers
 """
+import heapq
+import os
+import sys
 import time
 import threading
-from typing import Dict, Optional, Tuple, Any
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+CLEANUP_INTERVAL = 300
+DEFAULT_SHARDS = 16
+
+
+class EvictionPolicy:
+    LRU = "lru"
+    LFU = "lfu"
+
+
+class _Entry:
+    __slots__ = ("value", "expiry", "size", "hits")
+
+    def __init__(self, value, expiry, size):
+        self.value = value
+        self.expiry = expiry
+        self.size = size
+        self.hits = 1
+
+
+def _default_sizeof(key, value) -> int:
+    # Shallow estimate: containers are counted without their contents
+    return sys.getsizeof(key) + sys.getsizeof(value)
 
 
 class InMemoryCache:
     """
     Thread-safe in-memory cache with automatic cleanup of expired entries.
+
+    Optionally bounded by max_entries and/or max_bytes (estimated with
+    sys.getsizeof unless a sizeof(key, value) callable is given); when a
+    limit is exceeded expired entries are dropped first, then the least
+    recently (LRU) or least frequently (LFU) used ones. Expiry times are
+    kept in a heap, so sweeping costs O(expired) rather than O(entries).
     """
 
-    def __init__(self):
-        self._cache: Dict[str, Tuple[Any, float]] = {}  # key -> (value, expiry_timestamp)
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 eviction: str = EvictionPolicy.LRU, sizeof: Optional[Callable[[str, Any], int]] = None,
+                 lock_free_reads: bool = False, cleanup_interval: Optional[float] = CLEANUP_INTERVAL):
+        if eviction not in (EvictionPolicy.LRU, EvictionPolicy.LFU):
+            raise ValueError(f"Unknown eviction policy: {eviction}")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.lock_free_reads = lock_free_reads
+        self._bounded = max_entries is not None or max_bytes is not None
+        self._sizeof = sizeof or _default_sizeof
+        # key -> _Entry, least recently used first
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        # (expiry, key) min-heap; stale items are skipped when popped
+        self._expiries: List[Tuple[float, str]] = []
+        # LFU only: hit count -> keys with that count, oldest first
+        self._frequencies: Dict[int, "OrderedDict[str, None]"] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
         self._lock = threading.RLock()
-        # Clean up expired entries every 5 minutes
-        self._cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
-        self._cleanup_thread.start()
+        # Clean up expired entries every 5 minutes, on a thread started by the first write
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_thread = None
+        _live_caches.add(self)
+
+    # ---- bookkeeping, called with the lock held ----
+
+    def _lookup(self, key: str, now: float) -> Optional[_Entry]:
+        entry = self._cache.get(key)
+        if entry is not None and now >= entry.expiry:
+            self._remove(key)
+            self._expirations += 1
+            return None
+        return entry
+
+    def _touch(self, key: str, entry: _Entry):
+        self._cache.move_to_end(key)
+        if self.eviction == EvictionPolicy.LFU:
+            self._unlink_frequency(key, entry.hits)
+            entry.hits += 1
+            self._frequencies.setdefault(entry.hits, OrderedDict())[key] = None
+
+    def _unlink_frequency(self, key: str, hits: int):
+        bucket = self._frequencies.get(hits)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._frequencies[hits]
+
+    def _store(self, key: str, value: Any, expiry: float, now: float):
+        if self._cleanup_thread is None and self.cleanup_interval:
+            self._cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
+            self._cleanup_thread.start()
+        # Expired entries are dropped as new ones arrive, so churn can't pile them up
+        self._sweep(now)
+        if key in self._cache:
+            self._remove(key)
+        entry = _Entry(value, expiry, self._sizeof(key, value))
+        self._cache[key] = entry
+        self._bytes += entry.size
+        heapq.heappush(self._expiries, (expiry, key))
+        if self.eviction == EvictionPolicy.LFU:
+            self._frequencies.setdefault(1, OrderedDict())[key] = None
+        self._enforce_limits(key)
+        self._compact_expiries()
+
+    def _remove(self, key: str) -> Optional[_Entry]:
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            if self.eviction == EvictionPolicy.LFU:
+                self._unlink_frequency(key, entry.hits)
+        return entry
+
+    def _over_limit(self) -> bool:
+        return bool(
+            (self.max_entries is not None and len(self._cache) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        )
+
+    def _enforce_limits(self, protect: str):
+        """Evict until within limits; the entry just stored (protect) goes last"""
+        while self._over_limit() and self._cache:
+            victim = self._victim(protect)
+            self._remove(victim)
+            self._evictions += 1
+
+    def _victim(self, protect: str) -> str:
+        if self.eviction == EvictionPolicy.LFU:
+            for hits in sorted(self._frequencies):
+                for key in self._frequencies[hits]:
+                    if key != protect:
+                        return key
+            return protect
+        # Least recently used first; the new entry is last unless it is alone
+        return next(iter(self._cache))
+
+    def _sweep(self, now: float) -> int:
+        """Drop entries expired by now; O(expired) thanks to the expiry heap"""
+        removed = 0
+        while self._expiries and self._expiries[0][0] <= now:
+            expiry, key = heapq.heappop(self._expiries)
+            entry = self._cache.get(key)
+            # Skip heap items for keys that were overwritten or removed since
+            if entry is not None and entry.expiry == expiry:
+                self._remove(key)
+                removed += 1
+        self._expirations += removed
+        return removed
+
+    def _compact_expiries(self):
+        # Overwrites and deletes leave stale heap items behind; rebuild when they dominate
+        if len(self._expiries) > 2 * len(self._cache) + 64:
+            self._expiries = [(entry.expiry, key) for key, entry in self._cache.items()]
+            heapq.heapify(self._expiries)
+
+    # ---- public API ----
 
     def get(self, key: str) -> Optional[Any]:
         """
@@ -28,15 +177,28 @@ class InMemoryCache:
         Returns:
             Cached value if found and not expired, None otherwise
         """
+        if self.lock_free_reads:
+            # Single dict lookups are atomic, so hits on unexpired entries skip
+            # the lock; recency is only recorded when the lock is free, and the
+            # hit counter may undercount under contention
+            entry = self._cache.get(key)
+            if entry is not None and time.time() < entry.expiry:
+                self._hits += 1
+                if self._bounded and self._lock.acquire(blocking=False):
+                    try:
+                        if self._cache.get(key) is entry:
+                            self._touch(key, entry)
+                    finally:
+                        self._lock.release()
+                return entry.value
         with self._lock:
-            if key in self._cache:
-                value, expiry = self._cache[key]
-                if time.time() < expiry:
-                    return value
-                else:
-                    # Value expired, remove it
-                    del self._cache[key]
-            return None
+            entry = self._lookup(key, time.time())
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._touch(key, entry)
+            return entry.value
 
     def set(self, key: str, value: Any, expire_seconds: int):
         """
@@ -48,8 +210,62 @@ class InMemoryCache:
             expire_seconds: Expiration time in seconds
         """
         with self._lock:
-            expiry = time.time() + expire_seconds
-            self._cache[key] = (value, expiry)
+            now = time.time()
+            self._store(key, value, now + expire_seconds, now)
+
+    def add(self, key: str, value: Any, expire_seconds: int) -> bool:
+        """
+        Set a value only if the key is not already cached.
+
+        Args:
+            key: Cache key
+            value: Value to cache
+            expire_seconds: Expiration time in seconds
+
+        Returns:
+            True if the value was stored, False if an unexpired value already exists
+        """
+        with self._lock:
+            now = time.time()
+            if self._lookup(key, now) is not None:
+                return False
+            self._store(key, value, now + expire_seconds, now)
+            return True
+
+    def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        """
+        Atomically increment a numeric value, keeping its expiry.
+
+        Args:
+            key: Cache key
+            amount: Increment
+
+        Returns:
+            The new value, or None if the key is missing or expired
+        """
+        with self._lock:
+            entry = self._lookup(key, time.time())
+            if entry is None:
+                return None
+            entry.value += amount
+            self._touch(key, entry)
+            return entry.value
+
+    def pop(self, key: str) -> Optional[Any]:
+        """
+        Remove a value from the cache and return it.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The removed value if found and not expired, None otherwise
+        """
+        with self._lock:
+            entry = self._remove(key)
+            if entry is not None and time.time() < entry.expiry:
+                return entry.value
+            return None
 
     def delete(self, key: str):
         """
@@ -59,30 +275,173 @@ class InMemoryCache:
             key: Cache key to delete
         """
         with self._lock:
-            self._cache.pop(key, None)
+            self._remove(key)
+
+    def ttl(self, key: str) -> Optional[float]:
+        """
+        Seconds until a key expires.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Remaining lifetime, or None if the key is missing or expired
+        """
+        with self._lock:
+            now = time.time()
+            entry = self._lookup(key, now)
+            return entry.expiry - now if entry is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Counters: entries, bytes, hits, misses, evictions, expirations
+        """
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "bytes": self._bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._cache)
 
     def _cleanup_worker(self):
         """Background thread to clean up expired entries"""
         while True:
-            time.sleep(300)  # Clean up every 5 minutes
+            time.sleep(self.cleanup_interval)
             self._cleanup_expired()
 
+    def _sweep_expired(self) -> int:
+        with self._lock:
+            removed = self._sweep(time.time())
+            self._compact_expiries()
+            return removed
+
     def _cleanup_expired(self):
         """Remove expired entries from cache"""
-        with self._lock:
-            current_time = time.time()
-            expired_keys = [
-                key for key, (_, expiry) in self._cache.items()
-                if current_time >= expiry
-            ]
-            for key in expired_keys:
-                del self._cache[key]
-            if expired_keys:
-                print(f"[Cache] Cleaned up {len(expired_keys)} expired entries from memory cache")
+        removed = self._sweep_expired()
+        if removed:
+            print(f"[Cache] Cleaned up {removed} expired entries from memory cache")
+
+    def _fork_acquire(self):
+        self._lock.acquire()
+
+    def _fork_release(self):
+        self._lock.release()
+
+    def _fork_reinit(self):
+        # Only the forking thread survives: the cleanup thread is gone and the
+        # lock was held across fork, so replace both
+        self._lock = threading.RLock()
+        self._cleanup_thread = None
+
+
+class ShardedCache:
+    """
+    InMemoryCache striped across shards, each with its own lock.
+
+    Keys are spread over the shards by hash, so writers only contend when
+    they hit the same shard, and reads of unexpired entries don't take a lock
+    at all. Limits apply per shard (max_entries / shards each), so eviction
+    order is only approximately global. Has the same API as InMemoryCache.
+    """
+
+    def __init__(self, shards: int = DEFAULT_SHARDS, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 eviction: str = EvictionPolicy.LRU, sizeof: Optional[Callable[[str, Any], int]] = None,
+                 cleanup_interval: Optional[float] = CLEANUP_INTERVAL):
+        self.shards = max(1, int(shards))
+        self._shards = [
+            InMemoryCache(
+                max_entries=-(-max_entries // self.shards) if max_entries is not None else None,
+                max_bytes=-(-max_bytes // self.shards) if max_bytes is not None else None,
+                eviction=eviction,
+                sizeof=sizeof,
+                lock_free_reads=True,
+                cleanup_interval=None,
+            )
+            for _ in range(self.shards)
+        ]
+        # One cleanup thread for all shards, each swept under its own lock
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_thread = None
+        self._cleanup_lock = threading.Lock()
+        _live_caches.add(self)
+
+    def _ensure_cleanup(self):
+        if self._cleanup_thread is None and self.cleanup_interval:
+            with self._cleanup_lock:
+                if self._cleanup_thread is None:
+                    self._cleanup_thread = threading.Thread(target=self._cleanup_worker, daemon=True)
+                    self._cleanup_thread.start()
+
+    def _shard(self, key: str) -> InMemoryCache:
+        return self._shards[hash(key) % self.shards]
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._shard(key).get(key)
+
+    def set(self, key: str, value: Any, expire_seconds: int):
+        self._ensure_cleanup()
+        self._shard(key).set(key, value, expire_seconds)
+
+    def add(self, key: str, value: Any, expire_seconds: int) -> bool:
+        self._ensure_cleanup()
+        return self._shard(key).add(key, value, expire_seconds)
+
+    def incr(self, key: str, amount: int = 1) -> Optional[int]:
+        return self._shard(key).incr(key, amount)
 
+    def pop(self, key: str) -> Optional[Any]:
+        return self._shard(key).pop(key)
 
-# Global cache instance
-_memory_cache = InMemoryCache()
+    def delete(self, key: str):
+        self._shard(key).delete(key)
+
+    def ttl(self, key: str) -> Optional[float]:
+        return self._shard(key).ttl(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters summed over all shards, see InMemoryCache.stats()"""
+        totals: Dict[str, int] = {}
+        for shard in self._shards:
+            for name, value in shard.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def _cleanup_worker(self):
+        while True:
+            time.sleep(self.cleanup_interval)
+            self._cleanup_expired()
+
+    def _cleanup_expired(self):
+        removed = sum(shard._sweep_expired() for shard in self._shards)
+        if removed:
+            print(f"[Cache] Cleaned up {removed} expired entries from memory cache")
+
+    def _fork_acquire(self):
+        self._cleanup_lock.acquire()
+
+    def _fork_release(self):
+        self._cleanup_lock.release()
+
+    def _fork_reinit(self):
+        # Shards are registered on their own
+        self._cleanup_lock = threading.Lock()
+        self._cleanup_thread = None
+
+
+# Global cache instance, created on first use
+_memory_cache = None
+_memory_cache_lock = threading.Lock()
 
 
 def get_memory_cache() -> InMemoryCache:
@@ -92,4 +451,54 @@ def get_memory_cache() -> InMemoryCache:
     Returns:
         Global InMemoryCache instance
     """
-    return _memory_cache
\ No newline at end of file
+    global _memory_cache
+    cache = _memory_cache
+    if cache is None:
+        with _memory_cache_lock:
+            if _memory_cache is None:
+                _memory_cache = InMemoryCache()
+            cache = _memory_cache
+    return cache
+
+
+def set_memory_cache(cache):
+    """
+    Replace the global in-memory cache, e.g. with a bounded or sharded one.
+
+    Args:
+        cache: InMemoryCache or ShardedCache
+    """
+    global _memory_cache
+    _memory_cache = cache
+
+
+# Every cache is locked across fork() so the child gets consistent contents,
+# then given fresh locks and a cleanup thread restarted on its next write
+_live_caches = weakref.WeakSet()
+_forking = []
+
+
+def _before_fork():
+    _memory_cache_lock.acquire()
+    _forking[:] = list(_live_caches)
+    for cache in _forking:
+        cache._fork_acquire()
+
+
+def _after_fork_in_parent():
+    for cache in reversed(_forking):
+        cache._fork_release()
+    _forking.clear()
+    _memory_cache_lock.release()
+
+
+def _after_fork_in_child():
+    global _memory_cache_lock
+    for cache in _forking:
+        cache._fork_reinit()
+    _forking.clear()
+    _memory_cache_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent, after_in_child=_after_fork_in_child)
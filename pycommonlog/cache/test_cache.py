@@ -3,7 +3,7 @@ Tests for the cache module
 """
 import time
 import unittest
-from pycommonlog.cache import InMemoryCache, get_memory_cache
+from pycommonlog.cache import InMemoryCache, ShardedCache, EvictionPolicy, get_memory_cache, set_memory_cache
 
 
 class TestInMemoryCache(unittest.TestCase):
@@ -36,6 +36,21 @@ class TestInMemoryCache(unittest.TestCase):
         self.cache.delete("delete_key")
         self.assertIsNone(self.cache.get("delete_key"))
 
+    def test_add_only_sets_missing_keys(self):
+        """Test that add does not overwrite unexpired entries"""
+        self.assertTrue(self.cache.add("add_key", "first", 60))
+        self.assertFalse(self.cache.add("add_key", "second", 60))
+        self.assertEqual(self.cache.get("add_key"), "first")
+
+    def test_incr_and_pop(self):
+        """Test atomic increments and pop"""
+        self.assertIsNone(self.cache.incr("counter"))
+        self.cache.set("counter", 0, 60)
+        self.assertEqual(self.cache.incr("counter"), 1)
+        self.assertEqual(self.cache.incr("counter", 5), 6)
+        self.assertEqual(self.cache.pop("counter"), 6)
+        self.assertIsNone(self.cache.get("counter"))
+
     def test_thread_safety(self):
         """Test that the cache is thread-safe"""
         import threading
@@ -88,5 +103,131 @@ class TestGlobalCache(unittest.TestCase):
         self.assertEqual(cache2.get("global_test"), "global_value")
 
 
+class TestBoundedCache(unittest.TestCase):
+    def test_lru_evicts_least_recently_used(self):
+        """Test that max_entries evicts the least recently used key"""
+        cache = InMemoryCache(max_entries=2)
+        cache.set("a", 1, 60)
+        cache.set("b", 2, 60)
+        cache.get("a")
+        cache.set("c", 3, 60)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_lfu_evicts_least_frequently_used(self):
+        """Test that LFU keeps frequently read keys over recently written ones"""
+        cache = InMemoryCache(max_entries=2, eviction=EvictionPolicy.LFU)
+        cache.set("hot", 1, 60)
+        cache.set("cold", 2, 60)
+        for _ in range(3):
+            cache.get("hot")
+        cache.get("cold")
+        cache.set("new", 3, 60)
+        # cold and new both have fewer hits than hot; cold is the older of the two
+        self.assertIsNone(cache.get("cold"))
+        cache.set("newer", 4, 60)
+        self.assertEqual(cache.get("hot"), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_max_bytes(self):
+        """Test that max_bytes bounds the estimated size"""
+        cache = InMemoryCache(max_bytes=100, sizeof=lambda key, value: len(value))
+        cache.set("a", "x" * 60, 60)
+        cache.set("b", "y" * 60, 60)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 60)
+        # An entry larger than the limit is not kept at all
+        cache.set("c", "z" * 200, 60)
+        self.assertIsNone(cache.get("c"))
+
+    def test_expired_entries_are_dropped_before_evicting(self):
+        """Test that expired entries free room without counting as evictions"""
+        cache = InMemoryCache(max_entries=2)
+        cache.set("short", 1, 0.05)
+        cache.set("long", 2, 60)
+        time.sleep(0.06)
+        cache.set("new", 3, 60)
+        self.assertEqual(cache.get("long"), 2)
+        stats = cache.stats()
+        self.assertEqual((stats["evictions"], stats["expirations"]), (0, 1))
+
+    def test_overwritten_keys_keep_latest_expiry(self):
+        """Test that stale expiry heap items don't remove newer values"""
+        cache = InMemoryCache()
+        cache.set("key", "old", 0.05)
+        cache.set("key", "new", 60)
+        time.sleep(0.06)
+        cache._cleanup_expired()
+        self.assertEqual(cache.get("key"), "new")
+
+    def test_stats(self):
+        """Test hit and miss counters"""
+        cache = InMemoryCache()
+        cache.set("key", "value", 60)
+        cache.get("key")
+        cache.get("missing")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_unknown_eviction_policy(self):
+        """Test that an unknown eviction policy is rejected"""
+        with self.assertRaises(ValueError):
+            InMemoryCache(eviction="fifo")
+
+
+class TestShardedCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = ShardedCache(shards=4, cleanup_interval=None)
+
+    def test_operations(self):
+        """Test that the sharded cache mirrors the InMemoryCache API"""
+        self.cache.set("a", 1, 60)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertTrue(self.cache.add("b", 0, 60))
+        self.assertFalse(self.cache.add("b", 5, 60))
+        self.assertEqual(self.cache.incr("b", 2), 2)
+        self.assertEqual(self.cache.pop("b"), 2)
+        self.cache.delete("a")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lock_free_reads_respect_expiry(self):
+        """Test that the lock-free read path never returns expired entries"""
+        self.cache.set("short", "value", 0.05)
+        self.assertEqual(self.cache.get("short"), "value")
+        time.sleep(0.06)
+        self.assertIsNone(self.cache.get("short"))
+
+    def test_limits_are_split_across_shards(self):
+        """Test that max_entries bounds the total size"""
+        cache = ShardedCache(shards=4, max_entries=40, cleanup_interval=None)
+        for i in range(200):
+            cache.set(f"key-{i}", i, 60)
+        self.assertLessEqual(len(cache), 40)
+        self.assertEqual(cache.stats()["evictions"], 200 - len(cache))
+
+    def test_lru_with_lock_free_reads(self):
+        """Test that hits on the lock-free path still count as recent use"""
+        cache = InMemoryCache(max_entries=2, lock_free_reads=True, cleanup_interval=None)
+        cache.set("a", 1, 60)
+        cache.set("b", 2, 60)
+        cache.get("a")
+        cache.set("c", 3, 60)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_set_memory_cache(self):
+        """Test replacing the global cache"""
+        original = get_memory_cache()
+        try:
+            set_memory_cache(self.cache)
+            self.assertIs(get_memory_cache(), self.cache)
+        finally:
+            set_memory_cache(original)
+
+
 if __name__ == '__main__':
     unittest.main()
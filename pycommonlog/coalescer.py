@@ -0,0 +1,156 @@
+"""
+Alert coalescing for commonlog
+"""
+import logging
+import threading
+import time
+import weakref
+
+
+class _Bucket:
+    __slots__ = ("first_time", "deadline", "count", "samples", "omitted", "attachment", "emit")
+
+    def __init__(self, deadline, emit):
+        self.first_time = time.monotonic()
+        self.deadline = deadline
+        self.count = 0
+        self.samples = {}  # distinct message body -> occurrences, in arrival order
+        self.omitted = 0   # alerts whose body did not fit in samples
+        self.attachment = None
+        self.emit = emit
+
+
+class AlertCoalescer:
+    """
+    Buffers alerts per key, typically (provider, channel, level), and emits
+    one combined message per key when the window elapses or max_count alerts
+    have been buffered.
+
+    emit callbacks are invoked as emit(message, attachment) on the coalescer's
+    flusher thread, or on the caller's thread for flush()/close().
+    """
+
+    def __init__(self, window=5.0, max_count=100, max_samples=5):
+        self.window = window
+        self.max_count = max(1, int(max_count))
+        self.max_samples = max(1, int(max_samples))
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+
+        _live_coalescers.add(self)
+
+    def add(self, key, message, attachment, emit):
+        """
+        Buffer an alert.
+
+        Args:
+            key: Hashable coalescing key
+            message: Alert message body
+            attachment: Optional Attachment; the first one seen in a window is kept
+            emit: Callable(message, attachment) that delivers the combined alert
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("coalescer is closed")
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = _Bucket(time.monotonic() + self.window, emit)
+                self._buckets[key] = bucket
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name="commonlog-coalescer", daemon=True)
+                    self._thread.start()
+                self._wakeup.notify()
+
+            bucket.count += 1
+            if message in bucket.samples:
+                bucket.samples[message] += 1
+            elif len(bucket.samples) < self.max_samples:
+                bucket.samples[message] = 1
+            else:
+                bucket.omitted += 1
+            if bucket.attachment is None and attachment is not None:
+                bucket.attachment = attachment
+
+            if bucket.count >= self.max_count:
+                bucket.deadline = 0
+                self._wakeup.notify()
+
+    def pending(self):
+        """Number of alerts currently buffered"""
+        with self._lock:
+            return sum(bucket.count for bucket in self._buckets.values())
+
+    def flush(self):
+        """Emit every buffered bucket immediately on the calling thread"""
+        with self._lock:
+            buckets = list(self._buckets.values())
+            self._buckets.clear()
+        for bucket in buckets:
+            self._emit(bucket)
+
+    def close(self):
+        """Emit every buffered bucket and stop the flusher thread"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self.flush()
+        _live_coalescers.discard(self)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                due = []
+                while not due:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    next_deadline = None
+                    for key, bucket in list(self._buckets.items()):
+                        if bucket.deadline <= now:
+                            due.append(self._buckets.pop(key))
+                        elif next_deadline is None or bucket.deadline < next_deadline:
+                            next_deadline = bucket.deadline
+                    if not due:
+                        self._wakeup.wait(None if next_deadline is None else next_deadline - now)
+            for bucket in due:
+                self._emit(bucket)
+
+    def _emit(self, bucket):
+        message, attachment = self.render(bucket)
+        try:
+            bucket.emit(message, attachment)
+        except Exception as e:
+            logging.error(f"Failed to send alert: {e}")
+
+    def render(self, bucket):
+        """Return (message, attachment) for a bucket"""
+        if bucket.count == 1:
+            message = next(iter(bucket.samples))
+            return message, bucket.attachment
+
+        elapsed = time.monotonic() - bucket.first_time
+        lines = [f"[{bucket.count} alerts in {elapsed:.1f}s]"]
+        for body, occurrences in bucket.samples.items():
+            if occurrences > 1:
+                lines.append(f"- ({occurrences}x) {body}")
+            else:
+                lines.append(f"- {body}")
+        if bucket.omitted:
+            lines.append(f"...and {bucket.omitted} more")
+        return "\n".join(lines), bucket.attachment
+
+
+# Emit buffered alerts on interpreter exit, see logger._close_at_exit
+_live_coalescers = weakref.WeakSet()
+
+
+def _flush_at_exit():
+    for coalescer in list(_live_coalescers):
+        try:
+            coalescer.close()
+        except Exception:
+            pass
+
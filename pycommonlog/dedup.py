@@ -0,0 +1,242 @@
+"""
+Alert deduplication for commonlog
+"""
+import collections
+import hashlib
+import logging
+import re
+import threading
+import time
+import weakref
+
+from pycommonlog.cache import InMemoryCache
+from pycommonlog.providers.redis_client import get_redis_client
+
+_HEX_ID = re.compile(r"\b(?:0x)?[0-9a-f]{8,}\b", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+
+TRACE_HEAD_LINES = 3
+# Counters outlive the suppression window a little so its owner can still read them
+RELEASE_GRACE_SECONDS = 60
+
+
+def normalize_message(message):
+    """
+    Normalize a message so alerts that only differ in ids, numbers or
+    whitespace share a fingerprint.
+    """
+    message = _HEX_ID.sub("<id>", message)
+    message = _NUMBER.sub("<n>", message)
+    return _WHITESPACE.sub(" ", message).strip()
+
+
+def fingerprint(level, channel, message, trace=""):
+    """
+    Fingerprint of (level, channel, normalized message, trace head).
+    """
+    trace_head = ""
+    if trace:
+        trace_head = "\n".join(trace.strip().splitlines()[:TRACE_HEAD_LINES])
+    raw = "\x1f".join((str(level), str(channel), normalize_message(message), trace_head))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryDedupBackend:
+    """
+    Repeat counters in a private InMemoryCache.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache if cache is not None else InMemoryCache()
+
+    def check(self, key, ttl):
+        """
+        Return True for the first occurrence of key, otherwise count the repeat.
+
+        The counter lives until release() is called by the window's owner.
+        """
+        while True:
+            if self.cache.add(key, 0, ttl + RELEASE_GRACE_SECONDS):
+                return True
+            if self.cache.incr(key) is not None:
+                return False
+            # Expired between add and incr, try to claim it again
+
+    def release(self, key):
+        """Forget key and return the number of suppressed repeats"""
+        return int(self.cache.pop(key) or 0)
+
+
+class RedisDedupBackend:
+    """
+    Repeat counters in Redis so replicas share suppression state.
+
+    Falls back to a MemoryDedupBackend while Redis is unavailable.
+    """
+
+    KEY_PREFIX = "commonlog_dedup:"
+    # Claim or count in one step: with a separate INCR, a release() deleting
+    # the key in between would recreate it without a TTL
+    CHECK_SCRIPT = """
+if redis.call('SET', KEYS[1], 0, 'NX', 'EX', ARGV[1]) then
+    return 1
+end
+redis.call('INCR', KEYS[1])
+return 0
+"""
+
+    def __init__(self, config, fallback=None):
+        self.config = config
+        self.fallback = fallback or MemoryDedupBackend()
+
+    def check(self, key, ttl):
+        redis_key = self.KEY_PREFIX + key
+        try:
+            client = get_redis_client(self.config)
+            return bool(int(client.eval(self.CHECK_SCRIPT, 1, redis_key, int(ttl) + RELEASE_GRACE_SECONDS)))
+        except Exception:
+            return self.fallback.check(key, ttl)
+
+    def release(self, key):
+        redis_key = self.KEY_PREFIX + key
+        try:
+            client = get_redis_client(self.config)
+            pipe = client.pipeline()
+            pipe.get(redis_key)
+            pipe.delete(redis_key)
+            count, _ = pipe.execute()
+            return int(count or 0) + self.fallback.release(key)
+        except Exception:
+            return self.fallback.release(key)
+
+
+class _Entry:
+    __slots__ = ("expiry", "message", "emit")
+
+    def __init__(self, expiry, message, emit):
+        self.expiry = expiry
+        self.message = message
+        self.emit = emit
+
+
+class AlertDeduplicator:
+    """
+    Suppresses repeats of an alert within a TTL and emits a
+    "repeated N times" summary once the window expires.
+
+    Only fingerprints first seen by this process are tracked locally, at most
+    max_entries of them; when the limit is hit the oldest window is closed
+    early, so a storm of unique messages cannot grow memory without bound.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000, backend=None):
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self.backend = backend or MemoryDedupBackend()
+        # fingerprint -> _Entry; the TTL is constant, so insertion order is expiry order
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._closed = False
+
+        _live_deduplicators.add(self)
+
+    def should_send(self, level, channel, message, trace, emit_summary):
+        """
+        Decide whether an alert should be sent.
+
+        Args:
+            level: Alert level
+            channel: Target channel
+            message: Alert message
+            trace: Optional trace text, only its first lines are fingerprinted
+            emit_summary: Callable(message) used to deliver the repeat summary
+
+        Returns:
+            True for the first occurrence within the TTL, False for a suppressed repeat
+        """
+        key = fingerprint(level, channel, message, trace)
+        if not self.backend.check(key, self.ttl):
+            return False
+
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                # Window was re-opened after its counter expired in the backend
+                self._entries.pop(key)
+            while len(self._entries) >= self.max_entries:
+                evicted.append(self._entries.popitem(last=False))
+            self._entries[key] = _Entry(time.monotonic() + self.ttl, message, emit_summary)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._worker, name="commonlog-dedup", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+        for evicted_key, entry in evicted:
+            self._summarize(evicted_key, entry)
+        return True
+
+    def tracked(self):
+        """Number of fingerprints with an open suppression window"""
+        with self._lock:
+            return len(self._entries)
+
+    def flush(self):
+        """Close every open window now, emitting summaries for suppressed repeats"""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries.clear()
+        for key, entry in entries:
+            self._summarize(key, entry)
+
+    def close(self):
+        """Emit pending summaries and stop the sweeper thread"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self.flush()
+        _live_deduplicators.discard(self)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                expired = []
+                while not expired:
+                    if self._closed:
+                        return
+                    now = time.monotonic()
+                    while self._entries:
+                        key, entry = next(iter(self._entries.items()))
+                        if entry.expiry > now:
+                            break
+                        self._entries.popitem(last=False)
+                        expired.append((key, entry))
+                    if not expired:
+                        timeout = None
+                        if self._entries:
+                            timeout = next(iter(self._entries.values())).expiry - now
+                        self._wakeup.wait(timeout)
+            for key, entry in expired:
+                self._summarize(key, entry)
+
+    def _summarize(self, key, entry):
+        try:
+            repeats = self.backend.release(key)
+            if repeats > 0:
+                entry.emit(f"{entry.message}\n(repeated {repeats} times in the last {self.ttl}s)")
+        except Exception as e:
+            logging.error(f"Failed to send alert: {e}")
+
+
+# Emit pending repeat summaries on interpreter exit, see logger._close_at_exit
+_live_deduplicators = weakref.WeakSet()
+
+
+def _flush_at_exit():
+    for deduplicator in list(_live_deduplicators):
+        try:
+            deduplicator.close()
+        except Exception:
+            pass
+
@@ -0,0 +1,187 @@
+"""
+Background dispatch queue for commonlog
+"""
+import collections
+import logging
+import threading
+import time
+import weakref
+
+
+class OverflowPolicy:
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+
+
+class DispatcherClosedError(Exception):
+    pass
+
+
+class BackgroundDispatcher:
+    """
+    Bounded in-process queue drained by worker threads.
+
+    Callers only pay for an enqueue; the actual provider call runs on one of
+    the worker threads. Worker threads are started on the first submit.
+    on_drop(func, args, kwargs), if given, is called for every task the
+    overflow policy discards.
+    """
+
+    def __init__(self, max_queue_size=1000, workers=1, overflow_policy=OverflowPolicy.BLOCK, block_timeout=None, on_drop=None):
+        if overflow_policy not in (OverflowPolicy.BLOCK, OverflowPolicy.DROP_OLDEST, OverflowPolicy.DROP_NEWEST):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.max_queue_size = max(1, int(max_queue_size))
+        self.workers = max(1, int(workers))
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.on_drop = on_drop
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0  # queued + in-flight tasks
+        self._dropped = 0
+        self._closed = False
+        self._threads = []
+
+        _live_dispatchers.add(self)
+
+    @property
+    def dropped(self):
+        """Number of tasks discarded because the queue was full"""
+        return self._dropped
+
+    def qsize(self):
+        with self._lock:
+            return len(self._queue)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Enqueue func(*args, **kwargs) for a worker thread.
+
+        Returns:
+            True if the task was queued, False if it was dropped by the overflow policy
+        """
+        task = (func, args, kwargs)
+        dropped = None
+        try:
+            with self._lock:
+                if self._closed:
+                    raise DispatcherClosedError("dispatcher is closed")
+                if not self._threads:
+                    self._start_workers()
+
+                if len(self._queue) >= self.max_queue_size:
+                    if self.overflow_policy == OverflowPolicy.DROP_NEWEST:
+                        self._dropped += 1
+                        dropped = task
+                        return False
+                    elif self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                        dropped = self._queue.popleft()
+                        self._dropped += 1
+                        self._task_done()
+                    else:
+                        deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+                        while len(self._queue) >= self.max_queue_size:
+                            remaining = None if deadline is None else deadline - time.monotonic()
+                            if remaining is not None and remaining <= 0:
+                                self._dropped += 1
+                                dropped = task
+                                return False
+                            self._not_full.wait(remaining)
+                            if self._closed:
+                                raise DispatcherClosedError("dispatcher is closed")
+
+                self._queue.append(task)
+                self._unfinished += 1
+                self._not_empty.notify()
+                return True
+        finally:
+            # Outside the lock, so the callback may do its own locking
+            if dropped is not None and self.on_drop is not None:
+                self.on_drop(*dropped)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued task has been processed.
+
+        Args:
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            True if the queue drained, False if the timeout elapsed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._all_done.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Stop accepting tasks, drain the queue and stop the worker threads.
+
+        Returns:
+            True if the queue drained before the timeout
+        """
+        with self._lock:
+            already_closed = self._closed
+            self._closed = True
+        drained = self.flush(timeout)
+        if not already_closed:
+            with self._lock:
+                self._not_empty.notify_all()
+                self._not_full.notify_all()
+            _live_dispatchers.discard(self)
+        return drained
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"commonlog-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _task_done(self):
+        # Must be called with self._lock held
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._all_done.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    if self._closed:
+                        return
+                    self._not_empty.wait()
+                func, args, kwargs = self._queue.popleft()
+                self._not_full.notify()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Failed to send alert: {e}")
+            finally:
+                with self._lock:
+                    self._task_done()
+
+
+# Drain live dispatchers on interpreter exit so queued alerts are not lost,
+# see logger._close_at_exit
+_live_dispatchers = weakref.WeakSet()
+ATEXIT_DRAIN_TIMEOUT = 5.0
+
+
+def _drain_at_exit():
+    for dispatcher in list(_live_dispatchers):
+        try:
+            dispatcher.close(timeout=ATEXIT_DRAIN_TIMEOUT)
+        except Exception:
+            pass
+
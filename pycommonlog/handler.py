@@ -0,0 +1,173 @@
+"""
+logging.Handler that routes stdlib log records to commonlog
+"""
+import copy
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import weakref
+
+from pycommonlog.log_types import AlertLevel
+
+DEFAULT_LEVEL_MAP = {
+    logging.WARNING: AlertLevel.WARN,
+    logging.ERROR: AlertLevel.ERROR,
+}
+DEFAULT_QUEUE_SIZE = 1000
+_DEFAULT_FORMATTER = logging.Formatter()
+
+# Set on the listener thread while it sends, so records logged by commonlog
+# itself (e.g. "Failed to send alert") are not fed back into the handler
+_delivering = threading.local()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room instead of failing when stop() is called on a full queue
+        self.queue.put(self._sentinel)
+
+
+class _Sink:
+    """Listener-side target: formats records and sends them, off the logging thread"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def handle(self, record):
+        _delivering.active = True
+        try:
+            self.handler.deliver(record)
+        except Exception:
+            # commonlog has already logged the failure
+            self.handler.failed += 1
+        finally:
+            _delivering.active = False
+
+
+class CommonlogHandler(logging.Handler):
+    """
+    Sends WARNING and higher log records as commonlog alerts.
+
+    emit() runs the handler's filters and the sampling check, then puts the
+    raw record on a bounded queue; formatting, the traceback and the
+    provider call all happen on a listener thread started on the first
+    record. A full queue drops the record (counted in dropped) instead of
+    blocking the application. close() drains the queue; at interpreter exit
+    commonlog closes live handlers itself, before its dispatchers, coalescers
+    and spools shut down (logging.shutdown() would run too late).
+
+    Record arguments are formatted on the listener thread, so objects
+    passed as arguments should not be mutated after logging them.
+    """
+
+    def __init__(self, logger, level=logging.WARNING, level_map=None, channel=None, sample_rate=1.0, sample_rates=None, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            logger: commonlog instance used to send alerts
+            level_map: {stdlib level: AlertLevel}; a record maps to the entry
+                with the highest level not above its own
+            channel: Send every alert to this channel instead of the one
+                resolved for its level
+            sample_rate: Fraction of records sent, 1.0 sends all
+            sample_rates: {stdlib level: fraction} overriding sample_rate per level
+            queue_size: Maximum records waiting for the listener thread
+        """
+        super().__init__(level)
+        self.logger = logger
+        self.level_map = sorted((level_map or DEFAULT_LEVEL_MAP).items(), reverse=True)
+        self.channel = channel
+        self.sample_rate = sample_rate
+        self.sample_rates = sample_rates or {}
+        self.queue = queue.Queue(max(1, int(queue_size)))
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed = 0
+        self._listener = None
+        self._listener_lock = threading.Lock()
+        _live_handlers.add(self)
+
+    def alert_level(self, levelno):
+        for threshold, alert_level in self.level_map:
+            if levelno >= threshold:
+                return alert_level
+        return AlertLevel.INFO
+
+    def _sampled(self, record):
+        rate = self.sample_rates.get(record.levelno, self.sample_rate)
+        if rate >= 1:
+            return True
+        return rate > 0 and random.random() < rate
+
+    def _ensure_listener(self):
+        if self._listener is None:
+            with self._listener_lock:
+                if self._listener is None:
+                    listener = _Listener(self.queue, _Sink(self))
+                    listener.start()
+                    self._listener = listener
+
+    def emit(self, record):
+        if getattr(_delivering, "active", False) or (record.threadName or "").startswith("commonlog-"):
+            return
+        if not self._sampled(record):
+            self.sampled_out += 1
+            return
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def render(self, record):
+        """
+        Returns:
+            (message, trace): the formatted record without its traceback,
+            and the traceback plus stack info ("" if there is none)
+        """
+        formatter = self.formatter or _DEFAULT_FORMATTER
+        parts = []
+        if record.exc_info:
+            parts.append(formatter.formatException(record.exc_info))
+        elif record.exc_text:
+            parts.append(record.exc_text)
+        if record.stack_info:
+            parts.append(formatter.formatStack(record.stack_info))
+        # Other handlers may still be using the record, so strip the copy
+        record = copy.copy(record)
+        record.exc_info = record.exc_text = record.stack_info = None
+        return self.format(record), "\n".join(parts)
+
+    def deliver(self, record):
+        message, trace = self.render(record)
+        level = self.alert_level(record.levelno)
+        if self.channel:
+            self.logger.send_to_channel(level, message, trace=trace, channel=self.channel)
+        else:
+            self.logger.send(level, message, trace=trace)
+
+    def flush(self):
+        """Wait until every queued record has been sent"""
+        if self._listener is not None:
+            self.queue.join()
+
+    def close(self):
+        with self._listener_lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.stop()
+        _live_handlers.discard(self)
+        super().close()
+
+
+# Drain handler queues on interpreter exit, see logger._close_at_exit
+_live_handlers = weakref.WeakSet()
+
+
+def _close_at_exit():
+    for handler in list(_live_handlers):
+        try:
+            handler.close()
+        except Exception:
+            pass
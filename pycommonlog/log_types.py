@@ -60,20 +60,95 @@ class Config:
         if self.lark_token and (self.lark_token.app_id or self.lark_token.app_secret):
             self.provider_config["lark_token"] = self.lark_token
 
+_UNSET = object()
+
+class SendContext:
+    """
+    Immutable per-alert view of a Config.
+
+    Holds the channel a single alert goes to and reads every other setting
+    from the wrapped Config, so providers get a config-like object without
+    anyone mutating the shared Config. Safe to share between threads.
+    """
+    __slots__ = ("config", "channel")
+
+    def __init__(self, config, channel=_UNSET):
+        if channel is _UNSET:
+            channel = config.channel
+        if isinstance(config, SendContext):
+            config = config.config
+        object.__setattr__(self, "config", config)
+        object.__setattr__(self, "channel", channel)
+
+    def __getattr__(self, name):
+        if name == "config":
+            raise AttributeError(name)
+        return getattr(self.config, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"SendContext is immutable, cannot set '{name}'")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"SendContext is immutable, cannot delete '{name}'")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (SendContext, (self.config, self.channel))
+
+    def __repr__(self):
+        return f"SendContext(channel={self.channel!r}, provider={self.config.provider!r})"
+
 class Provider(ABC):
     @abstractmethod
     def send_to_channel(self, level, message, attachment, config, channel):
+        """
+        Returns:
+            None once sent, or a concurrent.futures.Future if delivery was
+            deferred (e.g. a rate-limited alert scheduled for a resend)
+        """
         pass
 
 # Debug logging
 import logging
+import threading
 
 debug_logger = logging.getLogger('commonlog.debug')
-debug_logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-handler.setFormatter(logging.Formatter('[COMMONLOG DEBUG] %(filename)s:%(lineno)d - %(message)s'))
-debug_logger.addHandler(handler)
+# Installed on the first debug message, so importing commonlog doesn't touch logging
+_debug_handler = None
+_debug_handler_lock = threading.Lock()
+
+def _install_debug_handler():
+    global _debug_handler
+    with _debug_handler_lock:
+        if _debug_handler is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('[COMMONLOG DEBUG] %(filename)s:%(lineno)d - %(message)s'))
+            debug_logger.setLevel(logging.DEBUG)
+            debug_logger.addHandler(handler)
+            _debug_handler = handler
+
+def debug_enabled(config):
+    """Cheap guard for debug instrumentation that is costly to prepare"""
+    return bool(getattr(config, 'debug', False))
 
 def debug_log(config, message, *args):
-    if hasattr(config, 'debug') and config.debug:
-        debug_logger.debug(message, *args)
\ No newline at end of file
+    """
+    Log a debug message when config.debug is set.
+
+    Formatting is deferred: pass %-style args (``debug_log(config, "sent %s", x)``)
+    or a zero-argument callable returning the message, so nothing is built
+    or serialized while debug is off.
+    """
+    if not debug_enabled(config):
+        return
+    if _debug_handler is None:
+        _install_debug_handler()
+    if callable(message):
+        message = message()
+    # stacklevel=2 reports the caller's file and line rather than this function
+    debug_logger.debug(message, *args, stacklevel=2)
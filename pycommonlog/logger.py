@@ -1,18 +1,55 @@
 """
 Main logger for commonlog
 """
+import atexit
+import functools
 import logging
+import threading
+import time
 
-from pycommonlog.providers import SlackProvider, LarkProvider
-from pycommonlog.log_types import AlertLevel, Attachment, debug_log
+from pycommonlog.providers.registry import create_provider, get_provider
+from pycommonlog.providers.ratelimit import RateLimitedError, get_resend_scheduler
+from pycommonlog.providers.retry import is_retryable
+from pycommonlog.log_types import AlertLevel, Attachment, SendContext, debug_log
+from pycommonlog.dispatcher import BackgroundDispatcher, OverflowPolicy
+from pycommonlog.coalescer import AlertCoalescer
+from pycommonlog import coalescer as _coalescer, dedup as _dedup, dispatcher as _dispatcher, handler as _handler, spool as _spool
+from pycommonlog.providers import ratelimit as _ratelimit
+from pycommonlog.trace import TRACE_SEPARATOR
+from pycommonlog.spool import AlertSpool, SpoolReplayer, encode_alert, decode_attachment, DEFAULT_SEGMENT_BYTES, DEFAULT_MAX_BYTES, DEFAULT_REPLAY_INTERVAL, DEFAULT_FSYNC_INTERVAL, DEFAULT_MAX_ATTEMPTS
+from pycommonlog.broadcast import Broadcaster, BroadcastReport, BroadcastTarget, DEFAULT_BROADCAST_WORKERS
+from pycommonlog.metrics import configure_metrics, metrics_enabled, measure_send
+from pycommonlog.tracing import configure_tracing, tracing_enabled, current_context, traced_send
+from pycommonlog.dedup import AlertDeduplicator, MemoryDedupBackend, RedisDedupBackend
 
 # ====================
 # Configuration and Logger
 # ====================
 
+def _replay_retryable(error):
+    # The client-side rate limiter raises without a status code, but a later replay will get through
+    return isinstance(error, RateLimitedError) or is_retryable(error)
+
+
+def attach_trace(attachment, trace):
+    """
+    Attach a trace to an alert, creating a trace.log attachment or appending
+    to the content of an existing one.
+    """
+    if attachment is None:
+        return Attachment(content=trace, file_name="trace.log")
+    # If there's already an attachment, combine the trace content in a single copy;
+    # truncation to trace_max_bytes happens when the provider formats the message
+    if attachment.content:
+        attachment.content = "".join((attachment.content, TRACE_SEPARATOR, trace))
+    else:
+        attachment.content = trace
+        attachment.file_name = "trace.log"
+    return attachment
+
 class commonlog:
     def send_to_channel(self, level, message, attachment=None, trace="", channel=None):
-        debug_log(self.config, f"send_to_channel called with level: {level}, message length: {len(message)}, channel: {channel}, has attachment: {attachment is not None}, has trace: {bool(trace)}")
+        debug_log(self.config, "send_to_channel called with level: %s, message length: %s, channel: %s, has attachment: %s, has trace: %s", level, len(message), channel, attachment is not None, bool(trace))
         
         if level == AlertLevel.INFO:
             logging.info(message)
@@ -22,48 +59,37 @@ class commonlog:
             # Use provided channel or fallback to resolved channel
             target_channel = channel if channel else self._resolve_channel(level)
             if channel is None:
-                debug_log(self.config, f"Resolved channel using resolver: {target_channel}")
+                debug_log(self.config, "Resolved channel using resolver: %s", target_channel)
             else:
-                debug_log(self.config, f"Using provided channel: {target_channel}")
+                debug_log(self.config, "Using provided channel: %s", target_channel)
             
-            original_channel = self.config.channel
-            self.config.channel = target_channel
+            if self._is_duplicate(self.provider_name, self.provider, level, message, trace, target_channel, channel_api=True):
+                debug_log(self.config, "Duplicate alert suppressed")
+                return
             if trace:
-                debug_log(self.config, f"Processing trace attachment, trace length: {len(trace)}")
-                if attachment is None:
-                    attachment = Attachment(content=trace, file_name="trace.log")
-                    debug_log(self.config, "Created new trace attachment")
-                else:
-                    if attachment.content:
-                        attachment.content += "\n\n--- Trace Log ---\n" + trace
-                        debug_log(self.config, "Appended trace to existing attachment content")
-                    else:
-                        attachment.content = trace
-                        attachment.file_name = "trace.log"
-                        debug_log(self.config, "Set trace as attachment content")
+                debug_log(self.config, "Processing trace attachment, trace length: %s", len(trace))
+                attachment = attach_trace(attachment, trace)
             
-            debug_log(self.config, f"Calling provider.send_to_channel with resolved channel: {target_channel}")
-            self.provider.send_to_channel(level, message, attachment, self.config, target_channel)
-            self.config.channel = original_channel
+            if self._defer(self.provider_name, self.provider, level, message, attachment, target_channel, channel_api=True):
+                debug_log(self.config, "Deferred provider.send_to_channel, channel: %s", target_channel)
+                return
+            debug_log(self.config, "Calling provider.send_to_channel with resolved channel: %s", target_channel)
+            self._deliver(self.provider_name, self.provider, level, target_channel, True, message, attachment)
             debug_log(self.config, "Provider send_to_channel completed successfully")
         except Exception as e:
-            debug_log(self.config, f"Provider send_to_channel failed: {e}")
+            debug_log(self.config, "Provider send_to_channel failed: %s", e)
             logging.error(f"Failed to send alert: {e}")
             raise
 
     def custom_send(self, provider, level, message, attachment=None, trace="", channel=None):
-        debug_log(self.config, f"custom_send called with custom provider: {provider}, level: {level}, message length: {len(message)}")
+        debug_log(self.config, "custom_send called with custom provider: %s, level: %s, message length: %s", provider, level, len(message))
         
-        if provider == "slack":
-            custom_provider = SlackProvider()
-        elif provider == "lark":
-            custom_provider = LarkProvider()
+        # Reuse warm provider instances (transport, caches, rate limiter) across calls
+        if provider == self.provider_name:
+            custom_provider = self.provider
         else:
-            logging.warning(f"Unknown provider: {provider}, defaulting to Slack")
-            custom_provider = SlackProvider()
-            debug_log(self.config, f"Unknown provider '{provider}', defaulted to slack")
-        
-        debug_log(self.config, f"Created custom provider: {provider}")
+            custom_provider = get_provider(provider, self.config)
+        debug_log(self.config, "Using custom provider: %s", provider)
 
         if level == AlertLevel.INFO:
             logging.info(message)
@@ -72,41 +98,286 @@ class commonlog:
         try:
             # Use provided channel or fallback to resolved channel
             target_channel = channel if channel else self._resolve_channel(level)
-            debug_log(self.config, f"Resolved channel for custom send: {target_channel}")
+            debug_log(self.config, "Resolved channel for custom send: %s", target_channel)
             
-            original_channel = self.config.channel
-            self.config.channel = target_channel
+            if self._is_duplicate(provider, custom_provider, level, message, trace, target_channel):
+                debug_log(self.config, "Duplicate alert suppressed for custom send")
+                return
             if trace:
-                debug_log(self.config, f"Processing trace for custom send, trace length: {len(trace)}")
-                if attachment is None:
-                    attachment = Attachment(content=trace, file_name="trace.log")
-                else:
-                    if attachment.content:
-                        attachment.content += "\n\n--- Trace Log ---\n" + trace
-                    else:
-                        attachment.content = trace
-                        attachment.file_name = "trace.log"
-            debug_log(self.config, f"Calling custom provider.send with provider: {provider}, channel: {target_channel}")
-            custom_provider.send(level, message, attachment, self.config)
-            self.config.channel = original_channel
+                debug_log(self.config, "Processing trace for custom send, trace length: %s", len(trace))
+                attachment = attach_trace(attachment, trace)
+            if self._defer(provider, custom_provider, level, message, attachment, target_channel):
+                debug_log(self.config, "Deferred custom provider.send, provider: %s, channel: %s", provider, target_channel)
+                return
+            debug_log(self.config, "Calling custom provider.send with provider: %s, channel: %s", provider, target_channel)
+            self._deliver(provider, custom_provider, level, target_channel, False, message, attachment)
             debug_log(self.config, "Custom provider send completed successfully")
         except Exception as e:
-            debug_log(self.config, f"Custom provider send failed: {e}")
+            debug_log(self.config, "Custom provider send failed: %s", e)
             logging.error(f"Failed to send alert: {e}")
             raise
 
+    def broadcast(self, level, message, targets, attachment=None, trace="", timeout=None):
+        """
+        Send one alert to several targets concurrently.
+
+        Every target is attempted even if others fail; failures are logged
+        and reported instead of raised. Dedup, coalescing and background
+        dispatch do not apply.
+
+        Args:
+            targets: "#channel" strings (logger's provider), (provider, channel)
+                tuples or BroadcastTarget objects; a None channel is resolved
+                from the alert level
+            timeout: Overall deadline in seconds, defaults to
+                provider_config["broadcast_timeout"] (no deadline if unset)
+
+        Returns:
+            BroadcastReport with one BroadcastResult per target
+        """
+        debug_log(self.config, "broadcast called with level: %s, message length: %s, targets: %s", level, len(message), len(targets))
+        if level == AlertLevel.INFO:
+            logging.info(message)
+            return BroadcastReport([])
+        if trace:
+            attachment = attach_trace(attachment, trace)
+        if timeout is None:
+            timeout = self.config.provider_config.get("broadcast_timeout")
+        report = self._get_broadcaster().run(self._broadcast_deliveries(level, targets), level, message, attachment, self.config, timeout)
+        debug_log(self.config, "broadcast finished: %s", report)
+        return report
+
+    def _broadcast_deliveries(self, level, targets):
+        deliveries = []
+        for target in targets:
+            target = BroadcastTarget.of(target)
+            if target.provider is None or target.provider == self.provider_name:
+                provider = self.provider
+            else:
+                provider = get_provider(target.provider, self.config)
+            deliveries.append((target, provider, target.channel or self._resolve_channel(level)))
+        return deliveries
+
+    def _get_broadcaster(self):
+        if self._broadcaster is None:
+            with self._broadcaster_lock:
+                if self._broadcaster is None:
+                    self._broadcaster = Broadcaster(self.config.provider_config.get("broadcast_workers", DEFAULT_BROADCAST_WORKERS))
+        return self._broadcaster
+
     def __init__(self, config):
         self.config = config
         provider_name = config.provider_config.get("provider", "slack")
-        if provider_name == "slack":
-            self.provider = SlackProvider()
-        elif provider_name == "lark":
-            self.provider = LarkProvider()
-        else:
-            logging.warning(f"Unknown provider: {provider_name}, defaulting to Slack")
-            self.provider = SlackProvider()
+        self.provider_name = provider_name
+        # Owned by this logger, so a transport injected into it stays local
+        self.provider = create_provider(provider_name)
+        # Thread pool for broadcast(), started on first use
+        self._broadcaster = None
+        self._broadcaster_lock = threading.Lock()
         
-        debug_log(config, f"Created logger with provider: {provider_name}, send method: {config.send_method}, debug: {config.debug}")
+        self.dispatcher = None
+        if config.provider_config.get("async_dispatch", False):
+            self.dispatcher = BackgroundDispatcher(
+                max_queue_size=config.provider_config.get("dispatch_queue_size", 1000),
+                workers=config.provider_config.get("dispatch_workers", 1),
+                overflow_policy=config.provider_config.get("dispatch_overflow", OverflowPolicy.BLOCK),
+                block_timeout=config.provider_config.get("dispatch_block_timeout"),
+                on_drop=self._release_dropped,
+            )
+
+        self.deduplicator = None
+        if config.provider_config.get("dedup_ttl", 0) > 0:
+            if config.provider_config.get("dedup_backend", "memory") == "redis":
+                backend = RedisDedupBackend(config)
+            else:
+                backend = MemoryDedupBackend()
+            self.deduplicator = AlertDeduplicator(
+                ttl=config.provider_config["dedup_ttl"],
+                max_entries=config.provider_config.get("dedup_max_entries", 10000),
+                backend=backend,
+            )
+
+        self.coalescer = None
+        if config.provider_config.get("coalesce_window", 0) > 0:
+            self.coalescer = AlertCoalescer(
+                window=config.provider_config["coalesce_window"],
+                max_count=config.provider_config.get("coalesce_max_count", 100),
+                max_samples=config.provider_config.get("coalesce_max_samples", 5),
+            )
+
+        configure_metrics(config)
+        configure_tracing(config)
+
+        self.spool = None
+        self._replayer = None
+        if config.provider_config.get("spool_dir"):
+            self.spool = AlertSpool(
+                config.provider_config["spool_dir"],
+                segment_bytes=config.provider_config.get("spool_segment_bytes", DEFAULT_SEGMENT_BYTES),
+                max_bytes=config.provider_config.get("spool_max_bytes", DEFAULT_MAX_BYTES),
+                fsync=config.provider_config.get("spool_fsync", True),
+                fsync_interval=config.provider_config.get("spool_fsync_interval", DEFAULT_FSYNC_INTERVAL),
+                max_attempts=config.provider_config.get("spool_max_attempts", DEFAULT_MAX_ATTEMPTS),
+            )
+            # Replays what a previous process left behind, then retries failed deliveries
+            self._replayer = SpoolReplayer(
+                self.spool,
+                self._replay_record,
+                config.provider_config.get("spool_replay_interval", DEFAULT_REPLAY_INTERVAL),
+                retryable=_replay_retryable,
+            )
+
+        debug_log(config, "Created logger with provider: %s, send method: %s, debug: %s, async dispatch: %s, coalescing: %s, dedup: %s", provider_name, config.send_method, config.debug, self.dispatcher is not None, self.coalescer is not None, self.deduplicator is not None)
+
+    def _send_context(self, channel):
+        # Each alert carries its own channel; the shared config is never mutated
+        return SendContext(self.config, channel)
+
+    def _is_duplicate(self, provider_name, provider, level, message, trace, channel, channel_api=False):
+        if self.deduplicator is None:
+            return False
+        emit_summary = functools.partial(self._send_summary, provider_name, provider, level, channel, channel_api)
+        return not self.deduplicator.should_send(level, channel, message, trace, emit_summary)
+
+    def _send_summary(self, provider_name, provider, level, channel, channel_api, message):
+        # Repeat summaries skip dedup but still go through coalescing / background dispatch
+        if not self._defer(provider_name, provider, level, message, None, channel, channel_api):
+            self._deliver(provider_name, provider, level, channel, channel_api, message, None)
+
+    def _defer(self, provider_name, provider, level, message, attachment, channel, channel_api=False):
+        """
+        Hand an alert to the coalescer or the background dispatcher.
+
+        Returns:
+            True if the alert was handed off, False if the caller must send it synchronously
+        """
+        if self.coalescer is not None:
+            emit = functools.partial(self._deliver, provider_name, provider, level, channel, channel_api)
+            self.coalescer.add((provider_name, channel, level), message, attachment, emit)
+            return True
+        if self.dispatcher is not None:
+            self._deliver(provider_name, provider, level, channel, channel_api, message, attachment)
+            return True
+        return False
+
+    def _deliver(self, provider_name, provider, level, channel, channel_api, message, attachment):
+        config = self._send_context(channel)
+        if channel_api:
+            task = (provider.send_to_channel, level, message, attachment, config, channel)
+        else:
+            task = (provider.send, level, message, attachment, config)
+        if metrics_enabled():
+            task = (measure_send, provider_name) + task
+        if tracing_enabled():
+            # Captured here so a send on a dispatch worker joins the caller's trace
+            attributes = {"commonlog.provider": provider_name, "commonlog.channel": channel, "commonlog.level": level}
+            task = (traced_send, current_context(), "commonlog.send", attributes) + task
+        if self.spool is not None:
+            # Written to disk before delivery is attempted, acked once it succeeds
+            position = self.spool.append(encode_alert(provider_name, level, message, attachment, channel, channel_api))
+            task = (self._spooled_send, position) + task
+        if self.dispatcher is None:
+            task[0](*task[1:])
+            return
+        try:
+            self.dispatcher.submit(*task)
+        except Exception:
+            if self.spool is not None:
+                self.spool.release(position)
+            raise
+
+    def _spooled_send(self, position, send, *args):
+        try:
+            deferred = send(*args)
+        except Exception:
+            self.spool.release(position)
+            raise
+        if deferred is None:
+            self.spool.ack(position)
+        else:
+            # Rate limited: the record stays in flight until the resend settles
+            deferred.add_done_callback(functools.partial(self._settle_spooled, position))
+
+    def _settle_spooled(self, position, deferred):
+        if deferred.exception() is None:
+            self.spool.ack(position)
+        else:
+            self.spool.release(position)
+
+    def _release_dropped(self, func, args, kwargs):
+        # An alert dropped by the dispatch queue stays in the spool for the replayer
+        if self.spool is not None and func == self._spooled_send:
+            self.spool.release(args[0])
+
+    def _replay_record(self, record):
+        provider_name = record["provider"]
+        provider = self.provider if provider_name == self.provider_name else get_provider(provider_name, self.config)
+        channel = record["channel"]
+        attachment = decode_attachment(record)
+        if record["channel_api"]:
+            deferred = provider.send_to_channel(record["level"], record["message"], attachment, self._send_context(channel), channel)
+        else:
+            deferred = provider.send(record["level"], record["message"], attachment, self._send_context(channel))
+        if deferred is not None:
+            # Only acked once the resend of a rate-limited alert went through
+            deferred.result()
+
+    def replay_spool(self):
+        """
+        Deliver spooled alerts that have not been delivered yet, oldest first.
+        Failed alerts are retried by later replays with backoff; those that
+        fail with a fatal error are moved to the spool's dead-letter file.
+
+        Returns:
+            Number of alerts delivered
+        """
+        if self.spool is None:
+            return 0
+        return self.spool.replay(self._replay_record, _replay_retryable)
+
+    def flush(self, timeout=None):
+        """
+        Emit pending repeat summaries and coalesced alerts, then wait for
+        queued alerts and resends of rate-limited alerts to be delivered.
+
+        Returns:
+            True if everything was delivered before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.deduplicator is not None:
+            self.deduplicator.flush()
+        if self.coalescer is not None:
+            self.coalescer.flush()
+        flushed = True if self.dispatcher is None else self.dispatcher.flush(timeout)
+        return get_resend_scheduler().flush(self._remaining(deadline)) and flushed
+
+    def close(self, timeout=None):
+        """
+        Emit pending repeat summaries and coalesced alerts, drain queued alerts
+        and resends of rate-limited alerts, and stop the background workers.
+
+        Returns:
+            True if everything was delivered before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if self.deduplicator is not None:
+            self.deduplicator.close()
+        if self.coalescer is not None:
+            self.coalescer.close()
+        if self._broadcaster is not None:
+            self._broadcaster.close(wait=False)
+        drained = True if self.dispatcher is None else self.dispatcher.close(timeout)
+        # The scheduler is shared, so it is drained but keeps running for other loggers
+        drained = get_resend_scheduler().flush(self._remaining(deadline)) and drained
+        if self.spool is not None:
+            # Whatever is still undelivered stays on disk for the next process
+            self._replayer.stop(self._remaining(deadline))
+            self.spool.close()
+        return drained
+
+    @staticmethod
+    def _remaining(deadline):
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
 
     def _resolve_channel(self, level):
         if self.config.channel_resolver:
@@ -120,26 +391,37 @@ class commonlog:
         try:
             # Resolve the channel for this alert level
             resolved_channel = self._resolve_channel(level)
+
+            # Suppress repeats of an alert already sent within the dedup TTL
+            if self._is_duplicate(self.provider_name, self.provider, level, message, trace, resolved_channel):
+                return
             
-            # Temporarily modify config with resolved channel
-            original_channel = self.config.channel
-            self.config.channel = resolved_channel
-            
-            # If trace is provided, create an attachment
+            # If trace is provided, attach it
             if trace:
-                if attachment is None:
-                    attachment = Attachment(content=trace, file_name="trace.log")
-                else:
-                    # If there's already an attachment, combine the trace content
-                    if attachment.content:
-                        attachment.content += "\n\n--- Trace Log ---\n" + trace
-                    else:
-                        attachment.content = trace
-                        attachment.file_name = "trace.log"
-            self.provider.send(level, message, attachment, self.config)
-            
-            # Restore original channel
-            self.config.channel = original_channel
+                attachment = attach_trace(attachment, trace)
+
+            # Coalescing / background dispatch: only pay for the hand-off on the caller's thread
+            if self._defer(self.provider_name, self.provider, level, message, attachment, resolved_channel):
+                return
+
+            self._deliver(self.provider_name, self.provider, level, resolved_channel, False, message, attachment)
         except Exception as e:
             logging.error(f"Failed to send alert: {e}")
-            raise
\ No newline at end of file
+            raise
+
+
+def _close_at_exit():
+    # One hook for every component, so exit runs the same steps in the same
+    # order as commonlog.close(): records queued by logging handlers are sent,
+    # summaries and coalesced alerts are emitted into the queues, the queues
+    # drain, resends run and only then are the spools that record their acks
+    # closed. It runs before logging.shutdown(), which is registered earlier.
+    _handler._close_at_exit()
+    _dedup._flush_at_exit()
+    _coalescer._flush_at_exit()
+    _dispatcher._drain_at_exit()
+    _ratelimit._drain_at_exit()
+    _spool._close_at_exit()
+
+
+atexit.register(_close_at_exit)
@@ -0,0 +1,404 @@
+"""
+Metrics for commonlog: counters, latency histograms and exporters
+"""
+import bisect
+import logging
+import socket
+import threading
+import time
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are per bucket, made cumulative on export"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return [(upper bound, cumulative count)], ending with ("+Inf", count)"""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class MetricsRegistry:
+    """
+    Thread-safe store of counters and histograms keyed by (name, labels).
+
+    Gauges are not stored: collectors registered with add_collector() are
+    called at snapshot() time and return the current values. Sinks added
+    with add_sink() see every incr/observe as it happens (e.g. StatsD).
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._sinks = []
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        for sink in self._sinks:
+            sink.incr(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        for sink in self._sinks:
+            sink.observe(name, value, labels)
+
+    def add_sink(self, sink):
+        self._sinks = self._sinks + [sink]
+
+    def remove_sink(self, sink):
+        self._sinks = [s for s in self._sinks if s is not sink]
+
+    def add_collector(self, collector):
+        """
+        Register collector() -> [(kind, name, labels, value)] with kind
+        "counter" or "gauge", called on every snapshot.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """
+        Returns:
+            {"counters": [...], "gauges": [...], "histograms": [...]} where
+            counters and gauges are {"name", "labels", "value"} and histograms
+            are {"name", "labels", "buckets": [(le, cumulative count)], "sum", "count"}
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self._counters.items()]
+            histograms = [
+                {"name": name, "labels": dict(labels), "buckets": h.cumulative(), "sum": h.sum, "count": h.count}
+                for (name, labels), h in self._histograms.items()
+            ]
+        gauges = []
+        for collector in list(self._collectors):
+            try:
+                samples = collector()
+            except Exception as e:
+                logging.warning(f"Metrics collector failed: {e}")
+                continue
+            for kind, name, labels, value in samples:
+                (counters if kind == "counter" else gauges).append({"name": name, "labels": labels, "value": value})
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+_registry = MetricsRegistry()
+# Checked before any work, so instrumentation is a global read and a return while disabled
+_enabled = False
+
+
+def enable_metrics(enabled=True):
+    """Turn recording of counters and histograms on or off for the process"""
+    global _enabled
+    _enabled = enabled
+
+
+def metrics_enabled():
+    return _enabled
+
+
+def get_metrics_registry():
+    return _registry
+
+
+def incr(name, value=1, **labels):
+    if _enabled:
+        _registry.incr(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if _enabled:
+        _registry.observe(name, value, **labels)
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(name, **labels):
+    """Context manager observing the elapsed seconds of its block into histogram name"""
+    if not _enabled:
+        return _NOOP_TIMER
+    return _Timer(name, labels)
+
+
+def measure_send(provider_name, send, *args):
+    """Call send(*args), recording its latency and outcome for provider_name"""
+    started = time.perf_counter()
+    try:
+        deferred = send(*args)
+    except Exception:
+        _record_send(provider_name, "failure", started)
+        raise
+    # A rate-limited alert handed to the resend scheduler is not delivered yet
+    _record_send(provider_name, "success" if deferred is None else "deferred", started)
+    return deferred
+
+
+async def measure_send_async(provider_name, send, *args):
+    """Coroutine version of measure_send()"""
+    started = time.perf_counter()
+    try:
+        await send(*args)
+    except Exception:
+        _record_send(provider_name, "failure", started)
+        raise
+    _record_send(provider_name, "success", started)
+
+
+def _record_send(provider_name, outcome, started):
+    _registry.observe("commonlog_send_seconds", time.perf_counter() - started, provider=provider_name)
+    _registry.incr("commonlog_alerts_total", provider=provider_name, outcome=outcome)
+
+
+def get_metrics_snapshot():
+    """Pull-style snapshot of every commonlog metric, see MetricsRegistry.snapshot"""
+    return _registry.snapshot()
+
+
+# ---- built-in collectors: state that other modules already track ----
+
+def _collect_builtin():
+    samples = []
+    from pycommonlog.providers.retry import get_retry_stats
+    for operation, counters in get_retry_stats().items():
+        for field, value in counters.items():
+            samples.append(("counter", f"commonlog_retry_{field}_total", {"operation": operation}, value))
+
+    from pycommonlog.providers.redis_client import get_redis_breaker_states
+    for target, state in get_redis_breaker_states().items():
+        samples.append(("gauge", "commonlog_redis_breaker_open", {"target": target}, 0 if state["state"] == "closed" else 1))
+        samples.append(("counter", "commonlog_redis_breaker_trips_total", {"target": target}, state["trips"]))
+        samples.append(("counter", "commonlog_redis_breaker_rejected_total", {"target": target}, state["rejected"]))
+
+    from pycommonlog import cache
+    if cache._memory_cache is not None:
+        stats = cache._memory_cache.stats()
+        for field in ("entries", "bytes"):
+            samples.append(("gauge", f"commonlog_memory_cache_{field}", {}, stats[field]))
+        for field in ("hits", "misses", "evictions", "expirations"):
+            samples.append(("counter", f"commonlog_memory_cache_{field}_total", {}, stats[field]))
+        lookups = stats["hits"] + stats["misses"]
+        samples.append(("gauge", "commonlog_memory_cache_hit_ratio", {}, stats["hits"] / lookups if lookups else 0.0))
+
+    from pycommonlog.dispatcher import _live_dispatchers
+    dispatchers = list(_live_dispatchers)
+    samples.append(("gauge", "commonlog_dispatch_queue_depth", {}, sum(d.qsize() for d in dispatchers)))
+    samples.append(("counter", "commonlog_dispatch_dropped_total", {}, sum(d.dropped for d in dispatchers)))
+
+    from pycommonlog.spool import _live_spools
+    spools = list(_live_spools)
+    if spools:
+        samples.append(("gauge", "commonlog_spool_pending", {}, sum(len(s) for s in spools)))
+        samples.append(("counter", "commonlog_spool_dropped_total", {}, sum(s.dropped for s in spools)))
+        samples.append(("counter", "commonlog_spool_dead_lettered_total", {}, sum(s.dead_lettered for s in spools)))
+    return samples
+
+
+def _collect_cache_hit_ratio():
+    lookups = hits = 0
+    with _registry._lock:
+        for (name, labels), value in _registry._counters.items():
+            if name == "commonlog_cache_lookups_total":
+                lookups += value
+                if dict(labels).get("result") in ("l1_hit", "l2_hit", "negative_hit"):
+                    hits += value
+    return [("gauge", "commonlog_cache_hit_ratio", {}, hits / lookups if lookups else 0.0)]
+
+
+_registry.add_collector(_collect_builtin)
+_registry.add_collector(_collect_cache_hit_ratio)
+
+
+# ---- exporters ----
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prometheus_labels(labels, extra=None):
+    items = list(labels.items()) + (extra or [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in items) + "}"
+
+
+def render_prometheus(snapshot=None):
+    """Render a snapshot in the Prometheus text exposition format"""
+    if snapshot is None:
+        snapshot = get_metrics_snapshot()
+    lines = []
+    typed = set()
+
+    def type_line(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for kind, key in (("counter", "counters"), ("gauge", "gauges")):
+        for sample in sorted(snapshot[key], key=lambda s: s["name"]):
+            type_line(sample["name"], kind)
+            lines.append(f"{sample['name']}{_prometheus_labels(sample['labels'])} {sample['value']}")
+    for sample in sorted(snapshot["histograms"], key=lambda s: s["name"]):
+        name = sample["name"]
+        type_line(name, "histogram")
+        for bound, count in sample["buckets"]:
+            lines.append(f"{name}_bucket{_prometheus_labels(sample['labels'], [('le', bound)])} {count}")
+        lines.append(f"{name}_sum{_prometheus_labels(sample['labels'])} {sample['sum']}")
+        lines.append(f"{name}_count{_prometheus_labels(sample['labels'])} {sample['count']}")
+    return "\n".join(lines) + "\n"
+
+
+_prometheus_servers = {}
+_prometheus_lock = threading.Lock()
+
+
+def start_prometheus_server(port, addr=""):
+    """
+    Serve render_prometheus() at http://addr:port/metrics from a daemon
+    thread. Starting the same port twice returns the running server.
+    """
+    with _prometheus_lock:
+        server = _prometheus_servers.get((addr, port))
+        if server is not None:
+            return server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="commonlog-metrics-http", daemon=True).start()
+        _prometheus_servers[(addr, port)] = server
+        return server
+
+
+class StatsDSink:
+    """
+    Pushes every counter increment and histogram observation to StatsD over
+    UDP as it happens; labels are sent as DogStatsD tags.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="commonlog", tags=True):
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.tags = tags
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def _metric_name(self, name):
+        if name.startswith("commonlog_"):
+            name = name[len("commonlog_"):]
+        return f"{self.prefix}.{name}" if self.prefix else name
+
+    def _send(self, name, value, kind, labels):
+        line = f"{self._metric_name(name)}:{value}|{kind}"
+        if self.tags and labels:
+            line += "|#" + ",".join(f"{key}:{value}" for key, value in labels.items())
+        try:
+            self._socket.sendto(line.encode("utf-8"), self.address)
+        except OSError:
+            pass  # Metrics must never break alerting
+
+    def incr(self, name, value, labels):
+        self._send(name, value, "c", labels)
+
+    def observe(self, name, value, labels):
+        self._send(name, round(value * 1000, 3), "ms", labels)
+
+    def close(self):
+        self._socket.close()
+
+
+_statsd_sinks = {}
+
+
+def configure_metrics(config):
+    """Apply the metrics settings in config.provider_config (idempotent)"""
+    provider_config = config.provider_config
+    if not provider_config.get("metrics", False):
+        return
+    enable_metrics()
+    statsd = provider_config.get("metrics_statsd")
+    if statsd:
+        with _prometheus_lock:
+            if statsd not in _statsd_sinks:
+                host, _, port = statsd.rpartition(":")
+                sink = StatsDSink(host or "127.0.0.1", port or 8125, prefix=provider_config.get("metrics_statsd_prefix", "commonlog"))
+                _statsd_sinks[statsd] = sink
+                _registry.add_sink(sink)
+    port = provider_config.get("metrics_prometheus_port")
+    if port:
+        start_prometheus_server(int(port), provider_config.get("metrics_prometheus_addr", ""))
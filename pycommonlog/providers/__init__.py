@@ -3,5 +3,37 @@ Providers package for commonlog
 """
 from .slack import SlackProvider
 from .lark import LarkProvider
+from .async_slack import AsyncSlackProvider
+from .async_lark import AsyncLarkProvider
+from .retry import RetryPolicy, ProviderHTTPError, get_retry_stats
+from .ratelimit import RateLimiter, RateLimitedError
+from .tiered_cache import TieredCache, get_tiered_cache
+from .circuit_breaker import CircuitBreaker, CircuitState, CircuitOpenError
+from .redis_client import get_redis_breaker_states
+from .registry import register_provider, get_provider, create_provider
+from .transport import HTTPTransport, AsyncHTTPTransport, get_transport, get_async_transport
 
-__all__ = ["SlackProvider", "LarkProvider"]
\ No newline at end of file
+__all__ = [
+    "SlackProvider",
+    "LarkProvider",
+    "AsyncSlackProvider",
+    "AsyncLarkProvider",
+    "HTTPTransport",
+    "AsyncHTTPTransport",
+    "get_transport",
+    "get_async_transport",
+    "RateLimiter",
+    "RateLimitedError",
+    "RetryPolicy",
+    "ProviderHTTPError",
+    "get_retry_stats",
+    "TieredCache",
+    "get_tiered_cache",
+    "CircuitBreaker",
+    "CircuitState",
+    "CircuitOpenError",
+    "get_redis_breaker_states",
+    "register_provider",
+    "get_provider",
+    "create_provider",
+]
\ No newline at end of file
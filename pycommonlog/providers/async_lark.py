@@ -0,0 +1,262 @@
+"""
+Asyncio Lark Provider for commonlog
+"""
+import asyncio
+import json
+import logging
+
+from pycommonlog.log_types import SendMethod, SendContext, debug_log
+from pycommonlog import metrics, tracing
+from pycommonlog.providers.lark import LarkProvider, TOKEN_URL, FILES_URL, RENEW_RETRY_SECONDS
+from pycommonlog.providers.transport import get_async_transport
+from pycommonlog.providers.lark_directory import get_chat_directory
+from pycommonlog.providers.retry import ProviderHTTPError, get_retry_policy
+from pycommonlog.providers.ratelimit import RateLimitedError, get_rate_limiter, check_rate_limited, send_or_resend_async
+from pycommonlog.providers.singleflight import AsyncSingleFlight
+from pycommonlog.providers.tiered_cache import get_tiered_cache
+from pycommonlog.trace import TraceUpload, should_upload_trace, utf8_length
+
+_token_flight = AsyncSingleFlight()
+# token cache key -> asyncio.TimerHandle for the next proactive renewal
+_renewals = {}
+
+class AsyncLarkProvider(LarkProvider):
+    """
+    Coroutine counterpart of LarkProvider backed by a pooled httpx.AsyncClient
+    and redis.asyncio, with the same in-memory cache fallback.
+    """
+    _sync_provider = None
+
+    def _get_transport(self, config):
+        return self.transport or get_async_transport(config)
+
+    async def send_to_channel(self, level, message, attachment, config, channel):
+        # Coroutines interleave at every await, so never mutate the shared config
+        await self.send(level, message, attachment, SendContext(config, channel))
+
+    async def cache_lark_token(self, config, app_id, app_secret, token, expire):
+        key = self._token_cache_key(app_id, app_secret)
+        expire_seconds = self._token_cache_seconds(expire)
+        if await get_tiered_cache(config).set_async(config, key, token, expire_seconds):
+            debug_log(config, "Lark token cached in Redis for key: %s", key)
+        else:
+            debug_log(config, "Lark token cached in memory for key: %s", key)
+
+    async def get_cached_lark_token(self, config, app_id, app_secret):
+        key = self._token_cache_key(app_id, app_secret)
+        token = await get_tiered_cache(config).get_async(config, key)
+        if token:
+            debug_log(config, "Lark token retrieved from cache for key: %s", key)
+        return token
+
+    async def cache_chat_id(self, config, channel_name, chat_id):
+        key = self._chat_id_cache_key(config, channel_name)
+        # No expiry in Redis, 30 days when only cached in memory
+        if await get_tiered_cache(config).set_async(config, key, chat_id):
+            debug_log(config, "Lark chat ID cached in Redis for key: %s", key)
+        else:
+            debug_log(config, "Lark chat ID cached in memory for key: %s", key)
+
+    async def get_cached_chat_id(self, config, channel_name):
+        key = self._chat_id_cache_key(config, channel_name)
+        chat_id = await get_tiered_cache(config).get_async(config, key)
+        if chat_id:
+            debug_log(config, "Lark chat ID retrieved from cache for key: %s", key)
+        return chat_id
+
+    async def get_tenant_access_token(self, config, app_id, app_secret):
+        cached = await self.get_cached_lark_token(config, app_id, app_secret)
+        if cached:
+            return cached
+        return await _token_flight.do(self._token_cache_key(app_id, app_secret), self._refresh_tenant_access_token, config, app_id, app_secret)
+
+    async def _fetch_tenant_access_token(self, config, app_id, app_secret):
+        payload = {"app_id": app_id, "app_secret": app_secret}
+
+        async def fetch():
+            response = await self._get_transport(config).post(TOKEN_URL, json=payload)
+            self._check_token_status(response)
+            return self._parse_token_response(response.json())
+
+        return await get_retry_policy(config).call_async(fetch, operation="lark.tenant_access_token")
+
+    async def _refresh_tenant_access_token(self, config, app_id, app_secret, force=False):
+        # Single-flight within this event loop; the Redis lock is not used here
+        # because waiting on it would mean polling Redis from the loop
+        if not force:
+            cached = await self.get_cached_lark_token(config, app_id, app_secret)
+            if cached:
+                return cached
+        token, expire = await self._fetch_tenant_access_token(config, app_id, app_secret)
+        await self.cache_lark_token(config, app_id, app_secret, token, expire)
+        self._schedule_token_renewal(config, app_id, app_secret, self._renewal_delay(config, self._token_cache_seconds(expire)))
+        return token
+
+    def _schedule_token_renewal(self, config, app_id, app_secret, delay):
+        """Renew the cached token on the running event loop after delay seconds"""
+        if not config.provider_config.get("lark_token_renew", True):
+            return
+        key = self._token_cache_key(app_id, app_secret)
+        loop = asyncio.get_running_loop()
+        previous = _renewals.get(key)
+        if previous is not None:
+            previous.cancel()
+        _renewals[key] = loop.call_later(delay, lambda: loop.create_task(self._renew_tenant_access_token(config, app_id, app_secret)))
+        debug_log(config, "Lark token renewal scheduled in %.0fs for key: %s", delay, key)
+
+    async def _renew_tenant_access_token(self, config, app_id, app_secret):
+        try:
+            await _token_flight.do(self._token_cache_key(app_id, app_secret), self._refresh_tenant_access_token, config, app_id, app_secret, force=True)
+            debug_log(config, "Lark token renewed in the background")
+        except Exception as e:
+            debug_log(config, "Lark token background renewal failed, retrying in %ss: %s", RENEW_RETRY_SECONDS, e)
+            self._schedule_token_renewal(config, app_id, app_secret, RENEW_RETRY_SECONDS)
+
+    async def _fetch_chats_page(self, config, url, headers):
+        response = await self._get_transport(config).get(url, headers=headers)
+        return self._parse_chats_page(response)
+
+    def _directory_provider(self):
+        # Sync provider for background refreshes of the chat directory, which
+        # run on a thread and outlive any one event loop
+        if self._sync_provider is None:
+            self._sync_provider = LarkProvider()
+        return self._sync_provider
+
+    async def get_chat_id_from_channel_name(self, config, token, channel_name):
+        """Get chat_id from channel name using the shared chat directory index"""
+        cached = await self.get_cached_chat_id(config, channel_name)
+        if cached:
+            return cached
+
+        # Same index as LarkProvider: one lookup, or a scan that stops as soon as the name is found
+        credentials = self._resolve_app_credentials(config)
+        directory = get_chat_directory(config, credentials[0] if credentials else None)
+        chat_id = await directory.resolve_async(self, config, token, channel_name, self._directory_provider())
+        if chat_id:
+            await self.cache_chat_id(config, channel_name, chat_id)
+            return chat_id
+
+        raise Exception(f"Channel '{channel_name}' not found")
+
+    async def send(self, level, message, attachment, config):
+        debug_log(config, "AsyncLarkProvider.send called with level: %s, send method: %s", level, config.send_method)
+        with tracing.span("lark.send", {"commonlog.provider": "lark", "commonlog.channel": config.channel, "commonlog.send_method": config.send_method}) as span:
+            with metrics.timer("commonlog_stage_seconds", provider="lark", stage="format"):
+                title, formatted_message = self._format_message(message, attachment, config, level=level)
+            if span.is_recording():
+                span.set_attribute("commonlog.payload_bytes", utf8_length(formatted_message))
+            if config.send_method == SendMethod.WEBCLIENT and should_upload_trace(attachment, config):
+                debug_log(config, "Using Lark webclient method with trace upload")
+                upload = TraceUpload.from_attachment(attachment)
+                _, upload_message = self._format_message(message, attachment, config, upload, level)
+                await send_or_resend_async(self._send_lark_trace_upload, title, upload_message, formatted_message, upload, config=config)
+            elif config.send_method == SendMethod.WEBCLIENT:
+                debug_log(config, "Using Lark webclient method")
+                await send_or_resend_async(self._send_lark_webclient, title, formatted_message, config=config)
+            elif config.send_method == SendMethod.WEBHOOK:
+                debug_log(config, "Using Lark webhook method")
+                await send_or_resend_async(self._send_lark_webhook, title, formatted_message, config=config)
+            else:
+                error_msg = f"Unknown send method for Lark: {config.send_method}"
+                debug_log(config, "Error: %s", error_msg)
+                raise ValueError(error_msg)
+
+    async def _resolve_access_token(self, config):
+        credentials = self._resolve_app_credentials(config)
+        if credentials:
+            debug_log(config, "send_lark_webclient: fetching tenant access token")
+            token = await self.get_tenant_access_token(config, *credentials)
+            debug_log(config, "send_lark_webclient: tenant access token fetched")
+            return token
+        return config.provider_config.get("token", "")
+
+    async def _send_lark_webclient(self, title, formatted_message, config, file_key=None):
+        debug_log(config, "send_lark_webclient: preparing API request")
+        credentials = self._resolve_app_credentials(config)
+        with metrics.timer("commonlog_stage_seconds", provider="lark", stage="token_lookup"), tracing.span("lark.get_tenant_access_token"):
+            token = await self._resolve_access_token(config)
+
+        debug_log(config, "send_lark_webclient: resolving chat_id for channel '%s'", config.channel)
+        with metrics.timer("commonlog_stage_seconds", provider="lark", stage="chat_id_lookup"), tracing.span("lark.get_chat_id_from_channel_name", {"commonlog.channel": config.channel}):
+            chat_id = await self.get_chat_id_from_channel_name(config, token, config.channel)
+
+        url = "https://open.larksuite.com/open-apis/im/v1/messages?receive_id_type=chat_id"
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        body = self._render_webclient_body(title, formatted_message, chat_id, config)
+        debug_log(config, "send_lark_webclient: sending HTTP request, payload size: %s", len(body))
+        tracing.set_attribute("commonlog.payload_bytes", len(body))
+
+        limiter = get_rate_limiter(config)
+        bucket = ("lark", credentials[0] if credentials else token, config.channel)
+
+        async def post(body):
+            if limiter is not None:
+                await limiter.throttle_async(*bucket)
+            response = await self._get_transport(config).post(url, headers=headers, content=body)
+            debug_log(config, "send_lark_webclient: response status: %s", response.status_code)
+            check_rate_limited(response, "Lark WebClient", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Lark WebClient response: {response.status_code}"
+                debug_log(config, "send_lark_webclient: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        policy = get_retry_policy(config)
+        await policy.call_async(post, body, operation="lark.im.messages")
+        if file_key is not None:
+            # An uploaded trace follows the alert as a file message
+            await policy.call_async(post, json.dumps(self._build_file_payload(file_key, chat_id)), operation="lark.im.messages")
+        debug_log(config, "send_lark_webclient: message sent successfully")
+
+    async def _upload_lark_file(self, config, token, upload):
+        debug_log(config, "send_lark_trace_upload: uploading %s, %s bytes (%s uncompressed)", upload.file_name, len(upload.data), upload.original_size)
+        data, files = self._build_file_upload(upload)
+
+        async def post():
+            response = await self._get_transport(config).post(FILES_URL, headers={"Authorization": f"Bearer {token}"}, data=data, files=files)
+            check_rate_limited(response, "Lark file upload")
+            return self._file_key_from_response(response)
+
+        return await get_retry_policy(config).call_async(post, operation="lark.im.files")
+
+    async def _send_lark_trace_upload(self, title, formatted_message, fallback_message, upload, config):
+        try:
+            file_key = await self._upload_lark_file(config, await self._resolve_access_token(config), upload)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f"Lark trace upload failed, sending the trace inline: {e}")
+            await self._send_lark_webclient(title, fallback_message, config)
+            return
+        await self._send_lark_webclient(title, formatted_message, config, file_key=file_key)
+
+    async def _send_lark_webhook(self, title, formatted_message, config):
+        debug_log(config, "send_lark_webhook: preparing webhook request")
+        # For webhook, the token field contains the webhook URL
+        webhook_url = config.token
+        if not webhook_url:
+            error_msg = "Webhook URL is required for Lark webhook method"
+            debug_log(config, "Error: %s", error_msg)
+            raise Exception(error_msg)
+
+        body = self._render_webhook_body(title, formatted_message, config)
+        headers = {"Content-Type": "application/json"}
+        debug_log(config, "send_lark_webhook: payload prepared, size: %s", len(body))
+        limiter = get_rate_limiter(config)
+        bucket = ("lark", webhook_url, config.channel)
+
+        async def post():
+            if limiter is not None:
+                await limiter.throttle_async(*bucket)
+            response = await self._get_transport(config).post(webhook_url, headers=headers, content=body)
+            debug_log(config, lambda: f"send_lark_webhook: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Lark webhook", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Lark webhook response: {response.status_code}"
+                debug_log(config, "send_lark_webhook: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        await get_retry_policy(config).call_async(post, operation="lark.webhook")
+        debug_log(config, "send_lark_webhook: webhook sent successfully")
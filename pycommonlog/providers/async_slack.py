@@ -0,0 +1,163 @@
+"""
+Asyncio Slack Provider for commonlog
+"""
+import logging
+
+from pycommonlog.log_types import SendMethod, SendContext, debug_log
+from pycommonlog import metrics, tracing
+from pycommonlog.providers.slack import SlackProvider, SLACK_API_URL, CHANNEL_ID_RE, _body_kwargs
+from pycommonlog.providers.transport import get_async_transport
+from pycommonlog.providers.retry import ProviderHTTPError, get_retry_policy
+from pycommonlog.providers.ratelimit import RateLimitedError, get_rate_limiter, check_rate_limited, send_or_resend_async
+from pycommonlog.providers.tiered_cache import get_tiered_cache
+from pycommonlog.trace import TraceUpload, should_upload_trace, utf8_length
+
+class AsyncSlackProvider(SlackProvider):
+    """
+    Coroutine counterpart of SlackProvider backed by a pooled httpx.AsyncClient.
+    """
+
+    def _get_transport(self, config):
+        return self.transport or get_async_transport(config)
+
+    async def send_to_channel(self, level, message, attachment, config, channel):
+        # Coroutines interleave at every await, so never mutate the shared config
+        config = SendContext(config, channel)
+        await self.send(level, message, attachment, config)
+
+    async def send(self, level, message, attachment, config):
+        debug_log(config, "AsyncSlackProvider.send called with level: %s, send method: %s", level, config.send_method)
+        with tracing.span("slack.send", {"commonlog.provider": "slack", "commonlog.channel": config.channel, "commonlog.send_method": config.send_method}) as span:
+            with metrics.timer("commonlog_stage_seconds", provider="slack", stage="format"):
+                formatted_message = self._format_message(message, attachment, config, level=level)
+            if span.is_recording():
+                span.set_attribute("commonlog.payload_bytes", utf8_length(formatted_message))
+            if config.send_method == SendMethod.WEBCLIENT and should_upload_trace(attachment, config):
+                debug_log(config, "Using Slack webclient method with trace upload")
+                upload = TraceUpload.from_attachment(attachment)
+                upload_message = self._format_message(message, attachment, config, upload, level)
+                await send_or_resend_async(self._send_slack_trace_upload, upload_message, formatted_message, upload, config=config)
+            elif config.send_method == SendMethod.WEBCLIENT:
+                debug_log(config, "Using Slack webclient method")
+                await send_or_resend_async(self._send_slack_webclient, formatted_message, config=config)
+            elif config.send_method == SendMethod.WEBHOOK:
+                debug_log(config, "Using Slack webhook method")
+                await send_or_resend_async(self._send_slack_webhook, formatted_message, config=config)
+            else:
+                error_msg = f"Unknown send method for Slack: {config.send_method}"
+                debug_log(config, "Error: %s", error_msg)
+                raise ValueError(error_msg)
+
+    async def _send_slack_webclient(self, formatted_message, config):
+        debug_log(config, "send_slack_webclient: preparing API request")
+        url, headers, payload = self._build_webclient_request(formatted_message, config)
+        debug_log(config, lambda: f"send_slack_webclient: sending to channel: {config.channel}, payload size: {len(str(payload))}")
+
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", self._webclient_token(config), config.channel)
+
+        async def post():
+            if limiter is not None:
+                await limiter.throttle_async(*bucket)
+            response = await self._get_transport(config).post(url, **_body_kwargs(payload, headers, raw_key="content"))
+            debug_log(config, lambda: f"send_slack_webclient: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Slack WebClient", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Slack WebClient response: {response.status_code}"
+                debug_log(config, "send_slack_webclient: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        await get_retry_policy(config).call_async(post, operation="slack.chat.postMessage")
+        debug_log(config, "send_slack_webclient: message sent successfully")
+
+    async def _send_slack_webhook(self, formatted_message, config):
+        debug_log(config, "send_slack_webhook: preparing webhook request")
+        # For webhook, the token field contains the webhook URL
+        webhook_url = config.provider_config.get("token", "")
+        if not webhook_url:
+            error_msg = "Webhook URL is required for Slack webhook method"
+            debug_log(config, "Error: %s", error_msg)
+            raise Exception(error_msg)
+
+        payload = self._build_webhook_payload(formatted_message, config)
+        debug_log(config, lambda: f"send_slack_webhook: payload prepared, size: {len(str(payload))}")
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", webhook_url, config.channel)
+
+        async def post():
+            if limiter is not None:
+                await limiter.throttle_async(*bucket)
+            response = await self._get_transport(config).post(webhook_url, **_body_kwargs(payload, raw_key="content"))
+            debug_log(config, lambda: f"send_slack_webhook: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Slack webhook", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Slack webhook response: {response.status_code}"
+                debug_log(config, "send_slack_webhook: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        await get_retry_policy(config).call_async(post, operation="slack.webhook")
+        debug_log(config, "send_slack_webhook: webhook sent successfully")
+
+    async def _send_slack_trace_upload(self, formatted_message, fallback_message, upload, config):
+        try:
+            await self._upload_slack_file(formatted_message, upload, config)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f"Slack trace upload failed, sending the trace inline: {e}")
+            await self._send_slack_webclient(fallback_message, config)
+
+    async def _resolve_channel_id(self, config, api, headers):
+        channel = config.channel or ""
+        if CHANNEL_ID_RE.match(channel):
+            return channel
+        name = channel.lstrip("#")
+        key = self._channel_id_cache_key(self._webclient_token(config), name)
+        cache = get_tiered_cache(config)
+        channel_id = await cache.get_async(config, key)
+        if channel_id:
+            debug_log(config, "Slack channel ID retrieved from cache for key: %s", key)
+            return channel_id
+        cursor = ""
+        while True:
+            page = await get_retry_policy(config).call_async(api, "conversations.list", headers=headers, data=self._conversations_page_data(cursor),
+                                                             operation="slack.conversations.list")
+            channel_id, cursor = self._find_channel(page, name)
+            if channel_id:
+                await cache.set_async(config, key, channel_id)
+                return channel_id
+            if not cursor:
+                raise Exception(f"Slack channel '{channel}' not found")
+
+    async def _upload_slack_file(self, formatted_message, upload, config):
+        debug_log(config, "send_slack_trace_upload: uploading %s, %s bytes (%s uncompressed)", upload.file_name, len(upload.data), upload.original_size)
+        token = self._webclient_token(config)
+        headers = {"Authorization": f"Bearer {token}"}
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", token, config.channel)
+        policy = get_retry_policy(config)
+        transport = self._get_transport(config)
+
+        async def api(method, **kwargs):
+            if limiter is not None:
+                await limiter.throttle_async(*bucket)
+            response = await transport.post(SLACK_API_URL + method, **kwargs)
+            check_rate_limited(response, f"Slack {method}", limiter, bucket)
+            return self._check_api_response(response, method)
+
+        async def put_file(upload_url):
+            response = await transport.post(upload_url, headers={"Content-Type": "application/octet-stream"}, content=upload.data)
+            if response.status_code != 200:
+                raise ProviderHTTPError(f"Slack file upload response: {response.status_code}", response.status_code)
+
+        channel_id = await self._resolve_channel_id(config, api, headers)
+        ticket = await policy.call_async(api, "files.getUploadURLExternal", headers=headers,
+                                         data={"filename": upload.file_name, "length": len(upload.data)},
+                                         operation="slack.files.getUploadURLExternal")
+        await policy.call_async(put_file, ticket["upload_url"], operation="slack.files.upload")
+        payload = self._build_complete_upload_payload(formatted_message, upload, ticket["file_id"], channel_id)
+        await policy.call_async(api, "files.completeUploadExternal", headers=dict(headers, **{"Content-Type": "application/json; charset=utf-8"}),
+                                json=payload, operation="slack.files.completeUploadExternal")
+        debug_log(config, "send_slack_trace_upload: trace uploaded and shared")
@@ -0,0 +1,145 @@
+"""
+Circuit breaker for commonlog's Redis layer
+"""
+import inspect
+import threading
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 30.0
+
+
+class CircuitState:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling a backend whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker.
+
+    After failure_threshold consecutive failures the circuit opens and
+    allow() returns False, so callers go straight to their fallback. Once
+    reset_timeout seconds have passed one probe call is let through per
+    reset_timeout (half-open); a success closes the circuit, a failure
+    re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_at = None
+        self._trips = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow(self):
+        """Return True if a call may go through"""
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == CircuitState.OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = CircuitState.HALF_OPEN
+                self._probe_at = None
+            if self._state == CircuitState.HALF_OPEN and (self._probe_at is None or now - self._probe_at >= self.reset_timeout):
+                # A probe whose outcome never got recorded doesn't block the next one forever
+                self._probe_at = now
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = CircuitState.CLOSED
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitState.HALF_OPEN or (self._state == CircuitState.CLOSED and self._failures >= self.failure_threshold):
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+                self._trips += 1
+
+    def reset(self):
+        """Force the circuit closed"""
+        self.record_success()
+
+    def snapshot(self):
+        """Return {state, failures, trips, rejected, open_for}"""
+        with self._lock:
+            return {
+                "state": self._state,
+                "failures": self._failures,
+                "trips": self._trips,
+                "rejected": self._rejected,
+                "open_for": time.monotonic() - self._opened_at if self._opened_at is not None else 0.0,
+            }
+
+
+class GuardedClient:
+    """
+    Proxy that reports the outcome of every client call to a CircuitBreaker.
+
+    Only errors in failure_types count as failures; anything else (e.g. a
+    Redis ResponseError) means the backend answered. Works for both sync
+    and asyncio clients, and guards pipeline execute() too.
+    """
+
+    def __init__(self, client, breaker, failure_types, guarded=None):
+        self._client = client
+        self._breaker = breaker
+        self._failure_types = failure_types
+        # Names of the methods to guard, None for all of them
+        self._guarded = guarded
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or (self._guarded is not None and name not in self._guarded):
+            return attr
+        if name == "pipeline":
+            # Queued commands are only sent by execute()
+            return lambda *args, **kwargs: GuardedClient(attr(*args, **kwargs), self._breaker, self._failure_types, guarded=("execute",))
+        return self._guard(attr)
+
+    def _guard(self, func):
+        breaker = self._breaker
+        failure_types = self._failure_types
+
+        async def await_guarded(awaitable):
+            try:
+                result = await awaitable
+            except failure_types:
+                breaker.record_failure()
+                raise
+            breaker.record_success()
+            return result
+
+        def guarded(*args, **kwargs):
+            try:
+                result = func(*args, **kwargs)
+            except failure_types:
+                breaker.record_failure()
+                raise
+            if inspect.isawaitable(result):
+                return await_guarded(result)
+            breaker.record_success()
+            return result
+
+        return guarded
@@ -1,269 +1,486 @@
 """
 Lark Provider for commonlog
 """
-import requests
+import functools
 import json
+import logging
 import time
 import threading
 from typing import Dict, Optional, Tuple
 
-from pycommonlog.log_types import SendMethod, Provider, debug_log
+from pycommonlog.log_types import SendMethod, Provider, SendContext, debug_log
+from pycommonlog import metrics, tracing
 from pycommonlog.providers.redis_client import get_redis_client
-from pycommonlog.cache import get_memory_cache
+from pycommonlog.providers.transport import get_transport
+from pycommonlog.providers.lark_directory import get_chat_directory
+from pycommonlog.providers.retry import ProviderHTTPError, get_retry_policy
+from pycommonlog.providers.ratelimit import RateLimitedError, get_rate_limiter, check_rate_limited, send_or_schedule
+from pycommonlog.providers.singleflight import SingleFlight, RedisLock
+from pycommonlog.providers.tiered_cache import get_tiered_cache
+from pycommonlog.trace import TraceUpload, should_upload_trace, trace_max_bytes, truncate_trace, utf8_length
+from pycommonlog.templates import TextTemplate, JsonTemplate, JsonString, get_template, LEVEL_NAMES, TEXT_FIELDS, PAYLOAD_FIELDS
+
+TOKEN_URL = "https://open.larksuite.com/open-apis/auth/v3/tenant_access_token/internal"
+FILES_URL = "https://open.larksuite.com/open-apis/im/v1/files"
+# A crashed lock holder frees the cross-process refresh lock after this long
+TOKEN_LOCK_SECONDS = 10
+DEFAULT_TOKEN_RENEW_MARGIN = 300
+RENEW_RETRY_SECONDS = 30
+
+# One token fetch at a time per app, shared by every provider instance
+_token_flight = SingleFlight()
+# token cache key -> threading.Timer for the next proactive renewal
+_renewals = {}
+_renewals_lock = threading.Lock()
+
+DEFAULT_TEMPLATE = TextTemplate("{message}{details}", TEXT_FIELDS)
+WEBCLIENT_FIELDS = PAYLOAD_FIELDS | {"chat_id"}
+# The post body, compiled once; "content" is sent as a JSON-encoded string
+_POST_CONTENT = {"en_us": {"title": "{title}", "content": [[{"tag": "text", "text": "{text}"}]]}}
+WEBCLIENT_TEMPLATE = JsonTemplate({"receive_id": "{chat_id}", "msg_type": "post", "content": JsonString(_POST_CONTENT)}, WEBCLIENT_FIELDS)
+WEBHOOK_TEMPLATE = JsonTemplate({"msg_type": "post", "content": {"post": _POST_CONTENT}}, PAYLOAD_FIELDS)
+
+
+@functools.lru_cache(maxsize=256)
+def lark_title(service_name, environment):
+    """The post title, rendered once per (service, environment) pair"""
+    if service_name and environment:
+        return f"{service_name} - {environment}"
+    return service_name or environment or "Alert"
 
 class LarkProvider(Provider):
+    def __init__(self, transport=None):
+        # Optional injected HTTPTransport; defaults to the shared one for the config
+        self.transport = transport
+
+    def _get_transport(self, config):
+        return self.transport or get_transport(config)
+
     def send_to_channel(self, level, message, attachment, config, channel):
-        original_channel = config.channel
-        config.channel = channel
-        title, formatted_message = self._format_message(message, attachment, config)
-        if config.send_method == SendMethod.WEBCLIENT:
-            self._send_lark_webclient(title, formatted_message, config)
-        elif config.send_method == SendMethod.WEBHOOK:
-            self._send_lark_webhook(title, formatted_message, config)
-        config.channel = original_channel
+        return self.send(level, message, attachment, SendContext(config, channel))
+
+    @staticmethod
+    def _token_cache_key(app_id, app_secret):
+        return f"commonlog_lark_token:{app_id}:{app_secret}"
+
+    @staticmethod
+    def _chat_id_cache_key(config, channel_name):
+        return f"commonlog_lark_chat_id:{config.environment}:{channel_name}"
+
+    @staticmethod
+    def _token_cache_seconds(expire):
+        # Refresh tokens 10 minutes before Lark expires them
+        expire_seconds = expire - 600
+        if expire_seconds <= 0:
+            expire_seconds = 60
+        return expire_seconds
+
+    @staticmethod
+    def _resolve_app_credentials(config):
+        """Return (app_id, app_secret) for tenant token auth, or None to use the raw token"""
+        token = config.provider_config.get("token", "")
+        lark_token = config.provider_config.get("lark_token")
+        if lark_token and lark_token.app_id and lark_token.app_secret:
+            return lark_token.app_id, lark_token.app_secret
+        if token and len(token) < 100 and "++" in token:
+            # Token in "app_id++app_secret" format
+            parts = token.split("++")
+            if len(parts) == 2:
+                return parts[0], parts[1]
+        return None
+
+    @staticmethod
+    def _check_token_status(response):
+        if response.status_code != 200:
+            raise ProviderHTTPError(f"Lark token API response: {response.status_code}", response.status_code)
+
+    @staticmethod
+    def _parse_token_response(result):
+        if result.get("code", 1) != 0:
+            raise Exception(f"lark token error: {result.get('msg')}")
+        return result.get("tenant_access_token"), result.get("expire", 0)
+
+    @staticmethod
+    def _parse_chats_page(response):
+        """Validate a /im/v1/chats response and return (items, page_token, has_more)"""
+        if response.status_code != 200:
+            raise ProviderHTTPError(f"Lark chats API response: {response.status_code}", response.status_code)
+        result = response.json()
+        # Check for API error
+        if result.get("code", 1) != 0:
+            raise Exception(f"Lark API error: {result.get('msg', 'Unknown error')}")
+        data = result.get("data", {})
+        return data.get("items", []), data.get("page_token", ""), data.get("has_more", False)
+
+    @staticmethod
+    def _payload_values(title, formatted_message, config):
+        return {
+            "text": formatted_message,
+            "header": "",
+            "title": title,
+            "service_name": config.service_name or "",
+            "environment": config.environment or "",
+            "channel": config.channel or "",
+        }
+
+    @classmethod
+    def _render_webclient_body(cls, title, formatted_message, chat_id, config):
+        """Request body for im/v1/messages: a post, or an interactive card with lark_card"""
+        card = config.provider_config.get("lark_card")
+        if card:
+            template = get_template("lark.im.messages", card, lambda card: JsonTemplate(
+                {"receive_id": "{chat_id}", "msg_type": "interactive", "content": JsonString(card)}, WEBCLIENT_FIELDS))
+        else:
+            template = WEBCLIENT_TEMPLATE
+        return template.render(chat_id=chat_id, **cls._payload_values(title, formatted_message, config))
+
+    @classmethod
+    def _render_webhook_body(cls, title, formatted_message, config):
+        card = config.provider_config.get("lark_card")
+        if card:
+            template = get_template("lark.webhook", card, lambda card: JsonTemplate({"msg_type": "interactive", "card": card}, PAYLOAD_FIELDS))
+        else:
+            template = WEBHOOK_TEMPLATE
+        return template.render(**cls._payload_values(title, formatted_message, config))
+
+    @staticmethod
+    def _build_file_payload(file_key, chat_id):
+        return {
+            "receive_id": chat_id,
+            "msg_type": "file",
+            "content": json.dumps({"file_key": file_key})
+        }
 
     def cache_lark_token(self, config, app_id, app_secret, token, expire):
-        key = f"commonlog_lark_token:{app_id}:{app_secret}"
-        try:
-            client = get_redis_client(config)
-            expire_seconds = expire - 600
-            if expire_seconds <= 0:
-                expire_seconds = 60
-            client.setex(key, expire_seconds, token)
-            debug_log(config, f"Lark token cached in Redis for key: {key}")
-        except Exception:
-            # Fallback to in-memory cache
-            expire_seconds = expire - 600
-            if expire_seconds <= 0:
-                expire_seconds = 60
-            get_memory_cache().set(key, token, expire_seconds)
-            debug_log(config, f"Lark token cached in memory for key: {key}")
+        key = self._token_cache_key(app_id, app_secret)
+        expire_seconds = self._token_cache_seconds(expire)
+        if get_tiered_cache(config).set(config, key, token, expire_seconds):
+            debug_log(config, "Lark token cached in Redis for key: %s", key)
+        else:
+            debug_log(config, "Lark token cached in memory for key: %s", key)
 
     def get_cached_lark_token(self, config, app_id, app_secret):
-        key = f"commonlog_lark_token:{app_id}:{app_secret}"
-        try:
-            client = get_redis_client(config)
-            token = client.get(key)
-            if token:
-                debug_log(config, f"Lark token retrieved from Redis for key: {key}")
-            return token
-        except Exception:
-            # Fallback to in-memory cache
-            token = get_memory_cache().get(key)
-            if token:
-                debug_log(config, f"Lark token retrieved from memory for key: {key}")
-            return token
+        key = self._token_cache_key(app_id, app_secret)
+        token = get_tiered_cache(config).get(config, key)
+        if token:
+            debug_log(config, "Lark token retrieved from cache for key: %s", key)
+        return token
 
     def cache_chat_id(self, config, channel_name, chat_id):
-        key = f"commonlog_lark_chat_id:{config.environment}:{channel_name}"
-        try:
-            client = get_redis_client(config)
-            client.set(key, chat_id)  # No expiry
-            debug_log(config, f"Lark chat ID cached in Redis for key: {key}")
-        except Exception:
-            # Fallback to in-memory cache (no expiry for chat IDs)
-            get_memory_cache().set(key, chat_id, 86400 * 30)  # 30 days expiry
-            debug_log(config, f"Lark chat ID cached in memory for key: {key}")
+        key = self._chat_id_cache_key(config, channel_name)
+        # No expiry in Redis, 30 days when only cached in memory
+        if get_tiered_cache(config).set(config, key, chat_id):
+            debug_log(config, "Lark chat ID cached in Redis for key: %s", key)
+        else:
+            debug_log(config, "Lark chat ID cached in memory for key: %s", key)
 
     def get_cached_chat_id(self, config, channel_name):
-        key = f"commonlog_lark_chat_id:{config.environment}:{channel_name}"
-        try:
-            client = get_redis_client(config)
-            chat_id = client.get(key)
-            if chat_id:
-                debug_log(config, f"Lark chat ID retrieved from Redis for key: {key}")
-            return chat_id
-        except Exception:
-            # Fallback to in-memory cache
-            chat_id = get_memory_cache().get(key)
-            if chat_id:
-                debug_log(config, f"Lark chat ID retrieved from memory for key: {key}")
-            return chat_id
+        key = self._chat_id_cache_key(config, channel_name)
+        chat_id = get_tiered_cache(config).get(config, key)
+        if chat_id:
+            debug_log(config, "Lark chat ID retrieved from cache for key: %s", key)
+        return chat_id
 
     def get_tenant_access_token(self, config, app_id, app_secret):
         cached = self.get_cached_lark_token(config, app_id, app_secret)
         if cached:
             return cached
-        url = "https://open.larksuite.com/open-apis/auth/v3/tenant_access_token/internal"
+        # Concurrent misses share a single fetch instead of each calling the token API
+        return _token_flight.do(self._token_cache_key(app_id, app_secret), self._refresh_tenant_access_token, config, app_id, app_secret)
+
+    def _fetch_tenant_access_token(self, config, app_id, app_secret):
         payload = {"app_id": app_id, "app_secret": app_secret}
-        response = requests.post(url, json=payload)
-        result = response.json()
-        if result.get("code", 1) != 0:
-            raise Exception(f"lark token error: {result.get('msg')}")
-        token = result.get("tenant_access_token")
-        expire = result.get("expire", 0)
-        self.cache_lark_token(config, app_id, app_secret, token, expire)
+
+        def fetch():
+            response = self._get_transport(config).post(TOKEN_URL, json=payload)
+            self._check_token_status(response)
+            return self._parse_token_response(response.json())
+
+        return get_retry_policy(config).call(fetch, operation="lark.tenant_access_token")
+
+    def _refresh_tenant_access_token(self, config, app_id, app_secret, force=False):
+        """
+        Fetch and cache a new tenant token, at most once across processes.
+
+        With force=False a token cached by another caller in the meantime is
+        returned as is; force=True is used for proactive renewal of a token
+        that is still valid.
+        """
+        key = self._token_cache_key(app_id, app_secret)
+        cached = self._renewed_token(config, app_id, app_secret) if force else self.get_cached_lark_token(config, app_id, app_secret)
+        if cached:
+            return cached
+        lock = None
+        if config.provider_config.get("lark_token_lock", True):
+            lock = RedisLock(config, f"commonlog_lark_token_lock:{app_id}", TOKEN_LOCK_SECONDS)
+            if lock.acquire() is False:
+                # Another process is fetching; use its token once it is done
+                debug_log(config, "Lark token refresh in progress elsewhere, waiting for key: %s", key)
+                lock.wait_released(TOKEN_LOCK_SECONDS)
+                cached = self._renewed_token(config, app_id, app_secret)
+                if not cached and not force:
+                    cached = self.get_cached_lark_token(config, app_id, app_secret)
+                if cached:
+                    return cached
+                lock = None
+        try:
+            token, expire = self._fetch_tenant_access_token(config, app_id, app_secret)
+            self.cache_lark_token(config, app_id, app_secret, token, expire)
+        finally:
+            if lock is not None:
+                lock.release()
+        self._schedule_token_renewal(config, app_id, app_secret, self._renewal_delay(config, self._token_cache_seconds(expire)))
         return token
 
+    @staticmethod
+    def _token_renew_margin(config):
+        return config.provider_config.get("lark_token_renew_margin", DEFAULT_TOKEN_RENEW_MARGIN)
+
+    @classmethod
+    def _renewal_delay(cls, config, lifetime):
+        """Seconds until a token cached for lifetime more seconds should be renewed"""
+        delay = lifetime - cls._token_renew_margin(config)
+        if delay <= 0:
+            # Lifetime shorter than the margin: renew halfway through
+            delay = lifetime / 2
+        return delay
+
+    def _renewed_token(self, config, app_id, app_secret):
+        """
+        Return the Redis-cached token if another process renewed it recently,
+        scheduling this process's next renewal from its remaining lifetime.
+        """
+        key = self._token_cache_key(app_id, app_secret)
+        try:
+            client = get_redis_client(config)
+            remaining = client.ttl(key)
+            if remaining is None or remaining <= self._token_renew_margin(config):
+                return None
+            token = client.get(key)
+        except Exception:
+            return None
+        if token:
+            self._schedule_token_renewal(config, app_id, app_secret, self._renewal_delay(config, remaining))
+        return token
+
+    def _schedule_token_renewal(self, config, app_id, app_secret, delay):
+        """Renew the cached token in the background after delay seconds"""
+        if not config.provider_config.get("lark_token_renew", True):
+            return
+        key = self._token_cache_key(app_id, app_secret)
+        timer = threading.Timer(delay, self._renew_tenant_access_token, args=(config, app_id, app_secret))
+        timer.daemon = True
+        timer.name = "commonlog-lark-token-renewal"
+        with _renewals_lock:
+            previous = _renewals.get(key)
+            if previous is not None:
+                previous.cancel()
+            _renewals[key] = timer
+        timer.start()
+        debug_log(config, "Lark token renewal scheduled in %.0fs for key: %s", delay, key)
+
+    def _renew_tenant_access_token(self, config, app_id, app_secret):
+        try:
+            _token_flight.do(self._token_cache_key(app_id, app_secret), self._refresh_tenant_access_token, config, app_id, app_secret, force=True)
+            debug_log(config, "Lark token renewed in the background")
+        except Exception as e:
+            debug_log(config, "Lark token background renewal failed, retrying in %ss: %s", RENEW_RETRY_SECONDS, e)
+            self._schedule_token_renewal(config, app_id, app_secret, RENEW_RETRY_SECONDS)
+
+    def _fetch_chats_page(self, config, url, headers):
+        response = self._get_transport(config).get(url, headers=headers)
+        return self._parse_chats_page(response)
+
+    def get_access_token(self, config):
+        """Return the token used for API calls: a tenant access token when app credentials are configured"""
+        credentials = self._resolve_app_credentials(config)
+        if credentials:
+            return self.get_tenant_access_token(config, *credentials)
+        return config.provider_config.get("token", "")
+
     def get_chat_id_from_channel_name(self, config, token, channel_name):
-        """Get chat_id from channel name using Lark API with pagination"""
+        """Get chat_id from channel name using the shared chat directory index"""
         # Try Redis cache first
         cached = self.get_cached_chat_id(config, channel_name)
         if cached:
             return cached
         
-        base_url = "https://open.larksuite.com/open-apis/im/v1/chats"
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        all_chats = []
-        page_token = ""
-        has_more = True
-        
-        while has_more:
-            url = f"{base_url}?page_size=10"
-            if page_token:
-                url += f"&page_token={page_token}"
-            
-            response = requests.get(url, headers=headers)
-            if response.status_code != 200:
-                raise Exception(f"Lark chats API response: {response.status_code}")
-            
-            result = response.json()
-            
-            # Check for API error
-            if result.get("code", 1) != 0:
-                raise Exception(f"Lark API error: {result.get('msg', 'Unknown error')}")
-            
-            data = result.get("data", {})
-            items = data.get("items", [])
-            
-            # Add current page items to all chats
-            all_chats.extend(items)
-            
-            # Update pagination info
-            page_token = data.get("page_token", "")
-            has_more = data.get("has_more", False)
-        
-        # Find the chat with matching name
-        for item in all_chats:
-            if item.get("name") == channel_name:
-                chat_id = item.get("chat_id")
-                # Cache the chat_id without expiry
-                self.cache_chat_id(config, channel_name, chat_id)
-                return chat_id
+        # One index lookup, or a scan that stops as soon as the name is found
+        credentials = self._resolve_app_credentials(config)
+        directory = get_chat_directory(config, credentials[0] if credentials else None)
+        chat_id = directory.resolve(self, config, token, channel_name)
+        if chat_id:
+            # Cache the chat_id without expiry
+            self.cache_chat_id(config, channel_name, chat_id)
+            return chat_id
         
         raise Exception(f"Channel '{channel_name}' not found")
 
     def send(self, level, message, attachment, config):
-        debug_log(config, f"LarkProvider.send called with level: {level}, send method: {config.send_method}")
-        title, formatted_message = self._format_message(message, attachment, config)
-        if config.send_method == SendMethod.WEBCLIENT:
-            debug_log(config, "Using Lark webclient method")
-            self._send_lark_webclient(title, formatted_message, config)
-        elif config.send_method == SendMethod.WEBHOOK:
-            debug_log(config, "Using Lark webhook method")
-            self._send_lark_webhook(title, formatted_message, config)
-        else:
-            error_msg = f"Unknown send method for Lark: {config.send_method}"
-            debug_log(config, f"Error: {error_msg}")
-            raise ValueError(error_msg)
-
-    def _format_message(self, message, attachment, config):
-        # Extract title from service and environment
-        title = "Alert"
-        if config.service_name and config.environment:
-            title = f"{config.service_name} - {config.environment}"
-        elif config.service_name:
-            title = config.service_name
-        elif config.environment:
-            title = config.environment
-        
-        # Format message content without the header
-        formatted = message
+        debug_log(config, "LarkProvider.send called with level: %s, send method: %s", level, config.send_method)
+        with tracing.span("lark.send", {"commonlog.provider": "lark", "commonlog.channel": config.channel, "commonlog.send_method": config.send_method}) as span:
+            with metrics.timer("commonlog_stage_seconds", provider="lark", stage="format"):
+                title, formatted_message = self._format_message(message, attachment, config, level=level)
+            if span.is_recording():
+                span.set_attribute("commonlog.payload_bytes", utf8_length(formatted_message))
+            if config.send_method == SendMethod.WEBCLIENT and should_upload_trace(attachment, config):
+                debug_log(config, "Using Lark webclient method with trace upload")
+                upload = TraceUpload.from_attachment(attachment)
+                _, upload_message = self._format_message(message, attachment, config, upload, level)
+                return send_or_schedule(self._send_lark_trace_upload, title, upload_message, formatted_message, upload, config=config)
+            elif config.send_method == SendMethod.WEBCLIENT:
+                debug_log(config, "Using Lark webclient method")
+                return send_or_schedule(self._send_lark_webclient, title, formatted_message, config=config)
+            elif config.send_method == SendMethod.WEBHOOK:
+                debug_log(config, "Using Lark webhook method")
+                return send_or_schedule(self._send_lark_webhook, title, formatted_message, config=config)
+            else:
+                error_msg = f"Unknown send method for Lark: {config.send_method}"
+                debug_log(config, "Error: %s", error_msg)
+                raise ValueError(error_msg)
+
+    def _format_message(self, message, attachment, config, upload=None, level=None):
+        title = lark_title(config.service_name, config.environment)
+
+        # The title is sent separately, so the text has no header; trace parts are
+        # spliced into the template's single join so a large trace is copied once
+        details = []
         if attachment and attachment.content:
             filename = attachment.file_name or "Trace Logs"
-            formatted += f"\n\n**{filename}:**\n```\n{attachment.content}\n```"
+            if upload is not None:
+                details.append(f"\n\n**{filename}:** attached as {upload.file_name}")
+            else:
+                details += ["\n\n**", filename, ":**\n```\n", truncate_trace(attachment.content, trace_max_bytes(config)), "\n```"]
         if attachment and attachment.url:
-            formatted += f"\n\n**Attachment:** {attachment.url}"
-        return title, formatted
+            details.append(f"\n\n**Attachment:** {attachment.url}")
+
+        text = self._text_template(config).render(
+            header="",
+            title=title,
+            service_name=config.service_name or "",
+            environment=config.environment or "",
+            level=LEVEL_NAMES.get(level, ""),
+            message=message,
+            details=details,
+            channel=config.channel or "",
+        )
+        return title, text
+
+    @staticmethod
+    def _text_template(config):
+        source = config.provider_config.get("message_template")
+        if not source:
+            return DEFAULT_TEMPLATE
+        return get_template("text", source, lambda source: TextTemplate(source, TEXT_FIELDS))
 
-    def _send_lark_webclient(self, title, formatted_message, config):
+    def _send_lark_webclient(self, title, formatted_message, config, file_key=None):
         debug_log(config, "send_lark_webclient: preparing API request")
-        token = config.provider_config.get("token", "")
-        
-        # Use lark_token if available, otherwise fall back to token parsing
-        lark_token = config.provider_config.get("lark_token")
-        if lark_token and lark_token.app_id and lark_token.app_secret:
-            debug_log(config, "send_lark_webclient: fetching tenant access token using lark_token")
-            token = self.get_tenant_access_token(config, lark_token.app_id, lark_token.app_secret)
-            debug_log(config, "send_lark_webclient: tenant access token fetched")
-        elif token and len(token) < 100 and "++" in token:
-            # If token is in "app_id++app_secret" format, fetch the tenant_access_token
-            debug_log(config, "send_lark_webclient: parsing token in app_id++app_secret format")
-            parts = token.split("++")
-            if len(parts) == 2:
-                token = self.get_tenant_access_token(config, parts[0], parts[1])
-                debug_log(config, "send_lark_webclient: tenant access token fetched from parsed token")
+        # Use lark_token if available, otherwise fall back to "app_id++app_secret" token parsing
+        credentials = self._resolve_app_credentials(config)
+        with metrics.timer("commonlog_stage_seconds", provider="lark", stage="token_lookup"), tracing.span("lark.get_tenant_access_token"):
+            token = self.get_access_token(config)
+        debug_log(config, "send_lark_webclient: access token resolved")
         
         # Get chat_id from channel name
-        debug_log(config, f"send_lark_webclient: resolving chat_id for channel '{config.channel}'")
-        chat_id = self.get_chat_id_from_channel_name(config, token, config.channel)
-        debug_log(config, f"send_lark_webclient: resolved chat_id")
+        debug_log(config, "send_lark_webclient: resolving chat_id for channel '%s'", config.channel)
+        with metrics.timer("commonlog_stage_seconds", provider="lark", stage="chat_id_lookup"), tracing.span("lark.get_chat_id_from_channel_name", {"commonlog.channel": config.channel}):
+            chat_id = self.get_chat_id_from_channel_name(config, token, config.channel)
+        debug_log(config, "send_lark_webclient: resolved chat_id")
         
         url = "https://open.larksuite.com/open-apis/im/v1/messages?receive_id_type=chat_id"
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
 
-        payload = {
-            "receive_id": chat_id,
-            "msg_type": "post",
-            "content": json.dumps({
-                "en_us": {
-                    "title": title,
-                    "content": [
-                        [
-                            {
-                                "tag": "text",
-                                "text": formatted_message
-                            }
-                        ]
-                    ]
-                }
-            })
-        }
-        debug_log(config, f"send_lark_webclient: sending HTTP request, payload size: {len(str(payload))}, payload: {json.dumps(payload)}")
+        # Rendered once from the compiled template, for both the debug log and every (re)try
+        body = self._render_webclient_body(title, formatted_message, chat_id, config)
+        debug_log(config, "send_lark_webclient: sending HTTP request, payload size: %s, payload: %s", len(body), body)
+        tracing.set_attribute("commonlog.payload_bytes", len(body))
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        debug_log(config, f"send_lark_webclient: response status: {response.status_code}")
-        if response.status_code != 200:
-            error_msg = f"Lark WebClient response: {response.status_code}"
-            debug_log(config, f"send_lark_webclient: error: {error_msg}")
-            raise Exception(error_msg)
+        limiter = get_rate_limiter(config)
+        bucket = ("lark", credentials[0] if credentials else token, config.channel)
+
+        def post(body):
+            if limiter is not None:
+                limiter.throttle(*bucket)
+            response = self._get_transport(config).post(url, headers=headers, data=body)
+            debug_log(config, "send_lark_webclient: response status: %s", response.status_code)
+            check_rate_limited(response, "Lark WebClient", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Lark WebClient response: {response.status_code}"
+                debug_log(config, "send_lark_webclient: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        policy = get_retry_policy(config)
+        policy.call(post, body, operation="lark.im.messages")
+        if file_key is not None:
+            # An uploaded trace follows the alert as a file message
+            policy.call(post, json.dumps(self._build_file_payload(file_key, chat_id)), operation="lark.im.messages")
         debug_log(config, "send_lark_webclient: message sent successfully")
 
+    @staticmethod
+    def _build_file_upload(upload):
+        """Return (data, files) for a multipart POST to the Lark file API"""
+        return {"file_type": "stream", "file_name": upload.file_name}, {"file": (upload.file_name, upload.data, "application/gzip")}
+
+    @staticmethod
+    def _file_key_from_response(response):
+        if response.status_code != 200:
+            raise ProviderHTTPError(f"Lark file upload response: {response.status_code}", response.status_code)
+        result = response.json()
+        if result.get("code") != 0:
+            raise Exception(f"Lark file upload error: {result.get('msg')}")
+        return result["data"]["file_key"]
+
+    def _upload_lark_file(self, config, token, upload):
+        debug_log(config, "send_lark_trace_upload: uploading %s, %s bytes (%s uncompressed)", upload.file_name, len(upload.data), upload.original_size)
+        data, files = self._build_file_upload(upload)
+
+        def post():
+            response = self._get_transport(config).post(FILES_URL, headers={"Authorization": f"Bearer {token}"}, data=data, files=files)
+            check_rate_limited(response, "Lark file upload")
+            return self._file_key_from_response(response)
+
+        return get_retry_policy(config).call(post, operation="lark.im.files")
+
+    def _send_lark_trace_upload(self, title, formatted_message, fallback_message, upload, config):
+        try:
+            file_key = self._upload_lark_file(config, self.get_access_token(config), upload)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f"Lark trace upload failed, sending the trace inline: {e}")
+            self._send_lark_webclient(title, fallback_message, config)
+            return
+        self._send_lark_webclient(title, formatted_message, config, file_key=file_key)
+
     def _send_lark_webhook(self, title, formatted_message, config):
         debug_log(config, "send_lark_webhook: preparing webhook request")
         # For webhook, the token field contains the webhook URL
         webhook_url = config.token
         if not webhook_url:
             error_msg = "Webhook URL is required for Lark webhook method"
-            debug_log(config, f"Error: {error_msg}")
+            debug_log(config, "Error: %s", error_msg)
             raise Exception(error_msg)
         
         debug_log(config, "send_lark_webhook: using webhook URL")
 
-        payload = {
-            "msg_type": "post",
-            "content": {
-                "post": {
-                    "en_us": {
-                        "title": title,
-                        "content": [
-                            [
-                                {
-                                    "tag": "text",
-                                    "text": formatted_message
-                                }
-                            ]
-                        ]
-                    }
-                }
-            }
-        }
-        debug_log(config, f"send_lark_webhook: payload prepared, size: {len(str(payload))}, payload: {json.dumps(payload)}")
-        response = requests.post(webhook_url, json=payload)
-        debug_log(config, f"send_lark_webhook: response status: {response.status_code}, response data: {response.text}")
-        if response.status_code != 200:
-            error_msg = f"Lark webhook response: {response.status_code}"
-            debug_log(config, f"send_lark_webhook: error: {error_msg}")
-            raise Exception(error_msg)
+        body = self._render_webhook_body(title, formatted_message, config)
+        headers = {"Content-Type": "application/json"}
+        debug_log(config, "send_lark_webhook: payload prepared, size: %s, payload: %s", len(body), body)
+        limiter = get_rate_limiter(config)
+        bucket = ("lark", webhook_url, config.channel)
+
+        def post():
+            if limiter is not None:
+                limiter.throttle(*bucket)
+            response = self._get_transport(config).post(webhook_url, headers=headers, data=body)
+            debug_log(config, lambda: f"send_lark_webhook: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Lark webhook", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Lark webhook response: {response.status_code}"
+                debug_log(config, "send_lark_webhook: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        get_retry_policy(config).call(post, operation="lark.webhook")
         debug_log(config, "send_lark_webhook: webhook sent successfully")
\ No newline at end of file
@@ -0,0 +1,245 @@
+"""
+Lark chat directory index for commonlog
+"""
+import asyncio
+import functools
+import hashlib
+import threading
+import time
+
+from pycommonlog.log_types import debug_log
+from pycommonlog.providers.redis_client import get_redis_client
+from pycommonlog.providers.retry import get_retry_policy
+from pycommonlog.providers.singleflight import AsyncSingleFlight
+from pycommonlog.cache import get_memory_cache
+
+CHATS_URL = "https://open.larksuite.com/open-apis/im/v1/chats"
+# Largest page size accepted by /im/v1/chats
+PAGE_SIZE = 100
+DEFAULT_REFRESH_INTERVAL = 600
+DEFAULT_RESCAN_INTERVAL = 30
+MEMORY_INDEX_SECONDS = 86400 * 30
+
+_scan_flight = AsyncSingleFlight()
+
+
+async def _in_thread(func, *args):
+    # asyncio.to_thread needs Python 3.9
+    return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+class LarkChatDirectory:
+    """
+    name -> chat_id index for one Lark app, stored as a Redis hash with an
+    in-memory fallback.
+
+    The index is filled page by page as chats are listed, so a lookup is a
+    single HGET. Misses trigger a scan that stops as soon as the name is
+    found; a name still missing after a complete scan is not rescanned for
+    rescan_interval seconds. Once used, the index is refreshed in the
+    background every refresh_interval seconds.
+
+    /im/v1/chats has no way to list only chats changed since a point in
+    time, so a refresh is a complete listing: renamed and deleted chats can
+    only be detected by seeing every chat. Pages are merged into the index
+    as they arrive, so lookups keep working during a refresh, and names that
+    are still missing are pruned only after the listing completes. New chats
+    do not wait for a refresh: a miss scans until it finds them.
+    """
+
+    def __init__(self, index_key, refresh_interval=DEFAULT_REFRESH_INTERVAL, rescan_interval=DEFAULT_RESCAN_INTERVAL):
+        self.index_key = index_key
+        self.refresh_interval = refresh_interval
+        self.rescan_interval = rescan_interval
+        self._scan_lock = threading.Lock()
+        self._memory_lock = threading.Lock()
+        self._last_complete_scan = None
+        self._source = None  # (provider, config) used by background refreshes
+        self._refresh_thread = None
+
+    # ---- storage ----
+
+    def get(self, config, channel_name):
+        try:
+            chat_id = get_redis_client(config).hget(self.index_key, channel_name)
+            if chat_id:
+                debug_log(config, "Lark chat ID retrieved from Redis index: %s", self.index_key)
+            return chat_id
+        except Exception:
+            index = get_memory_cache().get(self.index_key) or {}
+            return index.get(channel_name)
+
+    def _store(self, config, mapping):
+        try:
+            get_redis_client(config).hset(self.index_key, mapping=mapping)
+        except Exception:
+            with self._memory_lock:
+                index = dict(get_memory_cache().get(self.index_key) or {})
+                index.update(mapping)
+                get_memory_cache().set(self.index_key, index, MEMORY_INDEX_SECONDS)
+
+    def _prune(self, config, keep):
+        try:
+            client = get_redis_client(config)
+            stale = [name for name in client.hkeys(self.index_key) if name not in keep]
+            if stale:
+                client.hdel(self.index_key, *stale)
+        except Exception:
+            with self._memory_lock:
+                index = get_memory_cache().get(self.index_key) or {}
+                get_memory_cache().set(self.index_key, {name: chat_id for name, chat_id in index.items() if name in keep}, MEMORY_INDEX_SECONDS)
+
+    # ---- lookups ----
+
+    def resolve(self, provider, config, token, channel_name):
+        """
+        Resolve a channel name to a chat_id.
+
+        Returns:
+            The chat_id, or None if no chat with that name exists
+        """
+        chat_id = self.get(config, channel_name)
+        if chat_id:
+            return chat_id
+        # Only one scan at a time; concurrent misses wait and re-check the index
+        with self._scan_lock:
+            chat_id = self.get(config, channel_name)
+            if chat_id:
+                return chat_id
+            if self._last_complete_scan is not None and time.monotonic() - self._last_complete_scan < self.rescan_interval:
+                debug_log(config, "Lark channel '%s' missing from a recent complete scan, skipping rescan", channel_name)
+                return None
+            chat_id = self._scan(provider, config, token, stop_at=channel_name)
+        self._ensure_refresher(provider, config)
+        return chat_id
+
+    async def resolve_async(self, provider, config, token, channel_name, sync_provider):
+        """
+        Coroutine version of resolve() for AsyncLarkProvider.
+
+        Pages are fetched with the async provider; index reads and writes
+        run on a worker thread. Concurrent misses for a name on one event
+        loop share a scan.
+
+        Args:
+            sync_provider: LarkProvider used by the background refresh,
+                which runs on a thread
+        """
+        chat_id = await _in_thread(self.get, config, channel_name)
+        if chat_id:
+            return chat_id
+        if self._last_complete_scan is not None and time.monotonic() - self._last_complete_scan < self.rescan_interval:
+            debug_log(config, "Lark channel '%s' missing from a recent complete scan, skipping rescan", channel_name)
+            return None
+        chat_id = await _scan_flight.do((self.index_key, channel_name), self._scan_async, provider, config, token, channel_name)
+        self._ensure_refresher(sync_provider, config)
+        return chat_id
+
+    def refresh(self, provider, config, token):
+        """List every chat, merge it into the index and drop chats that no longer exist"""
+        with self._scan_lock:
+            self._scan(provider, config, token)
+
+    @staticmethod
+    def _page_url(page_token):
+        url = f"{CHATS_URL}?page_size={PAGE_SIZE}"
+        if page_token:
+            url += f"&page_token={page_token}"
+        return url
+
+    @staticmethod
+    def _page_mapping(items):
+        return {item["name"]: item["chat_id"] for item in items if item.get("name") and item.get("chat_id")}
+
+    def _scan(self, provider, config, token, stop_at=None):
+        headers = {"Authorization": f"Bearer {token}"}
+        seen = set()
+        page_token = ""
+        has_more = True
+        pages = 0
+        while has_more:
+            items, page_token, has_more = get_retry_policy(config).call(provider._fetch_chats_page, config, self._page_url(page_token), headers, operation="lark.im.chats")
+            pages += 1
+            mapping = self._page_mapping(items)
+            if mapping:
+                self._store(config, mapping)
+                seen.update(mapping)
+            if stop_at is not None and stop_at in mapping:
+                debug_log(config, "Lark chat index: found '%s' after %s page(s)", stop_at, pages)
+                return mapping[stop_at]
+        self._complete_scan(config, seen, pages)
+        return None
+
+    async def _scan_async(self, provider, config, token, stop_at):
+        headers = {"Authorization": f"Bearer {token}"}
+        seen = set()
+        page_token = ""
+        has_more = True
+        pages = 0
+        while has_more:
+            items, page_token, has_more = await get_retry_policy(config).call_async(provider._fetch_chats_page, config, self._page_url(page_token), headers, operation="lark.im.chats")
+            pages += 1
+            mapping = self._page_mapping(items)
+            if mapping:
+                await _in_thread(self._store, config, mapping)
+                seen.update(mapping)
+            if stop_at in mapping:
+                debug_log(config, "Lark chat index: found '%s' after %s page(s)", stop_at, pages)
+                return mapping[stop_at]
+        await _in_thread(self._complete_scan, config, seen, pages)
+        return None
+
+    def _complete_scan(self, config, seen, pages):
+        debug_log(config, "Lark chat index: complete scan of %s chats in %s page(s)", len(seen), pages)
+        self._prune(config, seen)
+        self._last_complete_scan = time.monotonic()
+
+    # ---- background refresh ----
+
+    def _ensure_refresher(self, provider, config):
+        self._source = (provider, config)
+        if not self.refresh_interval or self._refresh_thread is not None:
+            return
+        with self._scan_lock:
+            if self._refresh_thread is None:
+                self._refresh_thread = threading.Thread(target=self._refresh_worker, name="commonlog-lark-directory", daemon=True)
+                self._refresh_thread.start()
+
+    def _refresh_worker(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            provider, config = self._source
+            try:
+                self.refresh(provider, config, provider.get_access_token(config))
+            except Exception as e:
+                debug_log(config, "Lark chat index background refresh failed: %s", e)
+
+
+# Shared directories, one per environment and Lark app
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+def get_chat_directory(config, app_id=None):
+    """
+    Get the shared LarkChatDirectory for config's environment and Lark app.
+
+    Args:
+        config: Config
+        app_id: Lark app id, or None when a raw access token is configured
+    """
+    identity = app_id or hashlib.sha1(str(config.provider_config.get("token", "")).encode("utf-8")).hexdigest()[:16]
+    index_key = f"commonlog_lark_chat_index:{config.environment}:{identity}"
+    directory = _directories.get(index_key)
+    if directory is not None:
+        return directory
+    with _directories_lock:
+        directory = _directories.get(index_key)
+        if directory is None:
+            directory = LarkChatDirectory(
+                index_key,
+                refresh_interval=config.provider_config.get("lark_chat_index_refresh", DEFAULT_REFRESH_INTERVAL),
+                rescan_interval=config.provider_config.get("lark_chat_index_rescan", DEFAULT_RESCAN_INTERVAL),
+            )
+            _directories[index_key] = directory
+        return directory
@@ -0,0 +1,434 @@
+"""
+Client-side rate limiting for commonlog providers
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+
+from pycommonlog.log_types import SendContext, debug_log
+from pycommonlog.providers.redis_client import get_redis_client
+from pycommonlog.providers.retry import ProviderHTTPError
+
+# Sustained messages per second per channel, following the documented API limits
+DEFAULT_RATES = {
+    "slack": 1.0,  # chat.postMessage: about 1 message per second per channel
+    "lark": 5.0,   # im/v1/messages: 5 QPS per chat
+}
+DEFAULT_BURST = 3
+DEFAULT_MAX_WAIT = 5.0
+DEFAULT_MAX_RESENDS = 3
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimitedError(ProviderHTTPError):
+    """
+    Raised when a request is, or would be, rejected by the provider's rate limit.
+
+    status_code is 429 for provider rejections and None for the client-side limiter.
+    """
+
+    def __init__(self, message, retry_after=None, status_code=None):
+        super().__init__(message, status_code)
+        self.retry_after = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+
+
+def parse_retry_after(headers):
+    """Seconds to wait from Retry-After (Slack) or x-ogw-ratelimit-reset (Lark) headers"""
+    for header in ("Retry-After", "x-ogw-ratelimit-reset"):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def check_rate_limited(response, what, limiter=None, bucket=None):
+    """
+    Raise RateLimitedError if response is a rate-limit rejection.
+
+    Args:
+        response: HTTP response
+        what: Prefix for the error message, e.g. "Slack WebClient"
+        limiter: Optional RateLimiter whose bucket is held back for Retry-After
+        bucket: (provider, token, channel) key of that bucket
+    """
+    if response.status_code == 429 or (response.status_code == 400 and "x-ogw-ratelimit-reset" in response.headers):
+        retry_after = parse_retry_after(response.headers)
+        error = RateLimitedError(f"{what} response: {response.status_code}", retry_after, status_code=429)
+        if limiter is not None and bucket is not None:
+            limiter.penalize(*bucket, error.retry_after)
+        raise error
+
+
+class TokenBucket:
+    """
+    In-process token bucket.
+
+    reserve() hands out tokens ahead of time, so concurrent callers are spread
+    out at the sustained rate instead of all retrying at once.
+    """
+
+    def __init__(self, rate, burst=DEFAULT_BURST):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait):
+        """
+        Reserve one token.
+
+        Returns:
+            (reserved, wait) - seconds the caller must wait before sending; when
+            the wait would exceed max_wait nothing is reserved
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True, 0.0
+            wait = (1 - self._tokens) / self.rate
+            if wait > max_wait:
+                return False, wait
+            self._tokens -= 1
+            return True, wait
+
+    def penalize(self, retry_after):
+        """Hold back the next token until retry_after seconds from now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 1 - retry_after * self.rate)
+
+
+class RedisTokenBucket:
+    """
+    Token bucket stored in Redis so every process shares one budget per key.
+
+    Falls back to a local TokenBucket when Redis is unavailable.
+    """
+
+    # Returns {reserved, wait}; wait is a string because Lua numbers are truncated to integers
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local penalty = tonumber(ARGV[4])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local reserved = 1
+local wait = 0
+if penalty > 0 then
+    tokens = math.min(tokens, 1 - penalty * rate)
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+    if wait > max_wait then
+        reserved = 0
+    else
+        tokens = tokens - 1
+    end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {reserved, tostring(wait)}
+"""
+
+    def __init__(self, config, key, rate, burst=DEFAULT_BURST):
+        self.config = config
+        self.key = key
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.fallback = TokenBucket(rate, burst)
+
+    def _eval(self, max_wait, penalty):
+        client = get_redis_client(self.config)
+        reserved, wait = client.eval(self.SCRIPT, 1, self.key, self.rate, self.burst, max_wait, penalty)
+        return bool(int(reserved)), float(wait)
+
+    def reserve(self, max_wait):
+        try:
+            return self._eval(max_wait, 0)
+        except Exception:
+            return self.fallback.reserve(max_wait)
+
+    def penalize(self, retry_after):
+        try:
+            self._eval(0, retry_after)
+        except Exception:
+            self.fallback.penalize(retry_after)
+
+
+class RateLimiter:
+    """
+    Token buckets per (provider, token, channel).
+    """
+
+    def __init__(self, config):
+        provider_config = config.provider_config
+        self.config = config
+        self.rate = provider_config.get("rate_limit_per_second")
+        self.burst = provider_config.get("rate_limit_burst", DEFAULT_BURST)
+        self.max_wait = provider_config.get("rate_limit_max_wait", DEFAULT_MAX_WAIT)
+        self.distributed = provider_config.get("rate_limit_backend", "memory") == "redis"
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, provider, token, channel):
+        # Tokens are hashed so secrets never end up in Redis key names
+        token_hash = hashlib.sha1(str(token).encode("utf-8")).hexdigest()[:16]
+        key = f"commonlog_ratelimit:{provider}:{token_hash}:{channel}"
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            return bucket
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rate = self.rate or DEFAULT_RATES.get(provider, 1.0)
+                if self.distributed:
+                    bucket = RedisTokenBucket(self.config, key, rate, self.burst)
+                else:
+                    bucket = TokenBucket(rate, self.burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def reserve(self, provider, token, channel):
+        """
+        Reserve a send slot and return the seconds to wait for it.
+
+        Raises:
+            RateLimitedError: if the wait would exceed max_wait
+        """
+        reserved, wait = self.bucket(provider, token, channel).reserve(self.max_wait)
+        if not reserved:
+            raise RateLimitedError(f"{provider} client-side rate limit for channel {channel}", wait)
+        return wait
+
+    def throttle(self, provider, token, channel):
+        """Block until a send slot is available, see reserve()"""
+        wait = self.reserve(provider, token, channel)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def throttle_async(self, provider, token, channel):
+        """
+        Coroutine version of throttle().
+
+        Uses the in-process bucket even in distributed mode, so the event
+        loop never blocks on a Redis round-trip.
+        """
+        bucket = self.bucket(provider, token, channel)
+        reserved, wait = getattr(bucket, "fallback", bucket).reserve(self.max_wait)
+        if not reserved:
+            raise RateLimitedError(f"{provider} client-side rate limit for channel {channel}", wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, provider, token, channel, retry_after):
+        self.bucket(provider, token, channel).penalize(retry_after)
+
+
+# Shared rate limiters keyed by their settings, so every provider instance
+# sending with the same configuration draws from the same buckets
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(config):
+    """
+    Get the shared RateLimiter for config, or None if rate limiting is disabled.
+    """
+    provider_config = getattr(config, 'provider_config', {})
+    if not provider_config.get("rate_limit", False):
+        return None
+    key = (
+        provider_config.get("rate_limit_per_second"),
+        provider_config.get("rate_limit_burst", DEFAULT_BURST),
+        provider_config.get("rate_limit_max_wait", DEFAULT_MAX_WAIT),
+        provider_config.get("rate_limit_backend", "memory"),
+        provider_config.get("redis_host"),
+        provider_config.get("redis_port"),
+    )
+    limiter = _limiters.get(key)
+    if limiter is not None:
+        return limiter
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(config)
+            _limiters[key] = limiter
+        return limiter
+
+
+class ResendScheduler:
+    """
+    Runs delayed resends of rate-limited alerts on a single background thread.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0  # scheduled + running resends
+        self._thread = None
+
+    def schedule(self, delay, func, *args, **kwargs):
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), func, args, kwargs))
+            self._unfinished += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="commonlog-resend", daemon=True)
+                self._thread.start()
+            self._wakeup.notify()
+
+    def pending(self):
+        """Number of resends that are waiting or running"""
+        with self._lock:
+            return self._unfinished
+
+    def flush(self, timeout=None):
+        """
+        Wait until every scheduled resend has run, including resends they
+        schedule in turn.
+
+        Args:
+            timeout: Maximum seconds to wait, or None to wait indefinitely
+
+        Returns:
+            True if no resends are left, False if the timeout elapsed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._all_done.wait(remaining)
+            return True
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, func, args, kwargs = heapq.heappop(self._heap)
+                        break
+                    self._wakeup.wait(self._heap[0][0] - now if self._heap else None)
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"Failed to send alert: {e}")
+            finally:
+                with self._lock:
+                    self._unfinished -= 1
+                    if self._unfinished <= 0:
+                        self._unfinished = 0
+                        self._all_done.notify_all()
+
+    def _reinit_after_fork(self):
+        # Resends belong to the parent; the child starts empty with a fresh lock
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._all_done = threading.Condition(self._lock)
+        self._unfinished = 0
+        self._thread = None
+
+
+_resend_scheduler = ResendScheduler()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_resend_scheduler._reinit_after_fork)
+
+
+def get_resend_scheduler():
+    """Get the global ResendScheduler"""
+    return _resend_scheduler
+
+
+ATEXIT_DRAIN_TIMEOUT = 5.0
+
+
+def _drain_at_exit():
+    # Runs after the dispatchers drained, see logger._close_at_exit
+    try:
+        _resend_scheduler.flush(ATEXIT_DRAIN_TIMEOUT)
+    except Exception:
+        pass
+
+
+def send_or_schedule(send, *args, config, attempt=0, resend=None):
+    """
+    Call send(*args, config); if it is rate limited, schedule a resend after
+    the provider's Retry-After instead of raising, up to
+    rate_limit_max_resends times.
+
+    Returns:
+        None if the alert was sent, or a concurrent.futures.Future for the
+        deferred delivery: it resolves once a resend succeeds, or with the
+        error of the last attempt
+    """
+    try:
+        send(*args, config)
+    except RateLimitedError as e:
+        max_resends = config.provider_config.get("rate_limit_max_resends", DEFAULT_MAX_RESENDS)
+        if attempt >= max_resends:
+            if resend is not None:
+                resend.set_exception(e)
+            raise
+        debug_log(config, "Rate limited (%s), resending in %.2fs (resend %s/%s)", e, e.retry_after, attempt + 1, max_resends)
+        if resend is None:
+            resend = concurrent.futures.Future()
+        # Pin the channel: a plain Config may be changed by the caller once we return
+        get_resend_scheduler().schedule(e.retry_after, send_or_schedule, send, *args, config=SendContext(config), attempt=attempt + 1, resend=resend)
+        return resend
+    except Exception as e:
+        if resend is not None:
+            resend.set_exception(e)
+        raise
+    if resend is not None:
+        resend.set_result(None)
+    return None
+
+
+async def send_or_resend_async(send, *args, config):
+    """
+    Await send(*args, config), sleeping for the provider's Retry-After and
+    resending when it is rate limited, up to rate_limit_max_resends times.
+    """
+    max_resends = config.provider_config.get("rate_limit_max_resends", DEFAULT_MAX_RESENDS)
+    attempt = 0
+    while True:
+        try:
+            return await send(*args, config)
+        except RateLimitedError as e:
+            if attempt >= max_resends:
+                raise
+            attempt += 1
+            debug_log(config, "Rate limited (%s), resending in %.2fs (resend %s/%s)", e, e.retry_after, attempt, max_resends)
+            await asyncio.sleep(e.retry_after)
@@ -1,22 +1,40 @@
 """
 Redis client for commonlog (Python)
 """
+import asyncio
+import threading
+import weakref
+
+from pycommonlog.providers.circuit_breaker import (
+    CircuitBreaker, CircuitOpenError, GuardedClient, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT,
+)
+
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
 
 class RedisConfigError(Exception):
     pass
 
-def get_redis_client(config):
-    import redis  # Import lazily to avoid distutils issues in Python 3.12+
+def _connection_settings(config):
+    """Connection parameters from config.provider_config; also the registry key"""
     provider_config = getattr(config, 'provider_config', {})
     host = provider_config.get('redis_host')
     port = provider_config.get('redis_port')
-    password = provider_config.get('redis_password')
-    ssl = provider_config.get('redis_ssl', False)
-    cluster_mode = provider_config.get('redis_cluster_mode', False)
-    db = provider_config.get('redis_db', 0)
-
     if not host or not port:
         raise RedisConfigError("redis_host and redis_port must be set in provider_config")
+    return (
+        host,
+        int(port),
+        provider_config.get('redis_password'),
+        provider_config.get('redis_ssl', False),
+        provider_config.get('redis_cluster_mode', False),
+        int(provider_config.get('redis_db', 0)),
+        provider_config.get('redis_max_connections'),
+        provider_config.get('redis_health_check_interval', DEFAULT_HEALTH_CHECK_INTERVAL),
+    )
+
+def _create_redis_client(settings):
+    import redis  # Import lazily to avoid distutils issues in Python 3.12+
+    host, port, password, ssl, cluster_mode, db, max_connections, health_check_interval = settings
 
     if cluster_mode:
         # Use RedisCluster for cluster mode (ElastiCache with cluster mode enabled)
@@ -25,27 +43,199 @@ def get_redis_client(config):
         except ImportError:
             raise RedisConfigError("Redis cluster support is not available. Please upgrade redis package to version 4.0.0 or later")
 
-        # For cluster mode, we need to handle startup nodes differently
-        # ElastiCache cluster mode provides a single endpoint
-        startup_nodes = [{"host": host, "port": int(port)}]
-
+        # ElastiCache cluster mode provides a single endpoint; the slot map is
+        # discovered from it once and kept for the lifetime of the client
+        options = {"max_connections": max_connections} if max_connections else {}
         return RedisCluster(
-            startup_nodes=startup_nodes,
+            host=host,
+            port=port,
             password=password,
             ssl=ssl,
             decode_responses=True,
             skip_full_coverage_check=True,  # Allow partial cluster access
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            **options,
         )
     else:
-        # Standard Redis client for single node or ElastiCache without cluster mode
-        return redis.StrictRedis(
+        # Standard Redis client for single node or ElastiCache without cluster mode.
+        # Connections are opened lazily and re-opened on the next command after a
+        # failure; idle ones are PINGed before reuse after health_check_interval.
+        pool = redis.ConnectionPool(
+            connection_class=redis.SSLConnection if ssl else redis.Connection,
             host=host,
-            port=int(port),
+            port=port,
+            password=password,
+            db=db,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            socket_keepalive=True,
+            retry_on_timeout=True,
+            health_check_interval=health_check_interval,
+            max_connections=max_connections,
+        )
+        return redis.StrictRedis(connection_pool=pool)
+
+def _failure_types():
+    import redis
+    # Errors meaning Redis could not be reached; anything else means it answered
+    return (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError)
+
+# Circuit breakers per Redis target, shared by sync and asyncio clients
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_redis_breaker(config):
+    """
+    Get the CircuitBreaker guarding config's Redis target, or None if disabled.
+    """
+    provider_config = getattr(config, 'provider_config', {})
+    if not provider_config.get('redis_circuit_breaker', True):
+        return None
+    host, port, _, _, cluster_mode, db = _connection_settings(config)[:6]
+    name = f"{host}:{port}" if cluster_mode else f"{host}:{port}/{db}"
+    breaker = _breakers.get(name)
+    if breaker is not None:
+        return breaker
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=provider_config.get('redis_breaker_failure_threshold', DEFAULT_FAILURE_THRESHOLD),
+                reset_timeout=provider_config.get('redis_breaker_reset_timeout', DEFAULT_RESET_TIMEOUT),
+            )
+            _breakers[name] = breaker
+        return breaker
+
+def get_redis_breaker_states():
+    """
+    Returns:
+        {"host:port/db": {state, failures, trips, rejected, open_for}} for every Redis target used
+    """
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+def _check_breaker(config):
+    breaker = get_redis_breaker(config)
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError(f"Redis circuit open for {breaker.name}")
+    return breaker
+
+def _create_guarded(create, settings, breaker):
+    try:
+        client = create(settings)
+    except _failure_types():
+        if breaker is not None:
+            breaker.record_failure()
+        raise
+    if breaker is None:
+        return client
+    return GuardedClient(client, breaker, _failure_types())
+
+# One client, and so one connection pool, per Redis target in this process
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_redis_client(config):
+    """
+    Get the shared Redis client for the connection settings in config.provider_config.
+
+    While the target's circuit is open this raises CircuitOpenError right
+    away instead of waiting for connection timeouts, so callers fall back to
+    memory immediately.
+
+    Raises:
+        RedisConfigError: if redis_host/redis_port are missing
+        CircuitOpenError: if Redis is considered down
+    """
+    settings = _connection_settings(config)
+    breaker = _check_breaker(config)
+    client = _clients.get(settings)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(settings)
+        if client is None:
+            # Failures are not cached, so an unreachable cluster is retried on the next call
+            client = _create_guarded(_create_redis_client, settings, breaker)
+            _clients[settings] = client
+        return client
+
+def reset_redis_clients():
+    """Disconnect and forget every shared Redis client"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def _create_async_redis_client(settings):
+    try:
+        import redis.asyncio as aioredis  # Import lazily, only needed for the asyncio API
+    except ImportError:
+        raise RedisConfigError("Async Redis support is not available. Please upgrade redis package to version 4.2.0 or later")
+    host, port, password, ssl, cluster_mode, db, max_connections, health_check_interval = settings
+
+    if cluster_mode:
+        from redis.asyncio.cluster import RedisCluster
+        options = {"max_connections": max_connections} if max_connections else {}
+        return RedisCluster(
+            host=host,
+            port=port,
             password=password,
-            db=int(db),
             ssl=ssl,
             decode_responses=True,
+            health_check_interval=health_check_interval,
+            **options,
+        )
+    else:
+        pool = aioredis.ConnectionPool(
+            connection_class=aioredis.SSLConnection if ssl else aioredis.Connection,
+            host=host,
+            port=port,
+            password=password,
+            db=db,
+            decode_responses=True,
             socket_connect_timeout=5,
             socket_timeout=5,
+            socket_keepalive=True,
             retry_on_timeout=True,
+            health_check_interval=health_check_interval,
+            max_connections=max_connections,
         )
+        return aioredis.StrictRedis(connection_pool=pool)
+
+# asyncio connections are bound to the loop that opened them, so async
+# clients are shared per event loop
+_async_clients = weakref.WeakKeyDictionary()
+_async_clients_lock = threading.Lock()
+
+def get_async_redis_client(config):
+    """
+    Get the shared redis.asyncio client for config on the running event loop.
+
+    Raises:
+        RedisConfigError: if redis_host/redis_port are missing or redis.asyncio is unavailable
+        CircuitOpenError: if Redis is considered down
+    """
+    settings = _connection_settings(config)
+    breaker = _check_breaker(config)
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(settings)
+        if client is None:
+            client = _create_guarded(_create_async_redis_client, settings, breaker)
+            clients[settings] = client
+        return client
+
+
+async def close_async_redis_client(client):
+    # redis>=5 renamed close() to aclose()
+    closer = getattr(client, 'aclose', None) or client.close
+    await closer()
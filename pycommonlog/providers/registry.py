@@ -0,0 +1,140 @@
+"""
+Provider registry for commonlog
+"""
+import importlib
+import logging
+import threading
+
+from pycommonlog.providers.slack import SlackProvider
+from pycommonlog.providers.lark import LarkProvider
+from pycommonlog.providers.async_slack import AsyncSlackProvider
+from pycommonlog.providers.async_lark import AsyncLarkProvider
+
+ENTRY_POINT_GROUP = "pycommonlog.providers"
+ASYNC_ENTRY_POINT_GROUP = "pycommonlog.async_providers"
+DEFAULT_PROVIDER = "slack"
+
+# Provider factories by name: called with no arguments, return a Provider
+_factories = {"slack": SlackProvider, "lark": LarkProvider}
+_async_factories = {"slack": AsyncSlackProvider, "lark": AsyncLarkProvider}
+_factories_lock = threading.Lock()
+
+
+def register_provider(name, factory, asyncio=False):
+    """
+    Register a provider factory under name, replacing any existing one.
+
+    Args:
+        name: Name used in provider_config["provider"] and custom_send
+        factory: Callable with no arguments returning a Provider (usually the class)
+        asyncio: Register for AsyncCommonlog instead of commonlog
+    """
+    with _factories_lock:
+        (_async_factories if asyncio else _factories)[name] = factory
+    # Instances built by the previous factory must not be handed out any more
+    with _providers_lock:
+        for key in [key for key in _providers if key[:2] == (name, asyncio)]:
+            del _providers[key]
+
+
+def _load_entry_point(name, group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return None
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        matches = list(eps.select(group=group, name=name))
+    else:
+        # Python < 3.10 returns a dict of groups
+        matches = [ep for ep in eps.get(group, []) if ep.name == name]
+    return matches[0].load() if matches else None
+
+
+def _import_string(path):
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def resolve_provider_factory(name, asyncio=False):
+    """
+    Find the factory for a provider name.
+
+    Looks in the registered providers, then the "pycommonlog.providers"
+    (or "pycommonlog.async_providers") entry point group, then treats
+    "package.module:Class" as an import path. Entry point and import path
+    lookups are registered so they happen once.
+
+    Returns:
+        The factory, or None if name is unknown
+    """
+    factories = _async_factories if asyncio else _factories
+    factory = factories.get(name)
+    if factory is not None:
+        return factory
+    try:
+        factory = _load_entry_point(name, ASYNC_ENTRY_POINT_GROUP if asyncio else ENTRY_POINT_GROUP)
+        if factory is None and ":" in name:
+            factory = _import_string(name)
+    except Exception as e:
+        logging.warning(f"Failed to load provider {name}: {e}")
+        return None
+    if factory is not None:
+        with _factories_lock:
+            factory = factories.setdefault(name, factory)
+    return factory
+
+
+def _resolve(name, asyncio):
+    factory = resolve_provider_factory(name, asyncio)
+    if factory is None:
+        logging.warning(f"Unknown provider: {name}, defaulting to Slack")
+        name = DEFAULT_PROVIDER
+        factory = (_async_factories if asyncio else _factories)[name]
+    return name, factory
+
+
+def create_provider(name, asyncio=False):
+    """Create a new, unshared provider instance; unknown names default to Slack"""
+    return _resolve(name, asyncio)[1]()
+
+
+def _credentials_key(config):
+    provider_config = getattr(config, "provider_config", {}) or {}
+    lark_token = provider_config.get("lark_token")
+    return (
+        provider_config.get("token"),
+        provider_config.get("slack_token"),
+        getattr(lark_token, "app_id", None),
+        getattr(lark_token, "app_secret", None),
+    )
+
+
+# One long-lived provider per (name, asyncio, credentials) in this process
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name, config, asyncio=False):
+    """
+    Get the shared provider instance for name and config's credentials.
+
+    Reusing one instance keeps its transport, caches and rate limiter warm
+    across custom_send and fan-out calls. Unknown names default to Slack.
+    """
+    key = (name, asyncio, _credentials_key(config))
+    provider = _providers.get(key)
+    if provider is not None:
+        return provider
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = create_provider(name, asyncio)
+            _providers[key] = provider
+        return provider
+
+
+def reset_providers():
+    """Forget every shared provider instance"""
+    with _providers_lock:
+        _providers.clear()
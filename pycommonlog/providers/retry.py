@@ -0,0 +1,222 @@
+"""
+Retry policy for commonlog provider requests
+"""
+import asyncio
+import random
+import sys
+import threading
+import time
+
+from pycommonlog import metrics, tracing
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 8.0
+DEFAULT_DEADLINE = 30.0
+
+RETRYABLE_STATUS_CODES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+
+class ProviderHTTPError(Exception):
+    """Raised when a provider API answers with an unexpected HTTP status"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _set_status_code(span, status_code):
+    if status_code is not None:
+        span.set_attribute("http.status_code", status_code)
+
+
+def is_retryable(error):
+    """
+    Classify an error raised by a provider request.
+
+    Retryable: 5xx, 408/425/429, connection errors and timeouts.
+    Fatal: other 4xx (bad token, unknown channel, ...) and everything else.
+    """
+    if isinstance(error, ProviderHTTPError):
+        return error.status_code in RETRYABLE_STATUS_CODES or (error.status_code or 0) >= 500
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    httpx = sys.modules.get("httpx")
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    return False
+
+
+class RetryStats:
+    """
+    Thread-safe per-operation counters used to tune retry policies.
+    """
+
+    FIELDS = ("calls", "attempts", "retries", "successes", "fatal", "exhausted")
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def incr(self, operation, field):
+        with self._lock:
+            counters = self._counters.get(operation)
+            if counters is None:
+                counters = self._counters[operation] = dict.fromkeys(self.FIELDS, 0)
+            counters[field] += 1
+
+    def snapshot(self):
+        """Return {operation: {counter: value}}"""
+        with self._lock:
+            return {operation: dict(counters) for operation, counters in self._counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class RetryPolicy:
+    """
+    Retries retryable errors with exponential backoff, full jitter and a
+    total deadline.
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, deadline=DEFAULT_DEADLINE, jitter=True):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+        self.stats = RetryStats()
+
+    def compute_delay(self, attempt, error=None):
+        """Backoff before retry number `attempt` (1-based)"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def _next_delay(self, attempt, error, started):
+        """Return the delay before the next attempt, or None to give up"""
+        if not is_retryable(error):
+            return None
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.compute_delay(attempt, error)
+        if getattr(error, "retry_after", None) is not None and delay > self.max_delay:
+            # Long Retry-After waits are left to the caller's resend scheduling
+            return None
+        if self.deadline is not None and time.monotonic() - started + delay > self.deadline:
+            return None
+        return delay
+
+    def _record_failure(self, operation, error):
+        self.stats.incr(operation, "exhausted" if is_retryable(error) else "fatal")
+
+    def call(self, func, *args, operation="request", **kwargs):
+        """
+        Call func(*args, **kwargs), retrying retryable errors.
+        """
+        started = time.monotonic()
+        self.stats.incr(operation, "calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            self.stats.incr(operation, "attempts")
+            try:
+                with metrics.timer("commonlog_http_seconds", operation=operation), tracing.span(operation, {"commonlog.attempt": attempt}) as span:
+                    try:
+                        result = func(*args, **kwargs)
+                    except ProviderHTTPError as e:
+                        _set_status_code(span, e.status_code)
+                        raise
+                    _set_status_code(span, getattr(result, "status_code", None))
+            except Exception as e:
+                delay = self._next_delay(attempt, e, started)
+                if delay is None:
+                    self._record_failure(operation, e)
+                    raise
+                self.stats.incr(operation, "retries")
+                time.sleep(delay)
+                continue
+            self.stats.incr(operation, "successes")
+            return result
+
+    async def call_async(self, func, *args, operation="request", **kwargs):
+        """
+        Await func(*args, **kwargs), retrying retryable errors.
+        """
+        started = time.monotonic()
+        self.stats.incr(operation, "calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            self.stats.incr(operation, "attempts")
+            try:
+                with metrics.timer("commonlog_http_seconds", operation=operation), tracing.span(operation, {"commonlog.attempt": attempt}) as span:
+                    try:
+                        result = await func(*args, **kwargs)
+                    except ProviderHTTPError as e:
+                        _set_status_code(span, e.status_code)
+                        raise
+                    _set_status_code(span, getattr(result, "status_code", None))
+            except Exception as e:
+                delay = self._next_delay(attempt, e, started)
+                if delay is None:
+                    self._record_failure(operation, e)
+                    raise
+                self.stats.incr(operation, "retries")
+                await asyncio.sleep(delay)
+                continue
+            self.stats.incr(operation, "successes")
+            return result
+
+
+# Shared retry policies keyed by their settings, so stats accumulate per configuration
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_retry_policy(config):
+    """
+    Get the shared RetryPolicy for the retry settings in config.provider_config.
+    """
+    provider_config = getattr(config, 'provider_config', {})
+    key = (
+        provider_config.get('retry_max_attempts', DEFAULT_MAX_ATTEMPTS),
+        provider_config.get('retry_base_delay', DEFAULT_BASE_DELAY),
+        provider_config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+        provider_config.get('retry_deadline', DEFAULT_DEADLINE),
+        provider_config.get('retry_jitter', True),
+    )
+    policy = _policies.get(key)
+    if policy is not None:
+        return policy
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = RetryPolicy(*key)
+            _policies[key] = policy
+        return policy
+
+
+def get_retry_stats():
+    """
+    Merge the counters of every shared retry policy.
+
+    Returns:
+        {operation: {counter: value}}
+    """
+    merged = {}
+    for policy in list(_policies.values()):
+        for operation, counters in policy.stats.snapshot().items():
+            target = merged.setdefault(operation, dict.fromkeys(RetryStats.FIELDS, 0))
+            for field, value in counters.items():
+                target[field] += value
+    return merged
@@ -0,0 +1,143 @@
+"""
+Request de-duplication helpers for commonlog providers
+"""
+import asyncio
+import threading
+import time
+import uuid
+import weakref
+
+from pycommonlog.providers.redis_client import get_redis_client
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in
+    flight wait for and share its result or exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Coroutine version of SingleFlight; in-flight calls are tracked per event loop.
+
+    If the leading coroutine is cancelled, the callers waiting on it start
+    the call again instead of sharing the cancellation.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        future = calls.get(key)
+        while future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this caller was cancelled, not the leader
+            future = calls.get(key)
+        future = loop.create_future()
+        calls[key] = future
+        try:
+            result = await func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            calls.pop(key, None)
+            # Cancelled (or interrupted) before settling: release the waiters
+            if not future.done():
+                future.cancel()
+
+
+class RedisLock:
+    """
+    Best-effort cross-process lock: SET NX PX with an owner token.
+    """
+
+    RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, config, key, ttl_seconds):
+        self.config = config
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self._owner = uuid.uuid4().hex
+
+    def acquire(self):
+        """
+        Returns:
+            True if acquired, False if another process holds the lock,
+            None if Redis is unavailable
+        """
+        try:
+            client = get_redis_client(self.config)
+            return bool(client.set(self.key, self._owner, nx=True, px=int(self.ttl_seconds * 1000)))
+        except Exception:
+            return None
+
+    def wait_released(self, timeout, poll_interval=0.05):
+        """Wait until nobody holds the lock; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if not get_redis_client(self.config).exists(self.key):
+                    return True
+            except Exception:
+                return True
+            time.sleep(poll_interval)
+        return False
+
+    def release(self):
+        try:
+            get_redis_client(self.config).eval(self.RELEASE_SCRIPT, 1, self.key, self._owner)
+        except Exception:
+            pass
@@ -1,74 +1,258 @@
 """
 Slack Provider for commonlog
 """
-import requests
+import functools
+import hashlib
+import logging
+import re
 
-from pycommonlog.log_types import SendMethod, Provider, debug_log
+from pycommonlog.log_types import SendMethod, Provider, SendContext, debug_log
+from pycommonlog import metrics, tracing
+from pycommonlog.providers.transport import get_transport
+from pycommonlog.providers.retry import ProviderHTTPError, get_retry_policy
+from pycommonlog.providers.ratelimit import RateLimitedError, get_rate_limiter, check_rate_limited, send_or_schedule
+from pycommonlog.providers.tiered_cache import get_tiered_cache
+from pycommonlog.trace import TraceUpload, should_upload_trace, trace_max_bytes, truncate_trace, utf8_length
+from pycommonlog.templates import TextTemplate, JsonTemplate, get_template, LEVEL_NAMES, TEXT_FIELDS, PAYLOAD_FIELDS
 
-class SlackProvider(Provider):
-    def send_to_channel(self, level, message, attachment, config, channel):
-        original_channel = config.channel
-        config.channel = channel
-        self.send(level, message, attachment, config)
-        config.channel = original_channel
+SLACK_API_URL = "https://slack.com/api/"
+JSON_HEADERS = {"Content-Type": "application/json; charset=utf-8"}
+# Public, private and DM channel IDs; channel names are lowercase
+CHANNEL_ID_RE = re.compile(r"^[CGD][A-Z0-9]+$")
+# Largest page size accepted by conversations.list
+CONVERSATIONS_PAGE_SIZE = 1000
+DEFAULT_TEMPLATE = TextTemplate("{header}{message}{details}", TEXT_FIELDS)
 
-    def send(self, level, message, attachment, config):
-        debug_log(config, f"SlackProvider.send called with level: {level}, send method: {config.send_method}")
-        formatted_message = self._format_message(message, attachment, config)
-        if config.send_method == SendMethod.WEBCLIENT:
-            debug_log(config, "Using Slack webclient method")
-            self._send_slack_webclient(formatted_message, config)
-        elif config.send_method == SendMethod.WEBHOOK:
-            debug_log(config, "Using Slack webhook method")
-            self._send_slack_webhook(formatted_message, config)
-        else:
-            error_msg = f"Unknown send method for Slack: {config.send_method}"
-            debug_log(config, f"Error: {error_msg}")
-            raise ValueError(error_msg)
 
-    def _format_message(self, message, attachment, config):
-        formatted = ""
+@functools.lru_cache(maxsize=256)
+def slack_header(service_name, environment):
+    """The "*[service - environment]*" line, rendered once per pair"""
+    if service_name and environment:
+        return f"*[{service_name} - {environment}]*\n"
+    if service_name or environment:
+        return f"*[{service_name or environment}]*\n"
+    return ""
+
+
+def slack_title(service_name, environment):
+    if service_name and environment:
+        return f"{service_name} - {environment}"
+    return service_name or environment or ""
+
 
-        # Add service and environment header
-        if config.service_name and config.environment:
-            formatted += f"*[{config.service_name} - {config.environment}]*\n"
-        elif config.service_name:
-            formatted += f"*[{config.service_name}]*\n"
-        elif config.environment:
-            formatted += f"*[{config.environment}]*\n"
+def _body_kwargs(payload, headers=None, raw_key="data"):
+    """HTTP keyword arguments for a payload: a dict goes as json=, a body rendered from a template as is"""
+    if isinstance(payload, dict):
+        kwargs = {"json": payload}
+    else:
+        kwargs = {raw_key: payload.encode("utf-8")}
+        headers = headers or JSON_HEADERS
+    if headers is not None:
+        kwargs["headers"] = headers
+    return kwargs
 
-        formatted += message
 
+class SlackProvider(Provider):
+    def __init__(self, transport=None):
+        # Optional injected HTTPTransport; defaults to the shared one for the config
+        self.transport = transport
+
+    def _get_transport(self, config):
+        return self.transport or get_transport(config)
+
+    def send_to_channel(self, level, message, attachment, config, channel):
+        return self.send(level, message, attachment, SendContext(config, channel))
+
+    def send(self, level, message, attachment, config):
+        debug_log(config, "SlackProvider.send called with level: %s, send method: %s", level, config.send_method)
+        with tracing.span("slack.send", {"commonlog.provider": "slack", "commonlog.channel": config.channel, "commonlog.send_method": config.send_method}) as span:
+            with metrics.timer("commonlog_stage_seconds", provider="slack", stage="format"):
+                formatted_message = self._format_message(message, attachment, config, level=level)
+            if span.is_recording():
+                span.set_attribute("commonlog.payload_bytes", utf8_length(formatted_message))
+            if config.send_method == SendMethod.WEBCLIENT and should_upload_trace(attachment, config):
+                debug_log(config, "Using Slack webclient method with trace upload")
+                upload = TraceUpload.from_attachment(attachment)
+                upload_message = self._format_message(message, attachment, config, upload, level)
+                return send_or_schedule(self._send_slack_trace_upload, upload_message, formatted_message, upload, config=config)
+            elif config.send_method == SendMethod.WEBCLIENT:
+                debug_log(config, "Using Slack webclient method")
+                return send_or_schedule(self._send_slack_webclient, formatted_message, config=config)
+            elif config.send_method == SendMethod.WEBHOOK:
+                debug_log(config, "Using Slack webhook method")
+                return send_or_schedule(self._send_slack_webhook, formatted_message, config=config)
+            else:
+                error_msg = f"Unknown send method for Slack: {config.send_method}"
+                debug_log(config, "Error: %s", error_msg)
+                raise ValueError(error_msg)
+
+    def _format_message(self, message, attachment, config, upload=None, level=None):
+        # Trace and attachment parts are spliced into the template's single join,
+        # so a large trace is copied once
+        details = []
         if attachment and attachment.content:
             filename = attachment.file_name or "Trace Logs"
-            formatted += f"\n\n*{filename}:*\n```\n{attachment.content}\n```"
+            if upload is not None:
+                details.append(f"\n\n*{filename}:* attached as {upload.file_name}")
+            else:
+                details += ["\n\n*", filename, ":*\n```\n", truncate_trace(attachment.content, trace_max_bytes(config)), "\n```"]
         if attachment and attachment.url:
-            formatted += f"\n\n*Attachment:* {attachment.url}"
+            details.append(f"\n\n*Attachment:* {attachment.url}")
 
-        return formatted
+        return self._text_template(config).render(
+            header=slack_header(config.service_name, config.environment),
+            title=slack_title(config.service_name, config.environment),
+            service_name=config.service_name or "",
+            environment=config.environment or "",
+            level=LEVEL_NAMES.get(level, ""),
+            message=message,
+            details=details,
+            channel=config.channel or "",
+        )
 
-    def _send_slack_webclient(self, formatted_message, config):
-        debug_log(config, "send_slack_webclient: preparing API request")
+    @staticmethod
+    def _text_template(config):
+        source = config.provider_config.get("message_template")
+        if not source:
+            return DEFAULT_TEMPLATE
+        return get_template("text", source, lambda source: TextTemplate(source, TEXT_FIELDS))
+
+    @staticmethod
+    def _payload_values(formatted_message, config):
+        return {
+            "text": formatted_message,
+            "header": slack_header(config.service_name, config.environment),
+            "title": slack_title(config.service_name, config.environment),
+            "service_name": config.service_name or "",
+            "environment": config.environment or "",
+            "channel": config.channel or "",
+        }
+
+    @classmethod
+    def _render_blocks(cls, kind, skeleton, formatted_message, config):
+        """Render provider_config["slack_blocks"] into a full request body"""
+        blocks = config.provider_config["slack_blocks"]
+        template = get_template(kind, blocks, lambda blocks: JsonTemplate(dict(skeleton, blocks=blocks), PAYLOAD_FIELDS))
+        return template.render(**cls._payload_values(formatted_message, config))
+
+    @staticmethod
+    def _webclient_token(config):
         # Use slack_token if available, otherwise fall back to token
-        token = config.provider_config.get("token", "")
-        slack_token = config.provider_config.get("slack_token", "")
-        if slack_token:
-            token = slack_token
-            debug_log(config, "send_slack_webclient: using slack_token")
-        else:
-            debug_log(config, "send_slack_webclient: using token")
-        
+        return config.provider_config.get("slack_token", "") or config.provider_config.get("token", "")
+
+    @classmethod
+    def _build_webclient_request(cls, formatted_message, config):
+        """Return (url, headers, payload) for chat.postMessage"""
+        token = cls._webclient_token(config)
         url = "https://slack.com/api/chat.postMessage"
         headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
-        payload = {"channel": config.channel, "text": formatted_message}
-        debug_log(config, f"send_slack_webclient: sending to channel: {config.channel}, payload size: {len(str(payload))}")
-        
-        response = requests.post(url, headers=headers, json=payload)
-        debug_log(config, f"send_slack_webclient: response status: {response.status_code}, response data: {response.text}")
+        if config.provider_config.get("slack_blocks"):
+            payload = cls._render_blocks("slack.chat.postMessage", {"channel": "{channel}", "text": "{text}"}, formatted_message, config)
+        else:
+            payload = {"channel": config.channel, "text": formatted_message}
+        return url, headers, payload
+
+    @staticmethod
+    def _check_api_response(response, method):
+        """Return the JSON body of a Slack Web API response, raising if it is not ok"""
         if response.status_code != 200:
-            error_msg = f"Slack WebClient response: {response.status_code}"
-            debug_log(config, f"send_slack_webclient: error: {error_msg}")
-            raise Exception(error_msg)
+            raise ProviderHTTPError(f"Slack {method} response: {response.status_code}", response.status_code)
+        data = response.json()
+        if not data.get("ok"):
+            raise Exception(f"Slack {method} error: {data.get('error')}")
+        return data
+
+    @staticmethod
+    def _build_complete_upload_payload(formatted_message, upload, file_id, channel_id):
+        # The file and the alert text are posted to the channel as one message
+        return {
+            "files": [{"id": file_id, "title": upload.file_name}],
+            "channel_id": channel_id,
+            "initial_comment": formatted_message,
+        }
+
+    @staticmethod
+    def _channel_id_cache_key(token, channel_name):
+        # Tokens are hashed so secrets never end up in Redis key names
+        token_hash = hashlib.sha1(str(token).encode("utf-8")).hexdigest()[:16]
+        return f"commonlog_slack_channel_id:{token_hash}:{channel_name}"
+
+    @staticmethod
+    def _conversations_page_data(cursor):
+        data = {"types": "public_channel,private_channel", "exclude_archived": "true", "limit": CONVERSATIONS_PAGE_SIZE}
+        if cursor:
+            data["cursor"] = cursor
+        return data
+
+    @staticmethod
+    def _find_channel(page, channel_name):
+        """Return (channel ID or None, next cursor or "") for a conversations.list page"""
+        for channel in page.get("channels", []):
+            if channel.get("name") == channel_name:
+                return channel.get("id"), ""
+        return None, (page.get("response_metadata") or {}).get("next_cursor", "")
+
+    def _resolve_channel_id(self, config, api, headers):
+        """
+        Channel ID for files.completeUploadExternal, which does not accept
+        names: config.channel itself if it is an ID, otherwise looked up with
+        conversations.list and cached without expiry.
+        """
+        channel = config.channel or ""
+        if CHANNEL_ID_RE.match(channel):
+            return channel
+        name = channel.lstrip("#")
+        key = self._channel_id_cache_key(self._webclient_token(config), name)
+        cache = get_tiered_cache(config)
+        channel_id = cache.get(config, key)
+        if channel_id:
+            debug_log(config, "Slack channel ID retrieved from cache for key: %s", key)
+            return channel_id
+        cursor = ""
+        while True:
+            page = get_retry_policy(config).call(api, "conversations.list", headers=headers, data=self._conversations_page_data(cursor),
+                                                 operation="slack.conversations.list")
+            channel_id, cursor = self._find_channel(page, name)
+            if channel_id:
+                cache.set(config, key, channel_id)
+                return channel_id
+            if not cursor:
+                raise Exception(f"Slack channel '{channel}' not found")
+
+    @classmethod
+    def _build_webhook_payload(cls, formatted_message, config):
+        """Return the webhook payload: a dict, or a rendered JSON body with slack_blocks"""
+        if config.provider_config.get("slack_blocks"):
+            if config.channel:
+                return cls._render_blocks("slack.webhook.channel", {"text": "{text}", "channel": "{channel}"}, formatted_message, config)
+            return cls._render_blocks("slack.webhook", {"text": "{text}"}, formatted_message, config)
+        payload = {"text": formatted_message}
+        # If channel is specified, include it in the payload
+        if config.channel:
+            payload["channel"] = config.channel
+        return payload
+
+    def _send_slack_webclient(self, formatted_message, config):
+        debug_log(config, "send_slack_webclient: preparing API request")
+        url, headers, payload = self._build_webclient_request(formatted_message, config)
+        debug_log(config, lambda: f"send_slack_webclient: sending to channel: {config.channel}, payload size: {len(str(payload))}")
+        
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", self._webclient_token(config), config.channel)
+
+        def post():
+            if limiter is not None:
+                limiter.throttle(*bucket)
+            response = self._get_transport(config).post(url, **_body_kwargs(payload, headers))
+            debug_log(config, lambda: f"send_slack_webclient: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Slack WebClient", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Slack WebClient response: {response.status_code}"
+                debug_log(config, "send_slack_webclient: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        get_retry_policy(config).call(post, operation="slack.chat.postMessage")
         debug_log(config, "send_slack_webclient: message sent successfully")
 
     def _send_slack_webhook(self, formatted_message, config):
@@ -77,20 +261,73 @@ class SlackProvider(Provider):
         webhook_url = config.provider_config.get("token", "")
         if not webhook_url:
             error_msg = "Webhook URL is required for Slack webhook method"
-            debug_log(config, f"Error: {error_msg}")
+            debug_log(config, "Error: %s", error_msg)
             raise Exception(error_msg)
         
-        debug_log(config, f"send_slack_webhook: using webhook URL, channel: {config.channel}")
-        payload = {"text": formatted_message}
-        # If channel is specified, include it in the payload
-        if config.channel:
-            payload["channel"] = config.channel
+        debug_log(config, "send_slack_webhook: using webhook URL, channel: %s", config.channel)
+        payload = self._build_webhook_payload(formatted_message, config)
         
-        debug_log(config, f"send_slack_webhook: payload prepared, size: {len(str(payload))}")
-        response = requests.post(webhook_url, json=payload)
-        debug_log(config, f"send_slack_webhook: response status: {response.status_code}, response data: {response.text}")
-        if response.status_code != 200:
-            error_msg = f"Slack webhook response: {response.status_code}"
-            debug_log(config, f"send_slack_webhook: error: {error_msg}")
-            raise Exception(error_msg)
-        debug_log(config, "send_slack_webhook: webhook sent successfully")
\ No newline at end of file
+        debug_log(config, lambda: f"send_slack_webhook: payload prepared, size: {len(str(payload))}")
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", webhook_url, config.channel)
+
+        def post():
+            if limiter is not None:
+                limiter.throttle(*bucket)
+            response = self._get_transport(config).post(webhook_url, **_body_kwargs(payload))
+            debug_log(config, lambda: f"send_slack_webhook: response status: {response.status_code}, response data: {response.text}")
+            check_rate_limited(response, "Slack webhook", limiter, bucket)
+            if response.status_code != 200:
+                error_msg = f"Slack webhook response: {response.status_code}"
+                debug_log(config, "send_slack_webhook: error: %s", error_msg)
+                raise ProviderHTTPError(error_msg, response.status_code)
+            return response
+
+        get_retry_policy(config).call(post, operation="slack.webhook")
+        debug_log(config, "send_slack_webhook: webhook sent successfully")
+
+    def _send_slack_trace_upload(self, formatted_message, fallback_message, upload, config):
+        try:
+            self._upload_slack_file(formatted_message, upload, config)
+        except RateLimitedError:
+            raise
+        except Exception as e:
+            logging.warning(f"Slack trace upload failed, sending the trace inline: {e}")
+            self._send_slack_webclient(fallback_message, config)
+
+    def _upload_slack_file(self, formatted_message, upload, config):
+        """
+        Upload a gzipped trace with files.getUploadURLExternal, a POST of the
+        bytes and files.completeUploadExternal, which shares it to the channel
+        together with the alert text. A channel name is resolved to its ID
+        first, so a missing channel costs no upload.
+        """
+        debug_log(config, "send_slack_trace_upload: uploading %s, %s bytes (%s uncompressed)", upload.file_name, len(upload.data), upload.original_size)
+        token = self._webclient_token(config)
+        headers = {"Authorization": f"Bearer {token}"}
+        limiter = get_rate_limiter(config)
+        bucket = ("slack", token, config.channel)
+        policy = get_retry_policy(config)
+        transport = self._get_transport(config)
+
+        def api(method, **kwargs):
+            if limiter is not None:
+                limiter.throttle(*bucket)
+            response = transport.post(SLACK_API_URL + method, **kwargs)
+            check_rate_limited(response, f"Slack {method}", limiter, bucket)
+            return self._check_api_response(response, method)
+
+        def put_file(upload_url):
+            response = transport.post(upload_url, headers={"Content-Type": "application/octet-stream"}, data=upload.data)
+            if response.status_code != 200:
+                raise ProviderHTTPError(f"Slack file upload response: {response.status_code}", response.status_code)
+
+        channel_id = self._resolve_channel_id(config, api, headers)
+        ticket = policy.call(api, "files.getUploadURLExternal", headers=headers,
+                             data={"filename": upload.file_name, "length": len(upload.data)},
+                             operation="slack.files.getUploadURLExternal")
+        policy.call(put_file, ticket["upload_url"], operation="slack.files.upload")
+        payload = self._build_complete_upload_payload(formatted_message, upload, ticket["file_id"], channel_id)
+        policy.call(api, "files.completeUploadExternal", headers=dict(headers, **{"Content-Type": "application/json; charset=utf-8"}),
+                    json=payload, operation="slack.files.completeUploadExternal")
+        debug_log(config, "send_slack_trace_upload: trace uploaded and shared")
@@ -0,0 +1,233 @@
+"""
+Two-tier cache for commonlog providers: in-process L1 in front of Redis
+"""
+import threading
+import time
+
+from pycommonlog import metrics, tracing
+from pycommonlog.log_types import debug_log
+from pycommonlog.providers.redis_client import get_redis_client, get_async_redis_client
+from pycommonlog.cache import get_memory_cache
+
+DEFAULT_L1_TTL = 30
+DEFAULT_NEGATIVE_TTL = 5
+# Memory-only entries for values that never expire in Redis
+MEMORY_FALLBACK_SECONDS = 86400 * 30
+INVALIDATION_RETRY_SECONDS = 5
+
+# Stored in L1 for keys known to be missing from Redis
+_MISSING = object()
+
+
+class TieredCache:
+    """
+    Read-through cache with the shared InMemoryCache as L1 and Redis as L2.
+
+    L1 entries live for at most l1_ttl seconds and never outlive the Redis
+    key; misses are remembered for negative_ttl seconds. Writes go to both
+    tiers. While Redis is unavailable L1 holds values for their full expiry,
+    which keeps the previous memory-fallback behaviour.
+
+    With invalidation enabled, a background thread subscribes to Redis
+    keyspace notifications for key_prefix* and drops changed keys from L1,
+    so other processes' writes are seen before l1_ttl elapses.
+    """
+
+    def __init__(self, l1=None, l1_ttl=DEFAULT_L1_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, invalidation=False, key_prefix="commonlog_"):
+        self._l1 = l1
+        self.l1_ttl = l1_ttl
+        self.negative_ttl = negative_ttl
+        self.invalidation = invalidation
+        self.key_prefix = key_prefix
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    @property
+    def l1(self):
+        # Looked up on use so set_memory_cache() also applies to existing caches
+        return self._l1 if self._l1 is not None else get_memory_cache()
+
+    def _l1_seconds(self, ttl):
+        """L1 lifetime for a Redis value with ttl seconds left (-1: no expiry)"""
+        if ttl is not None and ttl > 0:
+            return min(self.l1_ttl, ttl)
+        return self.l1_ttl
+
+    def _remember(self, key, value, ttl):
+        if value is None:
+            if self.negative_ttl > 0:
+                self.l1.set(key, _MISSING, self.negative_ttl)
+        elif self.l1_ttl > 0:
+            self.l1.set(key, value, self._l1_seconds(ttl))
+
+    def get(self, config, key):
+        """
+        Get a value, from L1 if possible.
+
+        Returns:
+            The cached value, or None if missing
+        """
+        value = self.l1.get(key)
+        if value is _MISSING:
+            metrics.incr("commonlog_cache_lookups_total", result="negative_hit")
+            tracing.set_attribute("commonlog.cache.tier", "l1")
+            return None
+        if value is not None:
+            metrics.incr("commonlog_cache_lookups_total", result="l1_hit")
+            tracing.set_attribute("commonlog.cache.tier", "l1")
+            return value
+        try:
+            client = get_redis_client(config)
+            pipe = client.pipeline()
+            pipe.get(key)
+            pipe.ttl(key)
+            with tracing.span("redis.get", {"db.system": "redis"}):
+                value, ttl = pipe.execute()
+        except Exception:
+            metrics.incr("commonlog_redis_fallbacks_total", operation="get")
+            metrics.incr("commonlog_cache_lookups_total", result="miss")
+            tracing.set_attribute("commonlog.cache.tier", "none")
+            return None
+        self._ensure_listener(config)
+        self._remember(key, value, ttl)
+        metrics.incr("commonlog_cache_lookups_total", result="miss" if value is None else "l2_hit")
+        tracing.set_attribute("commonlog.cache.tier", "none" if value is None else "l2")
+        if value is not None:
+            debug_log(config, "Cache L2 hit for key: %s", key)
+        return value
+
+    def set(self, config, key, value, expire=None):
+        """
+        Write a value to Redis and L1.
+
+        Args:
+            expire: Seconds until the value expires, None for no expiry
+
+        Returns:
+            True if the value was stored in Redis, False if only in memory
+        """
+        try:
+            client = get_redis_client(config)
+            if expire:
+                client.setex(key, expire, value)
+            else:
+                client.set(key, value)
+        except Exception:
+            metrics.incr("commonlog_redis_fallbacks_total", operation="set")
+            self.l1.set(key, value, expire or MEMORY_FALLBACK_SECONDS)
+            return False
+        self._remember(key, value, expire or -1)
+        return True
+
+    def delete(self, config, key):
+        self.l1.delete(key)
+        try:
+            get_redis_client(config).delete(key)
+        except Exception:
+            pass
+
+    def invalidate(self, key):
+        """Drop key from L1 only"""
+        self.l1.delete(key)
+
+    async def get_async(self, config, key):
+        """Coroutine version of get() using redis.asyncio"""
+        value = self.l1.get(key)
+        if value is _MISSING:
+            metrics.incr("commonlog_cache_lookups_total", result="negative_hit")
+            tracing.set_attribute("commonlog.cache.tier", "l1")
+            return None
+        if value is not None:
+            metrics.incr("commonlog_cache_lookups_total", result="l1_hit")
+            tracing.set_attribute("commonlog.cache.tier", "l1")
+            return value
+        try:
+            pipe = get_async_redis_client(config).pipeline()
+            pipe.get(key)
+            pipe.ttl(key)
+            with tracing.span("redis.get", {"db.system": "redis"}):
+                value, ttl = await pipe.execute()
+        except Exception:
+            metrics.incr("commonlog_redis_fallbacks_total", operation="get")
+            metrics.incr("commonlog_cache_lookups_total", result="miss")
+            tracing.set_attribute("commonlog.cache.tier", "none")
+            return None
+        self._remember(key, value, ttl)
+        metrics.incr("commonlog_cache_lookups_total", result="miss" if value is None else "l2_hit")
+        tracing.set_attribute("commonlog.cache.tier", "none" if value is None else "l2")
+        if value is not None:
+            debug_log(config, "Cache L2 hit for key: %s", key)
+        return value
+
+    async def set_async(self, config, key, value, expire=None):
+        """Coroutine version of set() using redis.asyncio"""
+        try:
+            client = get_async_redis_client(config)
+            if expire:
+                await client.setex(key, expire, value)
+            else:
+                await client.set(key, value)
+        except Exception:
+            metrics.incr("commonlog_redis_fallbacks_total", operation="set")
+            self.l1.set(key, value, expire or MEMORY_FALLBACK_SECONDS)
+            return False
+        self._remember(key, value, expire or -1)
+        return True
+
+    # ---- keyspace notifications ----
+
+    def _ensure_listener(self, config):
+        if not self.invalidation or self._listener is not None:
+            return
+        if config.provider_config.get("redis_cluster_mode", False):
+            # Notifications are per node in cluster mode; rely on l1_ttl
+            return
+        with self._listener_lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, args=(config,), name="commonlog-cache-invalidation", daemon=True)
+                self._listener.start()
+
+    def _listen(self, config):
+        db = int(config.provider_config.get("redis_db", 0))
+        channel_prefix = f"__keyspace@{db}__:"
+        while True:
+            try:
+                pubsub = get_redis_client(config).pubsub(ignore_subscribe_messages=True)
+                # Changes made while disconnected are only picked up once l1_ttl expires
+                pubsub.psubscribe(f"{channel_prefix}{self.key_prefix}*")
+                for message in pubsub.listen():
+                    channel = message.get("channel") or ""
+                    if channel.startswith(channel_prefix):
+                        self.invalidate(channel[len(channel_prefix):])
+            except Exception as e:
+                debug_log(config, "Cache invalidation listener disconnected, retrying in %ss: %s", INVALIDATION_RETRY_SECONDS, e)
+            time.sleep(INVALIDATION_RETRY_SECONDS)
+
+
+# Shared tiered caches keyed by their settings
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_tiered_cache(config):
+    """
+    Get the shared TieredCache for the cache settings in config.provider_config.
+    """
+    provider_config = getattr(config, 'provider_config', {})
+    key = (
+        provider_config.get("cache_l1_ttl", DEFAULT_L1_TTL),
+        provider_config.get("cache_negative_ttl", DEFAULT_NEGATIVE_TTL),
+        provider_config.get("cache_invalidation", False),
+        provider_config.get("redis_host"),
+        provider_config.get("redis_port"),
+        provider_config.get("redis_db", 0),
+    )
+    cache = _caches.get(key)
+    if cache is not None:
+        return cache
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = TieredCache(l1_ttl=key[0], negative_ttl=key[1], invalidation=key[2])
+            _caches[key] = cache
+        return cache
@@ -0,0 +1,183 @@
+"""
+Pooled HTTP transport for commonlog providers
+"""
+import asyncio
+import threading
+import weakref
+from urllib.parse import urlsplit
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 10
+
+
+class HTTPTransport:
+    """
+    Per-host pool of keep-alive requests.Session objects shared by providers.
+
+    Each scheme+host gets its own Session so bursts of alerts to the same API
+    reuse warm TCP/TLS connections instead of paying a handshake per request.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, keep_alive=True):
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """
+        Get the pooled session for the host of a URL, creating it on first use.
+        """
+        parts = urlsplit(url)
+        host_key = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host_key)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host_key)
+            if session is None:
+                session = self._new_session()
+                self._sessions[host_key] = session
+            return session
+
+    def _new_session(self):
+        # Imported on first use; requests is a large share of import time
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        """Close every pooled session and its connections"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+def _transport_settings(config):
+    """Return (pool_size, connect_timeout, read_timeout, keep_alive) from provider_config"""
+    provider_config = getattr(config, 'provider_config', {})
+    return (
+        provider_config.get('http_pool_size', DEFAULT_POOL_SIZE),
+        provider_config.get('http_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+        provider_config.get('http_read_timeout', DEFAULT_READ_TIMEOUT),
+        provider_config.get('http_keep_alive', True),
+    )
+
+
+# Shared transports keyed by their settings
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(config):
+    """
+    Get the shared HTTPTransport for the HTTP settings in config.provider_config.
+
+    Providers configured with the same pool size, timeouts and keep-alive
+    setting share one transport and therefore one set of warm connections.
+    """
+    key = _transport_settings(config)
+    transport = _transports.get(key)
+    if transport is not None:
+        return transport
+    with _transports_lock:
+        transport = _transports.get(key)
+        if transport is None:
+            transport = HTTPTransport(
+                pool_size=key[0],
+                connect_timeout=key[1],
+                read_timeout=key[2],
+                keep_alive=key[3],
+            )
+            _transports[key] = transport
+        return transport
+
+
+class AsyncHTTPTransport:
+    """
+    Pooled keep-alive httpx.AsyncClient for the asyncio providers.
+
+    httpx is imported lazily so the synchronous API does not require it.
+    The client is bound to the event loop it is first used on.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT, keep_alive=True):
+        self.pool_size = max(1, int(pool_size))
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            try:
+                import httpx  # Import lazily, only needed for the asyncio API
+            except ImportError:
+                raise ImportError("The asyncio API requires httpx. Install it with: pip install pycommonlog[async]")
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size if self.keep_alive else 0,
+                ),
+            )
+        return self._client
+
+    async def request(self, method, url, **kwargs):
+        return await self._get_client().request(method, url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def aclose(self):
+        """Close the underlying client and its connections"""
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+# Async transports are bound to an event loop, so they are shared per loop
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport(config):
+    """
+    Get the shared AsyncHTTPTransport for the running event loop and the
+    HTTP settings in config.provider_config.
+    """
+    key = _transport_settings(config)
+    loop = asyncio.get_running_loop()
+    loop_transports = _async_transports.setdefault(loop, {})
+    transport = loop_transports.get(key)
+    if transport is None:
+        transport = AsyncHTTPTransport(
+            pool_size=key[0],
+            connect_timeout=key[1],
+            read_timeout=key[2],
+            keep_alive=key[3],
+        )
+        loop_transports[key] = transport
+    return transport
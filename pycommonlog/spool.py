@@ -0,0 +1,571 @@
+"""
+Durable on-disk spool (write-ahead log) for commonlog alerts
+"""
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no directory locking
+    fcntl = None
+
+from pycommonlog.log_types import Attachment
+
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_REPLAY_INTERVAL = 30.0
+DEFAULT_FSYNC_INTERVAL = 0.1
+DEFAULT_MAX_ATTEMPTS = 10
+# A record that failed to replay is skipped for base * 2**(attempts - 1) seconds, capped
+REPLAY_BACKOFF_BASE = 30.0
+REPLAY_BACKOFF_MAX = 3600.0
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# Every record is <length><crc32> followed by a UTF-8 JSON body
+_HEADER = struct.Struct("<II")
+# Ack files hold the offsets of delivered records in the matching segment
+_ACK = struct.Struct("<Q")
+_SEGMENT_SUFFIX = ".log"
+_ACK_SUFFIX = ".ack"
+_LOCK_FILE = "lock"
+
+
+def encode_alert(provider_name, level, message, attachment, channel, channel_api):
+    record = {
+        "provider": provider_name,
+        "level": level,
+        "message": message,
+        "channel": channel,
+        "channel_api": channel_api,
+        "time": time.time(),
+    }
+    if attachment is not None:
+        record["attachment"] = {"url": attachment.url, "file_name": attachment.file_name, "content": attachment.content}
+    return record
+
+
+def decode_attachment(record):
+    attachment = record.get("attachment")
+    return Attachment(**attachment) if attachment else None
+
+
+def _lock_directory(root):
+    """
+    Take an exclusive lock on root, or on the first worker-N subdirectory
+    that no other spool holds.
+
+    Returns:
+        (directory, lock file descriptor), the descriptor being None without fcntl
+    """
+    if fcntl is None:
+        os.makedirs(root, exist_ok=True)
+        return root, None
+    slot = 0
+    while True:
+        directory = root if slot == 0 else os.path.join(root, f"worker-{slot}")
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, _LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            slot += 1
+            continue
+        return directory, fd
+
+
+class _Segment:
+    __slots__ = ("seq", "path", "size", "records", "acked")
+
+    def __init__(self, seq, path, size=0, records=0, acked=None):
+        self.seq = seq
+        self.path = path
+        self.size = size
+        self.records = records
+        self.acked = acked if acked is not None else set()
+
+    @property
+    def ack_path(self):
+        return self.path[:-len(_SEGMENT_SUFFIX)] + _ACK_SUFFIX
+
+
+def _read_records(path, limit=None):
+    """Yield (offset, record) from a segment, stopping at a torn or corrupt tail"""
+    with open(path, "rb") as f:
+        offset = 0
+        while limit is None or offset < limit:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, crc = _HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                return
+            yield offset, json.loads(body)
+            offset += _HEADER.size + length
+
+
+class AlertSpool:
+    """
+    Append-only, segment-rotated alert queue on local disk.
+
+    append() writes a record before delivery and ack() marks it delivered;
+    pending() yields what was never acked, including records left behind by
+    a previous process, so they can be replayed (at-least-once: a crash
+    between delivery and ack replays the alert).
+
+    Records reach the OS with one write() each, so they survive the process
+    being killed. With fsync on, a background thread fsyncs new records at
+    most every fsync_interval seconds, so one fsync covers every append of
+    that interval (group commit) and append() never waits for the disk.
+    With fsync_interval=0, append() instead waits until the record is on
+    disk; concurrent appends still share one fsync.
+    Segments are deleted once every record in them is acked; beyond
+    max_bytes the oldest segments are dropped.
+
+    Records that cannot be delivered after max_attempts replays, or that
+    fail with an error the caller deems fatal, are moved to the
+    dead-letter file (dead-letter.jsonl in the spool directory).
+
+    A spool holds an exclusive lock on its directory. Another spool given
+    the same directory, in this process or another one, uses the first
+    free worker-N subdirectory instead, so a restarted worker picks up what
+    its predecessor in that slot left behind. A process forked from the
+    owner leaves the parent's files alone and moves to a slot of its own.
+    """
+
+    def __init__(self, directory, segment_bytes=DEFAULT_SEGMENT_BYTES, max_bytes=DEFAULT_MAX_BYTES, fsync=True, fsync_interval=DEFAULT_FSYNC_INTERVAL, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.root = directory
+        self.segment_bytes = max(1, int(segment_bytes))
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_attempts = max(1, int(max_attempts))
+        self._open()
+        _live_spools.add(self)
+
+    def _open(self):
+        self.directory, self._lock_fd = _lock_directory(self.root)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._segments = {}
+        self._inflight = set()
+        # position -> (failed replays, monotonic time before which it is skipped)
+        self._attempts = {}
+        self._dropped = 0
+        self._dead_lettered = 0
+        self._closed = False
+        # Group commit bookkeeping: records written vs. records known to be on disk
+        self._written = 0
+        self._synced = 0
+        self._syncing_fd = None
+        self._retired_fds = []
+        self._flusher = None
+        self._flusher_wakeup = threading.Event()
+
+        self._active = None
+        self._load()
+        last = max(self._segments) if self._segments else 0
+        self._open_segment(last + 1)
+
+    def _reinit_after_fork(self):
+        # The parent keeps its files, lock and threads; closing the inherited
+        # descriptors here does not release its lock
+        if self._closed:
+            self._lock = threading.Lock()
+            self._sync_lock = threading.Lock()
+            return
+        for fd in [self._fd, self._ack_fd, self._lock_fd] + self._retired_fds:
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._open()
+
+    @property
+    def dropped(self):
+        """Number of undelivered records discarded to stay within max_bytes"""
+        return self._dropped
+
+    @property
+    def dead_lettered(self):
+        """Number of records given up on and moved to the dead-letter file"""
+        return self._dead_lettered
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, f"{seq:016d}{_SEGMENT_SUFFIX}")
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(_SEGMENT_SUFFIX):
+                continue
+            try:
+                seq = int(name[:-len(_SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            segment = _Segment(seq, os.path.join(self.directory, name))
+            if os.path.exists(segment.ack_path):
+                with open(segment.ack_path, "rb") as f:
+                    data = f.read()
+                segment.acked = {offset for (offset,) in _ACK.iter_unpack(data[:len(data) - len(data) % _ACK.size])}
+            segment.records = sum(1 for _ in _read_records(segment.path))
+            segment.size = os.path.getsize(segment.path)
+            self._segments[seq] = segment
+            self._maybe_delete(segment)
+
+    def _open_segment(self, seq):
+        # Must be called with self._lock held (or from __init__)
+        segment = _Segment(seq, self._segment_path(seq))
+        self._fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._ack_fd = os.open(segment.ack_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._segments[seq] = segment
+        self._active = segment
+
+    def _rotate(self):
+        # Must be called with self._lock held
+        old_fd, old_ack_fd = self._fd, self._ack_fd
+        if self.fsync:
+            os.fsync(old_fd)
+        if old_fd == self._syncing_fd:
+            # A group commit is fsyncing it right now; it closes it when done
+            self._retired_fds.append(old_fd)
+        else:
+            os.close(old_fd)
+        os.close(old_ack_fd)
+        previous = self._active
+        self._open_segment(previous.seq + 1)
+        self._maybe_delete(previous)
+        self._enforce_max_bytes()
+
+    def _enforce_max_bytes(self):
+        # Must be called with self._lock held
+        if not self.max_bytes:
+            return
+        total = sum(segment.size for segment in self._segments.values())
+        for seq in sorted(self._segments):
+            if total <= self.max_bytes or seq == self._active.seq:
+                break
+            segment = self._segments.pop(seq)
+            total -= segment.size
+            lost = segment.records - len(segment.acked)
+            self._dropped += lost
+            self._remove_files(segment)
+            logging.warning(f"Alert spool over {self.max_bytes} bytes, dropped {lost} undelivered alerts")
+
+    def _maybe_delete(self, segment):
+        # Must be called with self._lock held
+        if segment is not self._active and len(segment.acked) >= segment.records:
+            self._segments.pop(segment.seq, None)
+            self._remove_files(segment)
+
+    @staticmethod
+    def _remove_files(segment):
+        for path in (segment.path, segment.ack_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def append(self, record):
+        """
+        Write a record to the spool.
+
+        Returns:
+            The record's position, to pass to ack() or release()
+        """
+        body = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        data = _HEADER.pack(len(body), zlib.crc32(body)) + body
+        with self._lock:
+            if self._closed:
+                raise ValueError("spool is closed")
+            if self._active.size and self._active.size + len(data) > self.segment_bytes:
+                self._rotate()
+            segment = self._active
+            position = (segment.seq, segment.size)
+            os.write(self._fd, data)
+            segment.size += len(data)
+            segment.records += 1
+            self._inflight.add(position)
+            self._written += 1
+            ticket = self._written
+        if self.fsync:
+            if self.fsync_interval and self.fsync_interval > 0:
+                self._ensure_flusher()
+                self._flusher_wakeup.set()
+            else:
+                self._sync(ticket)
+        return position
+
+    def _sync(self, ticket):
+        """Wait until the ticket-th record is on disk, sharing fsyncs between threads"""
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return  # Another thread's fsync already covered it
+            with self._lock:
+                if self._fd is None:
+                    return  # Closed; close() synced everything
+                target = self._written
+                fd = self._fd
+                self._syncing_fd = fd
+            try:
+                os.fsync(fd)
+            finally:
+                with self._lock:
+                    self._syncing_fd = None
+                    retired, self._retired_fds = self._retired_fds, []
+                for retired_fd in retired:
+                    os.close(retired_fd)
+            self._synced = target
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None and not self._closed:
+                    self._flusher = threading.Thread(target=self._flush_loop, name="commonlog-spool-fsync", daemon=True)
+                    self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._flusher_wakeup.wait()
+            self._flusher_wakeup.clear()
+            if self._closed:
+                return
+            try:
+                self._sync(self._written)
+            except OSError as e:
+                logging.error(f"Alert spool fsync failed: {e}")
+            # Appends arriving meanwhile are covered by the next fsync
+            time.sleep(self.fsync_interval)
+
+    def ack(self, position):
+        """
+        Mark a record delivered.
+
+        Does nothing once the spool is closed; the record is then replayed
+        by the next process.
+        """
+        with self._lock:
+            self._inflight.discard(position)
+            self._attempts.pop(position, None)
+            if self._closed:
+                return
+            segment = self._segments.get(position[0])
+            if segment is None or position[1] in segment.acked:
+                return
+            segment.acked.add(position[1])
+            if segment is self._active:
+                # A lost ack only means a duplicate on replay, so acks are not fsynced
+                os.write(self._ack_fd, _ACK.pack(position[1]))
+            elif len(segment.acked) >= segment.records:
+                self._maybe_delete(segment)
+            else:
+                with open(segment.ack_path, "ab") as f:
+                    f.write(_ACK.pack(position[1]))
+
+    def release(self, position):
+        """Give a record whose delivery failed back to pending()"""
+        with self._lock:
+            self._inflight.discard(position)
+
+    def claim(self, position):
+        """
+        Mark a pending record as being delivered.
+
+        Returns:
+            False if it was acked or claimed in the meantime
+        """
+        with self._lock:
+            segment = self._segments.get(position[0])
+            if segment is None or position[1] in segment.acked or position in self._inflight:
+                return False
+            self._inflight.add(position)
+            return True
+
+    def pending(self):
+        """Yield (position, record) for records that are neither acked nor in flight, oldest first"""
+        with self._lock:
+            segments = [(segment.seq, segment.path, segment.size) for _, segment in sorted(self._segments.items())]
+        for seq, path, size in segments:
+            try:
+                records = list(_read_records(path, limit=size))
+            except FileNotFoundError:
+                continue  # Fully acked and deleted meanwhile
+            for offset, record in records:
+                position = (seq, offset)
+                with self._lock:
+                    segment = self._segments.get(seq)
+                    if segment is None:
+                        break
+                    if offset in segment.acked or position in self._inflight:
+                        continue
+                yield position, record
+
+    def __len__(self):
+        """Number of records not acked yet"""
+        with self._lock:
+            return sum(segment.records - len(segment.acked) for segment in self._segments.values())
+
+    def replay(self, deliver, retryable=None):
+        """
+        Deliver pending records oldest first with deliver(record), acking
+        each one that succeeds.
+
+        A record that fails is skipped, so it never holds up the ones
+        behind it, and is retried by later replays with exponential
+        backoff. It is dead-lettered once it failed max_attempts times, or
+        right away if retryable(error) returns False.
+
+        Returns:
+            Number of records delivered
+        """
+        delivered = 0
+        now = time.monotonic()
+        for position, record in self.pending():
+            with self._lock:
+                attempts, not_before = self._attempts.get(position, (0, 0.0))
+            if not_before > now or not self.claim(position):
+                continue
+            try:
+                deliver(record)
+            except Exception as e:
+                attempts += 1
+                if attempts >= self.max_attempts or (retryable is not None and not retryable(e)):
+                    self.dead_letter(position, record, e, attempts)
+                    continue
+                backoff = min(REPLAY_BACKOFF_MAX, REPLAY_BACKOFF_BASE * 2 ** (attempts - 1))
+                with self._lock:
+                    self._attempts[position] = (attempts, time.monotonic() + backoff)
+                self.release(position)
+                logging.error(f"Failed to replay spooled alert (attempt {attempts} of {self.max_attempts}): {e}")
+                continue
+            self.ack(position)
+            delivered += 1
+        return delivered
+
+    def dead_letter(self, position, record, error, attempts):
+        """Move a record that cannot be delivered to the dead-letter file and ack it"""
+        path = os.path.join(self.directory, DEAD_LETTER_FILE)
+        line = json.dumps(dict(record, error=str(error), attempts=attempts, dead_lettered_at=time.time()), separators=(",", ":")) + "\n"
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if self.max_bytes and size + len(line) > self.max_bytes:
+            logging.error(f"Dropped undeliverable spooled alert, {path} is full: {error}")
+            with self._lock:
+                self._dropped += 1
+        else:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+            logging.error(f"Gave up on spooled alert after {attempts} attempt(s), moved it to {path}: {error}")
+            with self._lock:
+                self._dead_lettered += 1
+        self.ack(position)
+
+    def close(self):
+        """Sync and close the spool files"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._flusher_wakeup.set()
+        if self.fsync and self._synced < self._written:
+            self._sync(self._written)
+        with self._sync_lock, self._lock:
+            os.close(self._fd)
+            os.close(self._ack_fd)
+            self._fd = self._ack_fd = None
+            self._maybe_delete_active()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)  # Releases the directory lock
+                self._lock_fd = None
+        _live_spools.discard(self)
+
+    def _maybe_delete_active(self):
+        # Must be called with self._lock held, after the files are closed
+        segment = self._active
+        if len(segment.acked) >= segment.records:
+            self._segments.pop(segment.seq, None)
+            self._remove_files(segment)
+
+
+class SpoolReplayer:
+    """
+    Background thread that replays an AlertSpool every interval seconds,
+    starting right away so alerts left by a previous process go out first.
+    """
+
+    def __init__(self, spool, deliver, interval=DEFAULT_REPLAY_INTERVAL, retryable=None):
+        self.spool = spool
+        self.deliver = deliver
+        self.interval = interval
+        self.retryable = retryable
+        self._start()
+        _live_replayers.add(self)
+
+    def _start(self):
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="commonlog-spool-replayer", daemon=True)
+        self._thread.start()
+
+    def _reinit_after_fork(self):
+        # The thread did not survive fork; replay the child's own slot
+        if not self._stop.is_set():
+            self._start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.spool.replay(self.deliver, self.retryable)
+            except Exception as e:
+                logging.error(f"Alert spool replay failed: {e}")
+            self._stop.wait(self.interval)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        _live_replayers.discard(self)
+
+
+# Sync spools on interpreter exit so buffered records reach the disk, after
+# everything that may still ack them has finished, see logger._close_at_exit
+_live_spools = weakref.WeakSet()
+_live_replayers = weakref.WeakSet()
+ATEXIT_STOP_TIMEOUT = 5.0
+
+
+def _close_at_exit():
+    for replayer in list(_live_replayers):
+        try:
+            replayer.stop(ATEXIT_STOP_TIMEOUT)
+        except Exception:
+            pass
+    for spool in list(_live_spools):
+        try:
+            spool.close()
+        except Exception:
+            pass
+
+
+# A forked child must not write into its parent's segments: each spool moves
+# to a free slot and each replayer gets a new thread
+def _after_fork_in_child():
+    for spool in list(_live_spools):
+        try:
+            spool._reinit_after_fork()
+        except Exception as e:
+            logging.error(f"Failed to reopen alert spool after fork: {e}")
+    for replayer in list(_live_replayers):
+        replayer._reinit_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,177 @@
+"""
+Pre-compiled message templates for commonlog providers
+"""
+import collections
+import json
+import re
+import string
+import threading
+
+from pycommonlog.log_types import AlertLevel
+
+LEVEL_NAMES = {AlertLevel.INFO: "INFO", AlertLevel.WARN: "WARN", AlertLevel.ERROR: "ERROR"}
+
+# Fields of provider_config["message_template"], the text of an alert
+TEXT_FIELDS = frozenset(("header", "title", "service_name", "environment", "level", "message", "details", "channel"))
+# Fields of payload templates (Slack blocks, Lark cards), rendered from the formatted text
+PAYLOAD_FIELDS = frozenset(("text", "header", "title", "service_name", "environment", "channel"))
+
+_formatter = string.Formatter()
+_escape = json.encoder.encode_basestring_ascii
+# Marks a field inside the serialized skeleton of a JsonTemplate; JSON
+# escaping leaves it unchanged at any nesting depth
+_SENTINEL = "<<commonlog:{}>>"
+_SENTINEL_RE = re.compile(r"<<commonlog:(\d+)>>")
+
+
+def _parse(source, fields):
+    """Split a "{field}" string into [(literal, field name or None)]"""
+    parts = []
+    for literal, name, spec, conversion in _formatter.parse(source):
+        if name is not None:
+            if spec or conversion:
+                raise ValueError(f"Template field {{{name}}} may not use a format spec or conversion")
+            if fields is not None and name not in fields:
+                raise ValueError(f"Unknown template field {{{name}}}, expected one of: {', '.join(sorted(fields))}")
+        parts.append((literal, name))
+    return parts
+
+
+class TextTemplate:
+    """
+    A "{field}" string parsed once into literal and field parts.
+
+    render() joins the parts in a single pass; a value may be a list of
+    strings, which is spliced in without being joined first.
+    """
+    __slots__ = ("source", "_parts")
+
+    def __init__(self, source, fields=None):
+        self.source = source
+        self._parts = _parse(source, fields)
+
+    def render(self, **values):
+        out = []
+        for literal, name in self._parts:
+            if literal:
+                out.append(literal)
+            if name is not None:
+                value = values[name]
+                if isinstance(value, list):
+                    out += value
+                else:
+                    out.append(str(value))
+        return "".join(out)
+
+
+class JsonString:
+    """Wraps part of a JsonTemplate skeleton that the API expects as a JSON-encoded string"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class JsonTemplate:
+    """
+    A JSON payload skeleton serialized once, with "{field}" placeholders in
+    its string values.
+
+    render() returns the request body by joining the serialized literal
+    chunks with the JSON-escaped field values, so a payload is built without
+    creating nested dicts or calling json.dumps per alert. Values inside a
+    JsonString are escaped twice, exactly as json.dumps of json.dumps would.
+    Literal braces in the skeleton's strings are written {{ and }}.
+    """
+    __slots__ = ("skeleton", "_parts")
+
+    def __init__(self, skeleton, fields=None):
+        self.skeleton = skeleton
+        slots = []
+
+        def walk(node, depth):
+            if isinstance(node, str):
+                pieces = []
+                for literal, name in _parse(node, fields):
+                    pieces.append(literal)
+                    if name is not None:
+                        pieces.append(_SENTINEL.format(len(slots)))
+                        slots.append((name, depth))
+                return "".join(pieces)
+            if isinstance(node, JsonString):
+                return json.dumps(walk(node.value, depth + 1))
+            if isinstance(node, dict):
+                return {key: walk(value, depth) for key, value in node.items()}
+            if isinstance(node, (list, tuple)):
+                return [walk(value, depth) for value in node]
+            return node
+
+        chunks = _SENTINEL_RE.split(json.dumps(walk(skeleton, 1)))
+        # chunks alternate literal JSON text and slot numbers, ending with text
+        self._parts = [(chunks[i], slots[int(chunks[i + 1])] if i + 1 < len(chunks) else None) for i in range(0, len(chunks), 2)]
+
+    def render(self, **values):
+        out = []
+        for literal, slot in self._parts:
+            out.append(literal)
+            if slot is not None:
+                name, depth = slot
+                value = str(values[name])
+                for _ in range(depth):
+                    value = _escape(value)[1:-1]
+                out.append(value)
+        return "".join(out)
+
+
+# Custom templates from provider_config, compiled on first use and bounded
+# in least-recently-used order. The same source object is found by identity
+# (the entry keeps it alive, so its id cannot be reused while cached); a
+# provider_config rebuilt for every call falls back to its content key and
+# still reuses one compiled template.
+MAX_COMPILED_TEMPLATES = 128
+_compiled = collections.OrderedDict()
+_by_identity = collections.OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def _template_key(kind, source):
+    if isinstance(source, str):
+        return kind, source
+    # dict and list templates are not hashable; their canonical JSON is
+    return kind, json.dumps(source, sort_keys=True, separators=(",", ":"))
+
+
+def _remember(cache, key, value):
+    # Must be called with _compiled_lock held
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > MAX_COMPILED_TEMPLATES:
+        cache.popitem(last=False)
+
+
+def get_template(kind, source, build):
+    """
+    Get the compiled template for a user-supplied source.
+
+    Args:
+        kind: Distinguishes templates compiled from the same source for different payloads
+        build: Called with source to compile it, e.g. a TextTemplate or JsonTemplate factory
+    """
+    identity = (kind, id(source))
+    with _compiled_lock:
+        entry = _by_identity.get(identity)
+        if entry is not None and entry[0] is source:
+            _by_identity.move_to_end(identity)
+            return entry[1]
+    key = _template_key(kind, source)
+    with _compiled_lock:
+        template = _compiled.get(key)
+        if template is not None:
+            _compiled.move_to_end(key)
+    if template is None:
+        # Compiled outside the lock; a concurrent first use just compiles twice
+        template = build(source)
+    with _compiled_lock:
+        _remember(_compiled, key, template)
+        _remember(_by_identity, identity, (source, template))
+    return template
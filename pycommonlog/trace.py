@@ -0,0 +1,108 @@
+"""
+Trace handling for commonlog: byte-budget truncation and gzip for uploads
+"""
+import io
+import zlib
+
+from pycommonlog.log_types import SendMethod
+
+DEFAULT_TRACE_MAX_BYTES = 16 * 1024
+# Share of the budget kept from the start of the trace; the rest comes from
+# the end, where a traceback names the failing frame and the exception
+TRACE_HEAD_FRACTION = 0.25
+GZIP_CHUNK_CHARS = 64 * 1024
+TRACE_SEPARATOR = "\n\n--- Trace Log ---\n"
+
+
+def trace_max_bytes(config):
+    return config.provider_config.get("trace_max_bytes", DEFAULT_TRACE_MAX_BYTES)
+
+
+def utf8_length(text):
+    """Encoded size of text, without encoding it when it is pure ASCII"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-8"))
+
+
+def _marker(omitted):
+    return f"\n\n... [{omitted} bytes truncated] ...\n\n"
+
+
+def truncate_trace(text, max_bytes):
+    """
+    Keep the head and tail of text so its UTF-8 encoding fits in max_bytes.
+
+    The text is encoded at most once and the kept parts are decoded straight
+    from slices of that buffer, so a multi-MB trace is never copied whole.
+    Multi-byte characters cut at a boundary are dropped.
+    """
+    if not text or not max_bytes or max_bytes <= 0:
+        return text
+    if text.isascii():
+        # One byte per character, so slice the str itself
+        size = len(text)
+        if size <= max_bytes:
+            return text
+        data = None
+    else:
+        data = memoryview(text.encode("utf-8"))
+        size = len(data)
+        if size <= max_bytes:
+            return text
+
+    # The marker's own length depends on the number it prints; the omitted
+    # count never has more digits than size
+    budget = max(0, max_bytes - len(_marker(size)))
+    head = int(budget * TRACE_HEAD_FRACTION)
+    tail = budget - head
+    marker = _marker(size - head - tail)
+    if data is None:
+        return "".join((text[:head], marker, text[size - tail:]))
+    return "".join((
+        str(data[:head], "utf-8", "ignore"),
+        marker,
+        str(data[size - tail:], "utf-8", "ignore"),
+    ))
+
+
+def gzip_text(text, chunk_chars=GZIP_CHUNK_CHARS):
+    """
+    Gzip the UTF-8 encoding of text.
+
+    The text is encoded and compressed a chunk at a time, so only the
+    compressed output is held in memory, never a full encoded copy.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    out = io.BytesIO()
+    for start in range(0, len(text), chunk_chars):
+        out.write(compressor.compress(text[start:start + chunk_chars].encode("utf-8")))
+    out.write(compressor.flush())
+    return out.getvalue()
+
+
+class TraceUpload:
+    """A gzipped trace ready to be uploaded as a file"""
+    __slots__ = ("file_name", "data", "original_size")
+
+    def __init__(self, file_name, data, original_size):
+        self.file_name = file_name
+        self.data = data
+        self.original_size = original_size
+
+    @classmethod
+    def from_attachment(cls, attachment):
+        file_name = attachment.file_name or "trace.log"
+        return cls(f"{file_name}.gz", gzip_text(attachment.content), utf8_length(attachment.content))
+
+
+def should_upload_trace(attachment, config):
+    """
+    True if attachment's content is over the trace budget and trace_upload
+    is enabled; only the WebClient method can upload files.
+    """
+    if not attachment or not attachment.content:
+        return False
+    if not config.provider_config.get("trace_upload", False) or config.send_method != SendMethod.WEBCLIENT:
+        return False
+    return utf8_length(attachment.content) > trace_max_bytes(config)
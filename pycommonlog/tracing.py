@@ -0,0 +1,108 @@
+"""
+Optional OpenTelemetry spans for commonlog
+"""
+import logging
+
+TRACER_NAME = "pycommonlog"
+
+# opentelemetry is imported on the first span after tracing is enabled, so
+# applications that never enable tracing never pay for the import
+_enabled = False
+_tracer = None
+_otel_trace = None
+_otel_context = None
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or OpenTelemetry is missing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def is_recording(self):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _load_tracer():
+    global _tracer, _otel_trace, _otel_context, _enabled
+    try:
+        from opentelemetry import context, trace
+    except ImportError:
+        logging.warning("Tracing is enabled but opentelemetry is not installed. Install it with: pip install pycommonlog[otel]")
+        _enabled = False
+        return None
+    _otel_trace = trace
+    _otel_context = context
+    _tracer = trace.get_tracer(TRACER_NAME)
+    return _tracer
+
+
+def enable_tracing(enabled=True):
+    """Turn span creation on or off for the process"""
+    global _enabled
+    _enabled = enabled
+
+
+def tracing_enabled():
+    return _enabled
+
+
+def configure_tracing(config):
+    """Apply the tracing setting in config.provider_config"""
+    if config.provider_config.get("tracing", False):
+        enable_tracing()
+
+
+def span(name, attributes=None):
+    """
+    Context manager for a span named name, a child of the current span.
+
+    Attributes with a None value are skipped. Exceptions leaving the block
+    are recorded on the span by OpenTelemetry.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    tracer = _tracer or _load_tracer()
+    if tracer is None:
+        return _NOOP_SPAN
+    if attributes:
+        attributes = {key: value for key, value in attributes.items() if value is not None}
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def set_attribute(key, value):
+    """Set an attribute on the current span, if any"""
+    if _enabled and _tracer is not None and value is not None:
+        _otel_trace.get_current_span().set_attribute(key, value)
+
+
+def current_context():
+    """The caller's trace context, to parent spans started on another thread"""
+    if _enabled and (_tracer or _load_tracer()) is not None:
+        return _otel_context.get_current()
+    return None
+
+
+def traced_send(parent, name, attributes, send, *args):
+    """
+    Call send(*args) in a span whose parent is the context captured with
+    current_context() when the send was scheduled, so alerts delivered by
+    background workers still join the caller's trace.
+    """
+    token = _otel_context.attach(parent) if parent is not None else None
+    try:
+        with span(name, attributes):
+            return send(*args)
+    finally:
+        if token is not None:
+            _otel_context.detach(token)
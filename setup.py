@@ -34,6 +34,8 @@ setup(
     install_requires=["requests"],
     extras_require={
         "redis": ["redis>=4.0.0"],
+        "async": ["httpx>=0.23.0"],
+        "otel": ["opentelemetry-api>=1.0.0"],
     },
     license="MIT",
     python_requires=">=3.8",
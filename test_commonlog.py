@@ -308,5 +308,1727 @@ class Testcommonlog(unittest.TestCase):
         # Verify the logger uses the provider from provider_config
         self.assertIsNotNone(logger.provider)
 
+class TestBackgroundDispatch(unittest.TestCase):
+    def _async_config(self, **extra):
+        provider_config = {"async_dispatch": True}
+        provider_config.update(extra)
+        return Config(
+            provider="slack",
+            send_method=SendMethod.WEBCLIENT,
+            token="dummy-token",
+            channel="#test",
+            provider_config=provider_config
+        )
+
+    def test_send_is_queued_and_flushed(self):
+        logger = commonlog(self._async_config())
+        with patch.object(logger.provider, 'send') as mock_send:
+            logger.send(AlertLevel.ERROR, "Queued message")
+            self.assertTrue(logger.flush(timeout=5))
+            mock_send.assert_called_once()
+            # The queued config carries the resolved channel, shared config is untouched
+            self.assertEqual(mock_send.call_args[0][3].channel, "#test")
+        logger.close()
+
+    def test_send_to_channel_does_not_mutate_shared_config(self):
+        logger = commonlog(self._async_config())
+        with patch.object(logger.provider, 'send_to_channel') as mock_send:
+            logger.send_to_channel(AlertLevel.ERROR, "Queued message", channel="#custom")
+            self.assertEqual(logger.config.channel, "#test")
+            self.assertTrue(logger.flush(timeout=5))
+            self.assertEqual(mock_send.call_args[0][4], "#custom")
+        logger.close()
+
+    def test_provider_errors_do_not_reach_caller(self):
+        logger = commonlog(self._async_config())
+        with patch.object(logger.provider, 'send', side_effect=Exception("Test error")):
+            logger.send(AlertLevel.ERROR, "Test message")
+            self.assertTrue(logger.flush(timeout=5))
+        logger.close()
+
+    def test_overflow_policies(self):
+        from pycommonlog.dispatcher import BackgroundDispatcher, OverflowPolicy
+        import threading
+
+        for policy, expected in ((OverflowPolicy.DROP_NEWEST, [0, 1]), (OverflowPolicy.DROP_OLDEST, [0, 2])):
+            gate = threading.Event()
+            started = threading.Event()
+            processed = []
+
+            def task(i):
+                started.set()
+                gate.wait(5)
+                processed.append(i)
+
+            dispatcher = BackgroundDispatcher(max_queue_size=1, workers=1, overflow_policy=policy)
+            dispatcher.submit(task, 0)
+            started.wait(5)  # task 0 is in flight, the queue is empty
+            dispatcher.submit(task, 1)
+            dispatcher.submit(task, 2)
+            self.assertEqual(dispatcher.dropped, 1)
+            gate.set()
+            self.assertTrue(dispatcher.close(timeout=5))
+            self.assertEqual(processed, expected)
+
+    def test_sync_mode_flush_is_noop(self):
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = commonlog(config)
+        self.assertIsNone(logger.dispatcher)
+        self.assertTrue(logger.flush())
+        self.assertTrue(logger.close())
+
+class TestHTTPTransport(unittest.TestCase):
+    def test_session_pooled_per_host(self):
+        from pycommonlog.providers.transport import HTTPTransport
+        transport = HTTPTransport(pool_size=4)
+        a = transport.session_for("https://slack.com/api/chat.postMessage")
+        b = transport.session_for("https://slack.com/api/files.upload")
+        c = transport.session_for("https://open.larksuite.com/open-apis/im/v1/chats")
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(a.get_adapter("https://slack.com")._pool_maxsize, 4)
+        transport.close()
+
+    def test_shared_transport_per_settings(self):
+        from pycommonlog.providers.transport import get_transport
+        config_a = Config(provider="slack", send_method=SendMethod.WEBCLIENT, provider_config={"http_read_timeout": 3})
+        config_b = Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"http_read_timeout": 3})
+        config_c = Config(provider="slack", send_method=SendMethod.WEBCLIENT)
+        self.assertIs(get_transport(config_a), get_transport(config_b))
+        self.assertIsNot(get_transport(config_a), get_transport(config_c))
+        self.assertEqual(get_transport(config_a).timeout, (5, 3))
+
+    def test_injected_transport_used_by_provider(self):
+        from pycommonlog.providers import SlackProvider
+        transport = Mock()
+        transport.post.return_value = Mock(status_code=200, text="ok")
+        provider = SlackProvider(transport=transport)
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        provider.send(AlertLevel.ERROR, "Test message", None, config)
+        transport.post.assert_called_once()
+        self.assertEqual(transport.post.call_args[0][0], "https://slack.com/api/chat.postMessage")
+
+class TestAsyncCommonlog(unittest.IsolatedAsyncioTestCase):
+    def _ok_transport(self):
+        from unittest.mock import AsyncMock
+        transport = Mock()
+        transport.post = AsyncMock(return_value=Mock(status_code=200, text="ok"))
+        return transport
+
+    async def test_send_uses_async_provider(self):
+        from pycommonlog.async_logger import AsyncCommonlog
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = AsyncCommonlog(config)
+        logger.provider.transport = self._ok_transport()
+        await logger.send(AlertLevel.ERROR, "Async error", trace="stack trace here")
+        logger.provider.transport.post.assert_awaited_once()
+        payload = logger.provider.transport.post.call_args[1]["json"]
+        self.assertEqual(payload["channel"], "#test")
+        self.assertIn("stack trace here", payload["text"])
+
+    async def test_concurrent_send_to_channel_routes_each_alert(self):
+        import asyncio
+        from pycommonlog.async_logger import AsyncCommonlog
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = AsyncCommonlog(config)
+        logger.provider.transport = self._ok_transport()
+        channels = [f"#channel-{i}" for i in range(5)]
+        await asyncio.gather(*(logger.send_to_channel(AlertLevel.WARN, "Async warn", channel=c) for c in channels))
+        sent = sorted(call[1]["json"]["channel"] for call in logger.provider.transport.post.call_args_list)
+        self.assertEqual(sent, channels)
+        self.assertEqual(config.channel, "#default")
+
+    async def test_lark_token_and_chat_id_fall_back_to_memory_cache(self):
+        from pycommonlog.providers.async_lark import AsyncLarkProvider
+        from pycommonlog.log_types import LarkToken
+        config = Config(
+            provider="lark",
+            send_method=SendMethod.WEBCLIENT,
+            lark_token=LarkToken(app_id="async-app", app_secret="async-secret"),
+            channel="async-channel",
+            environment="async-test"
+        )
+        transport = self._ok_transport()
+        token_response = Mock(status_code=200)
+        token_response.json.return_value = {"code": 0, "tenant_access_token": "t-123", "expire": 7200}
+        transport.post.side_effect = [token_response, Mock(status_code=200), Mock(status_code=200)]
+        chats_response = Mock(status_code=200)
+        chats_response.json.return_value = {"code": 0, "data": {"items": [{"name": "async-channel", "chat_id": "oc_1"}], "has_more": False}}
+        from unittest.mock import AsyncMock
+        transport.get = AsyncMock(return_value=chats_response)
+        provider = AsyncLarkProvider(transport=transport)
+
+        await provider.send(AlertLevel.ERROR, "first", None, config)
+        await provider.send(AlertLevel.ERROR, "second", None, config)
+        # Token and chat id are only fetched once, then served from cache
+        self.assertEqual(transport.post.await_count, 3)
+        transport.get.assert_awaited_once()
+
+    async def test_lark_chat_id_resolves_through_shared_directory(self):
+        from unittest.mock import AsyncMock
+        from pycommonlog.providers import LarkProvider
+        from pycommonlog.providers.async_lark import AsyncLarkProvider
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, token="t-raw-token", environment="async-dir",
+                        provider_config={"lark_chat_index_refresh": 0})
+        provider = AsyncLarkProvider()
+        provider._fetch_chats_page = AsyncMock(side_effect=[
+            ([{"name": "alpha", "chat_id": "oc_a"}], "page-1", True),
+            ([{"name": "beta", "chat_id": "oc_b"}], "", False),
+        ])
+        self.assertEqual(await provider.get_chat_id_from_channel_name(config, "t-raw-token", "beta"), "oc_b")
+        self.assertIn("page_token=page-1", provider._fetch_chats_page.await_args_list[1][0][1])
+        # alpha was indexed on the way, for async and sync providers alike
+        sync_provider = LarkProvider()
+        sync_provider._fetch_chats_page = Mock()
+        self.assertEqual(sync_provider.get_chat_id_from_channel_name(config, "t-raw-token", "alpha"), "oc_a")
+        sync_provider._fetch_chats_page.assert_not_called()
+        self.assertEqual(provider._fetch_chats_page.await_count, 2)
+
+    async def test_single_flight_survives_cancelled_leader(self):
+        import asyncio
+        from pycommonlog.providers.singleflight import AsyncSingleFlight
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+            return "t-shared"
+
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await asyncio.wait_for(follower, 5), "t-shared")
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(len(calls), 2)
+
+    async def test_custom_send_error_handling(self):
+        from unittest.mock import AsyncMock
+        from pycommonlog.async_logger import AsyncCommonlog
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = AsyncCommonlog(config)
+        with patch('pycommonlog.providers.async_lark.AsyncLarkProvider.send_to_channel', new=AsyncMock(side_effect=Exception("Test error"))):
+            with self.assertRaises(Exception):
+                await logger.custom_send("lark", AlertLevel.ERROR, "Test message")
+
+class TestAlertCoalescing(unittest.TestCase):
+    def _config(self, **extra):
+        provider_config = {"coalesce_window": 60}
+        provider_config.update(extra)
+        return Config(
+            provider="slack",
+            send_method=SendMethod.WEBCLIENT,
+            token="dummy-token",
+            channel="#test",
+            provider_config=provider_config
+        )
+
+    def test_burst_is_merged_into_one_message(self):
+        logger = commonlog(self._config(coalesce_max_samples=2))
+        with patch.object(logger.provider, 'send') as mock_send:
+            for _ in range(3):
+                logger.send(AlertLevel.ERROR, "DB timeout")
+            logger.send(AlertLevel.ERROR, "Cache miss storm")
+            logger.send(AlertLevel.ERROR, "Disk full")
+            mock_send.assert_not_called()
+            logger.flush()
+            mock_send.assert_called_once()
+            message = mock_send.call_args[0][1]
+            self.assertIn("[5 alerts in", message)
+            self.assertIn("- (3x) DB timeout", message)
+            self.assertIn("- Cache miss storm", message)
+            self.assertIn("...and 1 more", message)
+        logger.close()
+
+    def test_buckets_are_per_channel_and_level(self):
+        logger = commonlog(self._config())
+        with patch.object(logger.provider, 'send_to_channel') as mock_send:
+            logger.send_to_channel(AlertLevel.ERROR, "a", channel="#one")
+            logger.send_to_channel(AlertLevel.ERROR, "b", channel="#two")
+            logger.send_to_channel(AlertLevel.WARN, "c", channel="#one")
+            logger.flush()
+            self.assertEqual(mock_send.call_count, 3)
+            # A single alert in a window is delivered unchanged
+            self.assertEqual(sorted(call[0][1] for call in mock_send.call_args_list), ["a", "b", "c"])
+        logger.close()
+
+    def test_max_count_flushes_before_window(self):
+        import threading
+        from pycommonlog.coalescer import AlertCoalescer
+        emitted = threading.Event()
+        received = []
+
+        def emit(message, attachment):
+            received.append(message)
+            emitted.set()
+
+        coalescer = AlertCoalescer(window=60, max_count=3)
+        for i in range(3):
+            coalescer.add(("slack", "#test", AlertLevel.ERROR), "boom", None, emit)
+        self.assertTrue(emitted.wait(5))
+        self.assertIn("(3x) boom", received[0])
+        self.assertEqual(coalescer.pending(), 0)
+        coalescer.close()
+
+    def test_window_elapses(self):
+        import threading
+        from pycommonlog.coalescer import AlertCoalescer
+        emitted = threading.Event()
+        coalescer = AlertCoalescer(window=0.05)
+        coalescer.add("key", "boom", None, lambda message, attachment: emitted.set())
+        self.assertTrue(emitted.wait(5))
+        coalescer.close()
+
+class TestAlertDeduplication(unittest.TestCase):
+    def _config(self, **extra):
+        provider_config = {"dedup_ttl": 60}
+        provider_config.update(extra)
+        return Config(
+            provider="slack",
+            send_method=SendMethod.WEBCLIENT,
+            token="dummy-token",
+            channel="#test",
+            provider_config=provider_config
+        )
+
+    def test_fingerprint_normalizes_ids_and_numbers(self):
+        from pycommonlog.dedup import fingerprint
+        a = fingerprint(AlertLevel.ERROR, "#test", "order 1234 failed for user deadbeef01", "Traceback\n  line 1")
+        b = fingerprint(AlertLevel.ERROR, "#test", "order 99  failed for user cafebabe99", "Traceback\n  line 1")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, fingerprint(AlertLevel.WARN, "#test", "order 1234 failed for user deadbeef01", "Traceback\n  line 1"))
+        self.assertNotEqual(a, fingerprint(AlertLevel.ERROR, "#other", "order 1234 failed for user deadbeef01", "Traceback\n  line 1"))
+
+    def test_repeats_are_suppressed_and_summarized(self):
+        logger = commonlog(self._config())
+        with patch.object(logger.provider, 'send') as mock_send:
+            logger.send(AlertLevel.ERROR, "Payment 1 failed")
+            logger.send(AlertLevel.ERROR, "Payment 2 failed")
+            logger.send(AlertLevel.ERROR, "Payment 3 failed")
+            mock_send.assert_called_once()
+            logger.flush()
+            self.assertEqual(mock_send.call_count, 2)
+            self.assertIn("(repeated 2 times in the last 60s)", mock_send.call_args[0][1])
+        logger.close()
+
+    def test_no_summary_without_repeats(self):
+        logger = commonlog(self._config())
+        with patch.object(logger.provider, 'send') as mock_send:
+            logger.send(AlertLevel.ERROR, "Single alert")
+            logger.flush()
+            mock_send.assert_called_once()
+        logger.close()
+
+    def test_tracked_fingerprints_are_bounded(self):
+        from pycommonlog.dedup import AlertDeduplicator
+        summaries = []
+        deduplicator = AlertDeduplicator(ttl=60, max_entries=3)
+        for i in range(10):
+            message = f"unique message {chr(ord('a') + i)}"
+            self.assertTrue(deduplicator.should_send(AlertLevel.ERROR, "#test", message, "", summaries.append))
+        self.assertEqual(deduplicator.tracked(), 3)
+        self.assertEqual(summaries, [])
+        deduplicator.close()
+
+    def test_window_expiry_emits_summary(self):
+        import threading
+        from pycommonlog.dedup import AlertDeduplicator
+        emitted = threading.Event()
+        summaries = []
+
+        def emit(message):
+            summaries.append(message)
+            emitted.set()
+
+        deduplicator = AlertDeduplicator(ttl=0.1)
+        self.assertTrue(deduplicator.should_send(AlertLevel.ERROR, "#test", "boom", "", emit))
+        self.assertFalse(deduplicator.should_send(AlertLevel.ERROR, "#test", "boom", "", emit))
+        self.assertTrue(emitted.wait(5))
+        self.assertIn("repeated 1 times", summaries[0])
+        # The window is closed, so the next occurrence is sent again
+        self.assertTrue(deduplicator.should_send(AlertLevel.ERROR, "#test", "boom", "", emit))
+        deduplicator.close()
+
+    def test_redis_backend_falls_back_to_memory(self):
+        from pycommonlog.dedup import RedisDedupBackend
+        backend = RedisDedupBackend(Config(provider="slack", send_method=SendMethod.WEBCLIENT))
+        self.assertTrue(backend.check("fp-fallback", 60))
+        self.assertFalse(backend.check("fp-fallback", 60))
+        self.assertEqual(backend.release("fp-fallback"), 1)
+
+    def test_redis_backend_uses_shared_counter(self):
+        from pycommonlog.dedup import RedisDedupBackend
+        client = Mock()
+        client.eval.side_effect = [1, 0]
+        client.pipeline.return_value.execute.return_value = ["1", 1]
+        backend = RedisDedupBackend(Config(provider="slack", send_method=SendMethod.WEBCLIENT))
+        with patch('pycommonlog.dedup.get_redis_client', return_value=client):
+            self.assertTrue(backend.check("fp", 60))
+            self.assertFalse(backend.check("fp", 60))
+            # SET NX EX and INCR run as one script, so INCR never sees a released key
+            self.assertEqual(client.eval.call_args[0][1:], (1, "commonlog_dedup:fp", 60 + 60))
+            self.assertEqual(backend.release("fp"), 1)
+
+class TestRateLimiting(unittest.TestCase):
+    def test_token_bucket_smooths_bursts(self):
+        from pycommonlog.providers.ratelimit import TokenBucket
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.reserve(max_wait=1), (True, 0.0))
+        self.assertEqual(bucket.reserve(max_wait=1), (True, 0.0))
+        reserved, wait = bucket.reserve(max_wait=1)
+        self.assertTrue(reserved)
+        self.assertAlmostEqual(wait, 0.1, places=2)
+        # The next caller queues behind the previous reservation
+        reserved, wait = bucket.reserve(max_wait=1)
+        self.assertAlmostEqual(wait, 0.2, places=2)
+        reserved, wait = bucket.reserve(max_wait=0.1)
+        self.assertFalse(reserved)
+
+    def test_penalize_holds_back_bucket(self):
+        from pycommonlog.providers.ratelimit import TokenBucket
+        bucket = TokenBucket(rate=1, burst=3)
+        bucket.penalize(30)
+        reserved, wait = bucket.reserve(max_wait=5)
+        self.assertFalse(reserved)
+        self.assertGreater(wait, 29)
+
+    def test_parse_retry_after(self):
+        from pycommonlog.providers.ratelimit import parse_retry_after
+        self.assertEqual(parse_retry_after({"Retry-After": "3"}), 3.0)
+        self.assertEqual(parse_retry_after({"x-ogw-ratelimit-reset": "2"}), 2.0)
+        self.assertIsNone(parse_retry_after({}))
+
+    def test_limiter_buckets_per_channel_and_shared_per_config(self):
+        from pycommonlog.providers.ratelimit import get_rate_limiter
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, provider_config={"rate_limit": True, "rate_limit_burst": 7})
+        self.assertIsNone(get_rate_limiter(Config(provider="slack", send_method=SendMethod.WEBCLIENT)))
+        limiter = get_rate_limiter(config)
+        self.assertIs(limiter, get_rate_limiter(config))
+        self.assertIs(limiter.bucket("slack", "t", "#a"), limiter.bucket("slack", "t", "#a"))
+        self.assertIsNot(limiter.bucket("slack", "t", "#a"), limiter.bucket("slack", "t", "#b"))
+        self.assertEqual(limiter.bucket("lark", "t", "#a").rate, 5.0)
+
+    def test_redis_bucket_falls_back_to_local(self):
+        from pycommonlog.providers.ratelimit import RedisTokenBucket
+        bucket = RedisTokenBucket(Config(provider="slack", send_method=SendMethod.WEBCLIENT), "commonlog_ratelimit:test", rate=1, burst=1)
+        self.assertEqual(bucket.reserve(max_wait=0), (True, 0.0))
+        self.assertFalse(bucket.reserve(max_wait=0)[0])
+
+    def test_redis_bucket_uses_shared_script(self):
+        from pycommonlog.providers.ratelimit import RedisTokenBucket
+        client = Mock()
+        client.eval.return_value = [1, "0.5"]
+        bucket = RedisTokenBucket(Config(provider="slack", send_method=SendMethod.WEBCLIENT), "commonlog_ratelimit:test", rate=1, burst=1)
+        with patch('pycommonlog.providers.ratelimit.get_redis_client', return_value=client):
+            self.assertEqual(bucket.reserve(max_wait=2), (True, 0.5))
+        self.assertEqual(client.eval.call_args[0][2], "commonlog_ratelimit:test")
+
+    def test_429_schedules_resend_instead_of_raising(self):
+        import threading
+        from pycommonlog.providers import SlackProvider
+        delivered = threading.Event()
+        limited = Mock(status_code=429, text="ratelimited", headers={"Retry-After": "0.05"})
+        ok = Mock(status_code=200, text="ok", headers={})
+
+        def post(*args, **kwargs):
+            if transport.post.call_count > 1:
+                delivered.set()
+                return ok
+            return limited
+
+        transport = Mock()
+        transport.post.side_effect = post
+        provider = SlackProvider(transport=transport)
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        provider.send_to_channel(AlertLevel.ERROR, "Rate limited message", None, config, "#custom")
+        self.assertTrue(delivered.wait(5))
+        self.assertEqual(transport.post.call_args[1]["json"]["channel"], "#custom")
+
+    def test_429_raises_after_max_resends(self):
+        from pycommonlog.providers import LarkProvider
+        from pycommonlog.providers.ratelimit import RateLimitedError
+        transport = Mock()
+        transport.post.return_value = Mock(status_code=400, text="frequency limit", headers={"x-ogw-ratelimit-reset": "1"})
+        provider = LarkProvider(transport=transport)
+        config = Config(
+            provider="lark",
+            send_method=SendMethod.WEBHOOK,
+            token="https://open.larksuite.com/open-apis/bot/v2/hook/test",
+            provider_config={"rate_limit_max_resends": 0, "retry_max_attempts": 1}
+        )
+        with self.assertRaises(RateLimitedError):
+            provider.send(AlertLevel.ERROR, "Rate limited message", None, config)
+
+    def test_flush_waits_for_scheduled_resends(self):
+        from pycommonlog.providers.ratelimit import get_resend_scheduler
+        limited = Mock(status_code=429, text="ratelimited", headers={"Retry-After": "0.1"})
+        ok = Mock(status_code=200, text="ok", headers={})
+        logger = commonlog(Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test", provider_config={"retry_max_attempts": 1}))
+        logger.provider.transport = Mock()
+        logger.provider.transport.post.side_effect = [limited, ok]
+        logger.send(AlertLevel.ERROR, "Rate limited message")
+        self.assertEqual(get_resend_scheduler().pending(), 1)
+        self.assertTrue(logger.flush(timeout=5))
+        self.assertEqual(get_resend_scheduler().pending(), 0)
+        self.assertEqual(logger.provider.transport.post.call_count, 2)
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_error_classification(self):
+        import requests
+        from pycommonlog.providers.retry import ProviderHTTPError, is_retryable
+        self.assertTrue(is_retryable(ProviderHTTPError("boom", 503)))
+        self.assertTrue(is_retryable(ProviderHTTPError("slow down", 429)))
+        self.assertTrue(is_retryable(requests.ConnectionError("reset")))
+        self.assertTrue(is_retryable(requests.Timeout("timeout")))
+        self.assertFalse(is_retryable(ProviderHTTPError("unauthorized", 401)))
+        self.assertFalse(is_retryable(ValueError("bad payload")))
+
+    def test_backoff_is_exponential_and_capped(self):
+        from pycommonlog.providers.retry import RetryPolicy
+        policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+        self.assertEqual([policy.compute_delay(n) for n in range(1, 5)], [1, 2, 4, 5])
+        jittered = RetryPolicy(base_delay=1, max_delay=5)
+        self.assertTrue(0 <= jittered.compute_delay(3) <= 4)
+
+    def test_retries_transient_errors_and_records_stats(self):
+        from pycommonlog.providers.retry import ProviderHTTPError, RetryPolicy
+        policy = RetryPolicy(max_attempts=3, base_delay=0)
+        func = Mock(side_effect=[ProviderHTTPError("boom", 502), ProviderHTTPError("boom", 503), "ok"])
+        self.assertEqual(policy.call(func, operation="test.op"), "ok")
+        self.assertEqual(func.call_count, 3)
+        stats = policy.stats.snapshot()["test.op"]
+        self.assertEqual((stats["calls"], stats["attempts"], stats["retries"], stats["successes"]), (1, 3, 2, 1))
+
+    def test_fatal_errors_are_not_retried(self):
+        from pycommonlog.providers.retry import ProviderHTTPError, RetryPolicy
+        policy = RetryPolicy(max_attempts=5, base_delay=0)
+        func = Mock(side_effect=ProviderHTTPError("unauthorized", 401))
+        with self.assertRaises(ProviderHTTPError):
+            policy.call(func, operation="test.op")
+        func.assert_called_once()
+        self.assertEqual(policy.stats.snapshot()["test.op"]["fatal"], 1)
+
+    def test_deadline_stops_retries(self):
+        from pycommonlog.providers.retry import ProviderHTTPError, RetryPolicy
+        policy = RetryPolicy(max_attempts=10, base_delay=1, jitter=False, deadline=0.5)
+        func = Mock(side_effect=ProviderHTTPError("boom", 500))
+        with self.assertRaises(ProviderHTTPError):
+            policy.call(func, operation="test.op")
+        func.assert_called_once()
+        self.assertEqual(policy.stats.snapshot()["test.op"]["exhausted"], 1)
+
+    def test_provider_retries_5xx(self):
+        from pycommonlog.providers import SlackProvider
+        transport = Mock()
+        transport.post.side_effect = [
+            Mock(status_code=503, text="unavailable", headers={}),
+            Mock(status_code=200, text="ok", headers={}),
+        ]
+        provider = SlackProvider(transport=transport)
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test", provider_config={"retry_base_delay": 0})
+        provider.send(AlertLevel.ERROR, "Retried message", None, config)
+        self.assertEqual(transport.post.call_count, 2)
+
+    def test_token_fetch_is_retried(self):
+        from pycommonlog.providers import LarkProvider
+        transport = Mock()
+        token_response = Mock(status_code=200)
+        token_response.json.return_value = {"code": 0, "tenant_access_token": "t-retry", "expire": 7200}
+        transport.post.side_effect = [Mock(status_code=500), token_response]
+        provider = LarkProvider(transport=transport)
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"retry_base_delay": 0})
+        self.assertEqual(provider.get_tenant_access_token(config, "retry-app", "retry-secret"), "t-retry")
+        self.assertEqual(transport.post.call_count, 2)
+
+class TestLarkChatDirectory(unittest.TestCase):
+    def _provider_with_pages(self, pages):
+        from pycommonlog.providers import LarkProvider
+        provider = LarkProvider()
+        responses = []
+        for i, items in enumerate(pages):
+            has_more = i < len(pages) - 1
+            responses.append((items, f"page-{i + 1}" if has_more else "", has_more))
+        provider._fetch_chats_page = Mock(side_effect=responses)
+        return provider
+
+    def _config(self, environment):
+        return Config(
+            provider="lark",
+            send_method=SendMethod.WEBCLIENT,
+            token="t-raw-token",
+            environment=environment,
+            provider_config={"lark_chat_index_refresh": 0}
+        )
+
+    def test_scan_uses_max_page_size_and_stops_early(self):
+        provider = self._provider_with_pages([
+            [{"name": "alpha", "chat_id": "oc_a"}],
+            [{"name": "beta", "chat_id": "oc_b"}],
+            [{"name": "gamma", "chat_id": "oc_c"}],
+        ])
+        config = self._config("dir-early-stop")
+        self.assertEqual(provider.get_chat_id_from_channel_name(config, "t-raw-token", "beta"), "oc_b")
+        self.assertEqual(provider._fetch_chats_page.call_count, 2)
+        self.assertIn("page_size=100", provider._fetch_chats_page.call_args_list[0][0][1])
+        self.assertIn("page_token=page-1", provider._fetch_chats_page.call_args_list[1][0][1])
+
+    def test_indexed_names_resolve_without_scanning(self):
+        from pycommonlog.providers.lark_directory import get_chat_directory
+        provider = self._provider_with_pages([
+            [{"name": "alpha", "chat_id": "oc_a"}, {"name": "beta", "chat_id": "oc_b"}],
+        ])
+        config = self._config("dir-indexed")
+        self.assertEqual(provider.get_chat_id_from_channel_name(config, "t-raw-token", "beta"), "oc_b")
+        # alpha was indexed from the same page, so it resolves with one lookup
+        self.assertEqual(get_chat_directory(config).resolve(provider, config, "t-raw-token", "alpha"), "oc_a")
+        provider._fetch_chats_page.assert_called_once()
+
+    def test_missing_channel_is_not_rescanned_immediately(self):
+        provider = self._provider_with_pages([[{"name": "alpha", "chat_id": "oc_a"}]])
+        config = self._config("dir-missing")
+        with self.assertRaises(Exception):
+            provider.get_chat_id_from_channel_name(config, "t-raw-token", "nope")
+        with self.assertRaises(Exception):
+            provider.get_chat_id_from_channel_name(config, "t-raw-token", "nope")
+        provider._fetch_chats_page.assert_called_once()
+
+    def test_refresh_drops_deleted_chats(self):
+        from pycommonlog.providers.lark_directory import get_chat_directory
+        config = self._config("dir-refresh")
+        directory = get_chat_directory(config)
+        directory.refresh(self._provider_with_pages([[{"name": "old", "chat_id": "oc_old"}]]), config, "t-raw-token")
+        self.assertEqual(directory.get(config, "old"), "oc_old")
+        directory.refresh(self._provider_with_pages([[{"name": "new", "chat_id": "oc_new"}]]), config, "t-raw-token")
+        self.assertIsNone(directory.get(config, "old"))
+        self.assertEqual(directory.get(config, "new"), "oc_new")
+
+class TestLarkTokenRefresh(unittest.TestCase):
+    def _token_response(self, token, expire=7200):
+        response = Mock(status_code=200)
+        response.json.return_value = {"code": 0, "tenant_access_token": token, "expire": expire}
+        return response
+
+    def test_concurrent_misses_fetch_once(self):
+        import threading
+        import time
+        from pycommonlog.providers import LarkProvider
+
+        def post(url, json=None):
+            time.sleep(0.1)
+            return self._token_response("t-shared")
+
+        transport = Mock()
+        transport.post.side_effect = post
+        provider = LarkProvider(transport=transport)
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"lark_token_renew": False})
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(provider.get_tenant_access_token(config, "flight-app", "flight-secret"))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["t-shared"] * 8)
+        transport.post.assert_called_once()
+
+    def test_single_flight_shares_errors(self):
+        import threading
+        from pycommonlog.providers.singleflight import SingleFlight
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("token API down")
+
+        errors = []
+
+        def call():
+            try:
+                flight.do("key", fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait(5)
+        follower = threading.Thread(target=call)
+        follower.start()
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+
+    def test_token_is_renewed_before_expiry(self):
+        import time
+        from pycommonlog.providers import LarkProvider
+        transport = Mock()
+        transport.post.side_effect = [self._token_response("t-first", expire=700), self._token_response("t-renewed")]
+        provider = LarkProvider(transport=transport)
+        # Cached for 100s, renewed 0.1s after the fetch
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"lark_token_renew_margin": 99.9})
+        self.assertEqual(provider.get_tenant_access_token(config, "renew-app", "renew-secret"), "t-first")
+        deadline = time.monotonic() + 5
+        while transport.post.call_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(provider.get_cached_lark_token(config, "renew-app", "renew-secret"), "t-renewed")
+        self.assertEqual(provider.get_tenant_access_token(config, "renew-app", "renew-secret"), "t-renewed")
+        self.assertEqual(transport.post.call_count, 2)
+
+class TestTieredCache(unittest.TestCase):
+    def _client(self, value, ttl):
+        client = Mock()
+        client.pipeline.return_value.execute.return_value = [value, ttl]
+        return client
+
+    def test_repeat_reads_are_served_from_l1(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.providers.tiered_cache import TieredCache
+        client = self._client("t-cached", 3600)
+        cache = TieredCache(l1=InMemoryCache())
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT)
+        with patch('pycommonlog.providers.tiered_cache.get_redis_client', return_value=client):
+            self.assertEqual(cache.get(config, "commonlog_k"), "t-cached")
+            self.assertEqual(cache.get(config, "commonlog_k"), "t-cached")
+        client.pipeline.assert_called_once()
+
+    def test_misses_are_negatively_cached_until_set(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.providers.tiered_cache import TieredCache
+        client = self._client(None, -2)
+        cache = TieredCache(l1=InMemoryCache(), negative_ttl=60)
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT)
+        with patch('pycommonlog.providers.tiered_cache.get_redis_client', return_value=client):
+            self.assertIsNone(cache.get(config, "commonlog_k"))
+            self.assertIsNone(cache.get(config, "commonlog_k"))
+            client.pipeline.assert_called_once()
+            self.assertTrue(cache.set(config, "commonlog_k", "oc_new"))
+            self.assertEqual(cache.get(config, "commonlog_k"), "oc_new")
+        client.set.assert_called_once_with("commonlog_k", "oc_new")
+        client.pipeline.assert_called_once()
+
+    def test_l1_entry_does_not_outlive_redis_key(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.providers.tiered_cache import TieredCache
+        client = self._client("t-expiring", 1)
+        cache = TieredCache(l1=InMemoryCache(), l1_ttl=30)
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT)
+        with patch('pycommonlog.providers.tiered_cache.get_redis_client', return_value=client):
+            cache.get(config, "commonlog_k")
+        self.assertLessEqual(cache.l1.ttl("commonlog_k"), 1)
+
+    def test_falls_back_to_memory_without_redis(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.providers.tiered_cache import TieredCache
+        cache = TieredCache(l1=InMemoryCache())
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT)
+        self.assertFalse(cache.set(config, "commonlog_k", "t-memory", 5400))
+        self.assertEqual(cache.get(config, "commonlog_k"), "t-memory")
+
+class TestRedisClientRegistry(unittest.TestCase):
+    def _config(self, **provider_config):
+        settings = {"redis_host": "redis.invalid", "redis_port": 6379}
+        settings.update(provider_config)
+        return Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config=settings)
+
+    def test_one_client_per_redis_target(self):
+        from pycommonlog.providers.redis_client import get_redis_client
+        a = get_redis_client(self._config())
+        self.assertIs(get_redis_client(self._config()), a)
+        self.assertIsNot(get_redis_client(self._config(redis_db=1)), a)
+
+    def test_pool_settings(self):
+        from pycommonlog.providers.redis_client import get_redis_client
+        client = get_redis_client(self._config(redis_health_check_interval=15, redis_max_connections=8))
+        pool = client.connection_pool
+        self.assertEqual(pool.max_connections, 8)
+        self.assertEqual(pool.connection_kwargs["health_check_interval"], 15)
+        self.assertTrue(pool.connection_kwargs["decode_responses"])
+
+    def test_reset_drops_cached_clients(self):
+        from pycommonlog.providers.redis_client import get_redis_client, reset_redis_clients
+        config = self._config(redis_db=2)
+        client = get_redis_client(config)
+        reset_redis_clients()
+        self.assertIsNot(get_redis_client(config), client)
+
+class TestRedisCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_and_probes_after_timeout(self):
+        import time
+        from pycommonlog.providers.circuit_breaker import CircuitBreaker, CircuitState
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        self.assertFalse(breaker.allow())
+        time.sleep(0.06)
+        # One probe in half-open, then a failed probe re-opens the circuit
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitState.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        self.assertEqual(breaker.snapshot()["trips"], 2)
+
+    def test_guarded_client_counts_connection_errors_only(self):
+        import redis
+        from pycommonlog.providers.circuit_breaker import CircuitBreaker, CircuitState, GuardedClient
+        breaker = CircuitBreaker("test", failure_threshold=1)
+        client = Mock()
+        client.get.side_effect = redis.exceptions.ResponseError("WRONGTYPE")
+        client.set.side_effect = redis.exceptions.ConnectionError("refused")
+        guarded = GuardedClient(client, breaker, (redis.exceptions.ConnectionError,))
+        with self.assertRaises(redis.exceptions.ResponseError):
+            guarded.get("k")
+        self.assertEqual(breaker.state, CircuitState.CLOSED)
+        with self.assertRaises(redis.exceptions.ConnectionError):
+            guarded.set("k", "v")
+        self.assertEqual(breaker.state, CircuitState.OPEN)
+
+    def test_open_circuit_falls_back_to_memory_immediately(self):
+        from pycommonlog.providers import LarkProvider
+        from pycommonlog.providers.circuit_breaker import CircuitOpenError
+        from pycommonlog.providers.redis_client import get_redis_client, get_redis_breaker, get_redis_breaker_states
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"redis_host": "breaker.invalid", "redis_port": 6379})
+        breaker = get_redis_breaker(config)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        with self.assertRaises(CircuitOpenError):
+            get_redis_client(config)
+        provider = LarkProvider()
+        provider.cache_chat_id(config, "breaker-channel", "oc_breaker")
+        self.assertEqual(provider.get_cached_chat_id(config, "breaker-channel"), "oc_breaker")
+        self.assertEqual(get_redis_breaker_states()["breaker.invalid:6379/0"]["state"], "open")
+
+class TestImportCost(unittest.TestCase):
+    # Generous enough for slow CI machines; a plain import takes well under 0.1s
+    IMPORT_BUDGET_SECONDS = 0.5
+
+    def _run(self, code):
+        import subprocess
+        result = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        return result.stdout.split()
+
+    def test_import_is_within_budget(self):
+        code = "import time; t = time.perf_counter(); import pycommonlog; print(time.perf_counter() - t)"
+        best = min(float(self._run(code)[0]) for _ in range(3))
+        self.assertLess(best, self.IMPORT_BUDGET_SECONDS)
+
+    def test_import_starts_no_threads_or_handlers(self):
+        code = (
+            "import logging, threading, pycommonlog, pycommonlog.cache; "
+            "print(threading.active_count(), len(logging.getLogger('commonlog.debug').handlers), pycommonlog.cache._memory_cache is None)"
+        )
+        self.assertEqual(self._run(code), ["1", "0", "True"])
+
+    def test_cache_survives_fork(self):
+        if not hasattr(os, "fork"):
+            self.skipTest("fork is not available")
+        code = (
+            "import os, threading; from pycommonlog.cache import get_memory_cache; "
+            "cache = get_memory_cache(); cache.set('k', 'v', 60); "
+            "pid = os.fork()\n"
+            "if pid == 0:\n"
+            "    cache.set('k2', 'v2', 60); ok = cache.get('k') == 'v' and cache._cleanup_thread.is_alive(); os._exit(0 if ok else 1)\n"
+            "print(os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) if hasattr(os, 'waitstatus_to_exitcode') else os.waitpid(pid, 0)[1])"
+        )
+        self.assertEqual(self._run(code), ["0"])
+
+class TestLazyDebugLog(unittest.TestCase):
+    def test_disabled_debug_does_not_format(self):
+        from pycommonlog.log_types import debug_log
+        config = Config(provider="slack", send_method=SendMethod.WEBHOOK, debug=False)
+        from unittest.mock import MagicMock
+        build = Mock(return_value="message")
+        arg = MagicMock()
+        debug_log(config, build)
+        debug_log(config, "value: %s", arg)
+        build.assert_not_called()
+        arg.__str__.assert_not_called()
+
+    def test_enabled_debug_formats_args_and_callables(self):
+        from pycommonlog.log_types import debug_log
+        config = Config(provider="slack", send_method=SendMethod.WEBHOOK, debug=True)
+        with self.assertLogs("commonlog.debug", level="DEBUG") as logs:
+            debug_log(config, "size: %s", 42)
+            debug_log(config, lambda: "built lazily")
+        self.assertEqual([r.getMessage() for r in logs.records], ["size: 42", "built lazily"])
+        self.assertEqual(logs.records[0].filename, "test_commonlog.py")
+
+    def test_lark_webhook_serializes_payload_once(self):
+        import json
+        from pycommonlog.providers import LarkProvider
+        transport = Mock()
+        transport.post.return_value = Mock(status_code=200, text="ok")
+        provider = LarkProvider(transport=transport)
+        config = Config(provider="lark", send_method=SendMethod.WEBHOOK, token="https://example.com/hook", debug=True)
+        with patch("pycommonlog.providers.lark.json.dumps", wraps=json.dumps) as dumps, \
+                self.assertLogs("commonlog.debug", level="DEBUG"):
+            provider._send_lark_webhook("title", "body", config)
+        # Rendered from the compiled template, no per-alert serialization
+        dumps.assert_not_called()
+        self.assertEqual(json.loads(transport.post.call_args[1]["data"])["msg_type"], "post")
+
+class TestSendContext(unittest.TestCase):
+    def test_context_is_immutable_and_reads_through(self):
+        from pycommonlog.log_types import SendContext
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        context = SendContext(config, "#alerts")
+        self.assertEqual(context.channel, "#alerts")
+        self.assertEqual(context.send_method, SendMethod.WEBCLIENT)
+        self.assertEqual(context.provider_config["token"], "dummy-token")
+        self.assertEqual(SendContext(context, "#other").config, config)
+        self.assertEqual(SendContext(config).channel, "#default")
+        self.assertEqual(SendContext(context).channel, "#alerts")
+        with self.assertRaises(AttributeError):
+            context.channel = "#elsewhere"
+
+    def test_concurrent_sends_from_thread_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = commonlog(config)
+        sent = []
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=lambda message, config: sent.append((message, config.channel))):
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                list(pool.map(lambda i: logger.send_to_channel(AlertLevel.ERROR, f"alert {i}", channel=f"#channel-{i}"), range(50)))
+        self.assertEqual(sorted(sent), sorted((f"alert {i}", f"#channel-{i}") for i in range(50)))
+        self.assertEqual(config.channel, "#default")
+
+    def test_failed_send_leaves_config_untouched(self):
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = commonlog(config)
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                logger.send_to_channel(AlertLevel.ERROR, "alert", channel="#custom")
+        self.assertEqual(config.channel, "#default")
+
+class TestProviderRegistry(unittest.TestCase):
+    def tearDown(self):
+        from pycommonlog.providers.registry import reset_providers
+        reset_providers()
+
+    def test_custom_send_reuses_provider_instances(self):
+        from pycommonlog.providers.registry import get_provider
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = commonlog(config)
+        with patch('pycommonlog.providers.LarkProvider.send', autospec=True) as mock_send:
+            logger.custom_send("lark", AlertLevel.ERROR, "first")
+            logger.custom_send("lark", AlertLevel.ERROR, "second")
+        self.assertIs(mock_send.call_args_list[0][0][0], mock_send.call_args_list[1][0][0])
+        self.assertIs(mock_send.call_args[0][0], get_provider("lark", config))
+        other = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="other-token")
+        self.assertIsNot(get_provider("lark", other), get_provider("lark", config))
+        with patch.object(logger.provider, "send") as own_send:
+            logger.custom_send("slack", AlertLevel.ERROR, "own provider")
+            own_send.assert_called_once()
+
+    def test_registered_and_import_path_providers(self):
+        from pycommonlog.log_types import Provider
+        from pycommonlog.providers import LarkProvider
+        from pycommonlog.providers.registry import register_provider, get_provider, _factories
+
+        class EchoProvider(Provider):
+            def __init__(self):
+                self.sent = []
+
+            def send_to_channel(self, level, message, attachment, config, channel):
+                self.sent.append((message, channel))
+
+            def send(self, level, message, attachment, config):
+                self.sent.append((message, config.channel))
+
+        register_provider("echo", EchoProvider)
+        try:
+            config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+            logger = commonlog(config)
+            logger.custom_send("echo", AlertLevel.ERROR, "hello", channel="#echo")
+            self.assertEqual(get_provider("echo", config).sent, [("hello", "#echo")])
+            self.assertIsInstance(get_provider("pycommonlog.providers.lark:LarkProvider", config), LarkProvider)
+        finally:
+            _factories.pop("echo", None)
+            _factories.pop("pycommonlog.providers.lark:LarkProvider", None)
+
+class TestBroadcast(unittest.TestCase):
+    def tearDown(self):
+        from pycommonlog.providers.registry import reset_providers
+        reset_providers()
+
+    def test_broadcast_runs_concurrently_and_reports_partial_failure(self):
+        import threading
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = commonlog(config)
+        barrier = threading.Barrier(3, timeout=5)
+
+        def send(message, config):
+            barrier.wait()  # only passes if all three targets are in flight together
+            if config.channel == "#broken":
+                raise RuntimeError("boom")
+
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=send):
+            report = logger.broadcast(AlertLevel.ERROR, "Broadcast test", targets=["#a", ("slack", "#broken"), "#b"])
+        logger.close()
+        self.assertFalse(report.ok)
+        self.assertEqual([r.target.channel for r in report.succeeded], ["#a", "#b"])
+        self.assertEqual(str(report.failed[0].error), "boom")
+        with self.assertRaises(Exception) as raised:
+            report.raise_for_failures()
+        self.assertIn("#broken", str(raised.exception))
+
+    def test_broadcast_deadline(self):
+        import threading
+        from pycommonlog.broadcast import BroadcastTimeoutError
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = commonlog(config)
+        release = threading.Event()
+
+        def send(message, config):
+            if config.channel == "#slow":
+                release.wait(5)
+
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=send):
+            report = logger.broadcast(AlertLevel.ERROR, "Deadline test", targets=["#fast", "#slow", (None, None)], timeout=0.2)
+            release.set()
+        logger.close()
+        self.assertEqual([r.ok for r in report], [True, False, True])
+        self.assertIsInstance(report.results[1].error, BroadcastTimeoutError)
+        self.assertEqual(report.results[2].target.channel, None)
+
+    def test_broadcast_reports_rate_limited_target_as_deferred(self):
+        from pycommonlog.providers.ratelimit import RateLimitedError
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = commonlog(config)
+        attempts = []
+
+        def send(message, config):
+            attempts.append(config.channel)
+            if config.channel == "#busy" and attempts.count("#busy") == 1:
+                raise RateLimitedError("slow down", retry_after=0.05, status_code=429)
+
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=send):
+            report = logger.broadcast(AlertLevel.ERROR, "Deferred test", targets=["#a", "#busy"])
+            self.assertFalse(report.ok)
+            self.assertEqual([r.target.channel for r in report.deferred], ["#busy"])
+            self.assertEqual(report.failed, [])
+            report.raise_for_failures()
+            self.assertIsNone(report.deferred[0].deferred.result(timeout=5))
+        logger.close()
+        self.assertEqual(attempts.count("#busy"), 2)
+
+class TestAsyncBroadcast(unittest.IsolatedAsyncioTestCase):
+    async def test_async_broadcast(self):
+        import asyncio
+        from unittest.mock import AsyncMock
+        from pycommonlog.async_logger import AsyncCommonlog
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#default")
+        logger = AsyncCommonlog(config)
+
+        async def send(message, config):
+            if config.channel == "#slow":
+                await asyncio.sleep(5)
+            if config.channel == "#broken":
+                raise RuntimeError("boom")
+
+        logger.provider._send_slack_webclient = AsyncMock(side_effect=send)
+        report = await logger.broadcast(AlertLevel.ERROR, "Async broadcast", targets=["#a", "#broken", "#slow"], timeout=0.2)
+        self.assertEqual([r.ok for r in report], [True, False, False])
+        self.assertEqual(len(report.failed), 2)
+        self.assertEqual(config.channel, "#default")
+
+class TestTracePipeline(unittest.TestCase):
+    def test_truncate_keeps_head_and_tail_within_budget(self):
+        from pycommonlog.trace import truncate_trace
+        self.assertEqual(truncate_trace("short", 100), "short")
+        text = "HEAD" + "x" * 100000 + "ValueError: boom"
+        truncated = truncate_trace(text, 1000)
+        self.assertLessEqual(len(truncated.encode("utf-8")), 1000)
+        self.assertTrue(truncated.startswith("HEAD"))
+        self.assertTrue(truncated.endswith("ValueError: boom"))
+        self.assertIn("bytes truncated", truncated)
+        unicode_text = "é" * 5000 + "错误"
+        truncated = truncate_trace(unicode_text, 500)
+        self.assertLessEqual(len(truncated.encode("utf-8")), 500)
+        self.assertTrue(truncated.endswith("错误"))
+
+    def test_gzip_round_trip(self):
+        import gzip
+        from pycommonlog.trace import gzip_text
+        text = "line ✓\n" * 50000
+        self.assertEqual(gzip.decompress(gzip_text(text, chunk_chars=1000)).decode("utf-8"), text)
+
+    def test_provider_truncates_inline_trace(self):
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test",
+                        provider_config={"trace_max_bytes": 2000})
+        logger = commonlog(config)
+        with patch.object(logger.provider, "_send_slack_webclient") as mock_send:
+            logger.send(AlertLevel.ERROR, "Large trace", trace="frame\n" * 100000)
+        self.assertLess(len(mock_send.call_args[0][0]), 2200)
+
+    def test_slack_uploads_oversize_trace(self):
+        import gzip
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="C123",
+                        provider_config={"trace_max_bytes": 1000, "trace_upload": True})
+        logger = commonlog(config)
+        transport = Mock()
+        transport.post.side_effect = [
+            Mock(status_code=200, json=Mock(return_value={"ok": True, "upload_url": "https://files.slack.com/upload/1", "file_id": "F1"})),
+            Mock(status_code=200, text="OK"),
+            Mock(status_code=200, json=Mock(return_value={"ok": True})),
+        ]
+        logger.provider.transport = transport
+        trace = "Traceback\n" * 10000
+        logger.send(AlertLevel.ERROR, "Upload trace", trace=trace)
+        urls = [call[0][0] for call in transport.post.call_args_list]
+        self.assertEqual(urls[0], "https://slack.com/api/files.getUploadURLExternal")
+        self.assertEqual(urls[1], "https://files.slack.com/upload/1")
+        self.assertEqual(gzip.decompress(transport.post.call_args_list[1][1]["data"]).decode(), trace)
+        complete = transport.post.call_args_list[2][1]["json"]
+        self.assertEqual(complete["channel_id"], "C123")
+        self.assertEqual(complete["files"], [{"id": "F1", "title": "trace.log.gz"}])
+        self.assertIn("attached as trace.log.gz", complete["initial_comment"])
+
+    def test_slack_upload_resolves_channel_name_first(self):
+        from pycommonlog.providers import SlackProvider
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="upload-name-token", channel="#alerts",
+                        provider_config={"trace_max_bytes": 1000, "trace_upload": True})
+        transport = Mock()
+        transport.post.side_effect = [
+            Mock(status_code=200, json=Mock(return_value={"ok": True, "channels": [{"name": "general", "id": "C0"}], "response_metadata": {"next_cursor": "n1"}})),
+            Mock(status_code=200, json=Mock(return_value={"ok": True, "channels": [{"name": "alerts", "id": "C42"}]})),
+            Mock(status_code=200, json=Mock(return_value={"ok": True, "upload_url": "https://files.slack.com/upload/1", "file_id": "F1"})),
+            Mock(status_code=200, text="OK"),
+            Mock(status_code=200, json=Mock(return_value={"ok": True})),
+        ]
+        provider = SlackProvider(transport=transport)
+        provider.send(AlertLevel.ERROR, "Upload trace", Attachment(content="x" * 5000, file_name="trace.log"), config)
+        urls = [call[0][0] for call in transport.post.call_args_list]
+        self.assertEqual(urls[:2], ["https://slack.com/api/conversations.list"] * 2)
+        self.assertEqual(transport.post.call_args_list[1][1]["data"]["cursor"], "n1")
+        self.assertEqual(transport.post.call_args_list[4][1]["json"]["channel_id"], "C42")
+
+        # A name that does not resolve falls back to the inline trace before anything is uploaded
+        transport.post.side_effect = [Mock(status_code=200, json=Mock(return_value={"ok": True, "channels": []}))]
+        missing = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="upload-name-token", channel="#gone",
+                         provider_config={"trace_max_bytes": 1000, "trace_upload": True})
+        with patch.object(provider, "_send_slack_webclient") as mock_send, self.assertLogs(level="WARNING"):
+            provider.send(AlertLevel.ERROR, "Upload trace", Attachment(content="x" * 5000, file_name="trace.log"), missing)
+        self.assertEqual(transport.post.call_args[0][0], "https://slack.com/api/conversations.list")
+        self.assertIn("bytes truncated", mock_send.call_args[0][0])
+
+    def test_lark_upload_failure_falls_back_to_inline(self):
+        from pycommonlog.providers import LarkProvider
+        provider = LarkProvider(transport=Mock())
+        provider.transport.post.return_value = Mock(status_code=200, json=Mock(return_value={"code": 99991, "msg": "no permission"}))
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="alerts",
+                        provider_config={"trace_max_bytes": 1000, "trace_upload": True})
+        with patch.object(provider, "_send_lark_webclient") as mock_send, self.assertLogs(level="WARNING"):
+            provider.send_to_channel(AlertLevel.ERROR, "Fallback", Attachment(content="x" * 5000, file_name="trace.log"), config, "alerts")
+        title, message, context = mock_send.call_args[0]
+        self.assertIn("bytes truncated", message)
+        self.assertNotIn("file_key", mock_send.call_args[1])
+
+class TestAlertSpool(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _config(self):
+        return Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test",
+                      provider_config={"spool_dir": self.directory, "spool_replay_interval": 3600})
+
+    def test_undelivered_alerts_are_replayed_after_restart(self):
+        import time
+        logger = commonlog(self._config())
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=RuntimeError("provider down")):
+            for i in range(3):
+                with self.assertRaises(RuntimeError):
+                    logger.send(AlertLevel.ERROR, f"alert {i}")
+        with patch.object(logger.provider, "_send_slack_webclient"):
+            logger.send(AlertLevel.ERROR, "delivered")
+        self.assertEqual(len(logger.spool), 3)
+        logger.close()
+
+        sent = []
+        with patch("pycommonlog.providers.slack.SlackProvider._send_slack_webclient", autospec=True,
+                   side_effect=lambda provider, message, config: sent.append((message, config.channel))):
+            restarted = commonlog(self._config())
+            deadline = time.monotonic() + 5
+            while len(sent) < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            restarted.close()
+        self.assertEqual(sent, [(f"alert {i}", "#test") for i in range(3)])
+        self.assertEqual(len(restarted.spool), 0)
+
+    def test_segments_rotate_and_are_bounded(self):
+        import os
+        from pycommonlog.spool import AlertSpool
+        spool = AlertSpool(self.directory, segment_bytes=1024, max_bytes=4096, fsync=False)
+        positions = [spool.append({"message": "x" * 200, "i": i}) for i in range(40)]
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)), 4096 + 1024)
+        self.assertGreater(spool.dropped, 0)
+        for position in positions:
+            spool.ack(position)
+        self.assertEqual(len(spool), 0)
+        spool.close()
+        self.assertEqual(os.listdir(self.directory), ["lock"])
+
+    def test_torn_tail_is_ignored(self):
+        import os
+        from pycommonlog.spool import AlertSpool
+        spool = AlertSpool(self.directory, fsync=False)
+        spool.append({"message": "complete"})
+        path = spool._active.path
+        spool.close()
+        with open(path, "ab") as f:
+            f.write(b"\x40\x00\x00\x00partial")
+        reopened = AlertSpool(self.directory, fsync=False)
+        self.assertEqual([record["message"] for _, record in reopened.pending()], ["complete"])
+        reopened.close()
+
+    def test_concurrent_appends_share_fsyncs(self):
+        import os
+        import threading
+        import time
+        from pycommonlog.spool import AlertSpool
+        calls = []
+        real_fsync = os.fsync
+
+        def slow_fsync(fd):
+            calls.append(fd)
+            time.sleep(0.005)
+            real_fsync(fd)
+
+        with patch("pycommonlog.spool.os.fsync", side_effect=slow_fsync):
+            spool = AlertSpool(self.directory, fsync_interval=0)
+            workers = [threading.Thread(target=lambda: [spool.ack(spool.append({"n": n})) for n in range(20)]) for _ in range(8)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            spool.close()
+        self.assertLess(len(calls), 160 / 2)
+
+    def test_appends_are_fsynced_in_the_background_by_default(self):
+        import os
+        import threading
+        import time
+        from pycommonlog.spool import AlertSpool
+        threads = []
+        real_fsync = os.fsync
+
+        def recording_fsync(fd):
+            threads.append(threading.current_thread().name)
+            real_fsync(fd)
+
+        with patch("pycommonlog.spool.os.fsync", side_effect=recording_fsync):
+            spool = AlertSpool(self.directory)
+            for n in range(50):
+                spool.append({"n": n})
+            deadline = time.monotonic() + 5
+            while spool._synced < 50 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(spool._synced, 50)
+            self.assertLess(len(threads), 50)
+            self.assertEqual(set(threads), {"commonlog-spool-fsync"})
+            spool.close()
+
+    def test_exit_hook_closes_spool_after_deferred_alerts_are_sent(self):
+        from pycommonlog.logger import _close_at_exit
+        from pycommonlog.spool import AlertSpool
+        for setting in ({"coalesce_window": 60}, {"async_dispatch": True}):
+            config = self._config()
+            config.provider_config.update(setting)
+            logger = commonlog(config)
+            with patch.object(logger.provider, "_send_slack_webclient") as send:
+                logger.send(AlertLevel.ERROR, "alert at exit")
+                _close_at_exit()
+            self.assertEqual(send.call_count, 1, setting)
+            reopened = AlertSpool(self.directory)
+            self.assertEqual(list(reopened.pending()), [], setting)
+            reopened.close()
+
+    def test_rate_limited_alert_is_acked_after_resend(self):
+        from pycommonlog.providers.ratelimit import RateLimitedError
+        logger = commonlog(self._config())
+        outcomes = [RateLimitedError("slow down", retry_after=0.1, status_code=429), None]
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=outcomes):
+            logger.send(AlertLevel.ERROR, "rate limited")
+            self.assertEqual(len(logger.spool), 1)
+            self.assertEqual(list(logger.spool.pending()), [])  # in flight, not replayed meanwhile
+            self.assertTrue(logger.flush(timeout=5))
+        self.assertEqual(len(logger.spool), 0)
+        logger.close()
+
+    def test_alert_dropped_by_dispatcher_is_left_for_replay(self):
+        import threading
+        import time
+        config = self._config()
+        config.provider_config.update({"async_dispatch": True, "dispatch_queue_size": 1, "dispatch_overflow": "drop_newest"})
+        logger = commonlog(config)
+        release = threading.Event()
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=lambda message, config: release.wait(5)):
+            logger.send(AlertLevel.ERROR, "alert 0")
+            deadline = time.monotonic() + 5
+            while logger.dispatcher.qsize() and time.monotonic() < deadline:
+                time.sleep(0.01)  # running on the worker
+            logger.send(AlertLevel.ERROR, "alert 1")  # queued
+            logger.send(AlertLevel.ERROR, "alert 2")  # dropped
+            self.assertEqual(logger.dispatcher.dropped, 1)
+            self.assertEqual([record["message"] for _, record in logger.spool.pending()], ["alert 2"])
+            release.set()
+            logger.close()
+
+    def test_ack_after_close_is_ignored(self):
+        from pycommonlog.spool import AlertSpool
+        spool = AlertSpool(self.directory, fsync=False)
+        position = spool.append({"message": "late"})
+        spool.close()
+        spool.ack(position)
+        spool.release(position)
+        reopened = AlertSpool(self.directory)
+        self.assertEqual([record["message"] for _, record in reopened.pending()], ["late"])
+        reopened.close()
+
+    def test_second_spool_on_a_directory_uses_a_worker_slot(self):
+        import os
+        from pycommonlog.spool import AlertSpool
+        first = AlertSpool(self.directory, fsync=False)
+        first.append({"message": "first"})
+        second = AlertSpool(self.directory, fsync=False)
+        self.assertEqual(second.directory, os.path.join(self.directory, "worker-1"))
+        second.append({"message": "second"})
+        self.assertEqual([record["message"] for _, record in second.pending()], [])  # in flight, but not first's
+        first.close()
+        second.close()
+        reopened = AlertSpool(self.directory, fsync=False)
+        self.assertEqual(reopened.directory, self.directory)
+        self.assertEqual([record["message"] for _, record in reopened.pending()], ["first"])
+        reopened.close()
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs fork()")
+    def test_forked_child_spools_into_its_own_slot(self):
+        import os
+        from pycommonlog.spool import AlertSpool
+        spool = AlertSpool(self.directory, fsync=False)
+        spool.release(spool.append({"message": "parent"}))
+        pid = os.fork()
+        if pid == 0:
+            moved = False
+            try:
+                spool.release(spool.append({"message": "child"}))
+                moved = spool.directory == os.path.join(self.directory, "worker-1")
+                spool.close()
+            finally:
+                os._exit(0 if moved else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertEqual([record["message"] for _, record in spool.pending()], ["parent"])
+        spool.close()
+        child = AlertSpool(os.path.join(self.directory, "worker-1"), fsync=False)
+        self.assertEqual([record["message"] for _, record in child.pending()], ["child"])
+        child.close()
+
+    def test_replay_skips_failing_records_and_dead_letters_them(self):
+        import json
+        import os
+        from pycommonlog.providers.retry import ProviderHTTPError, is_retryable
+        from pycommonlog.spool import AlertSpool
+        spool = AlertSpool(self.directory, fsync=False, max_attempts=2)
+        for message in ("outage", "bad channel", "fine"):
+            spool.release(spool.append({"message": message}))  # failed live delivery
+        errors = {"outage": ProviderHTTPError("unavailable", 503), "bad channel": ProviderHTTPError("not found", 404)}
+        attempts = []
+
+        def deliver(record):
+            attempts.append(record["message"])
+            if record["message"] in errors:
+                raise errors[record["message"]]
+
+        self.assertEqual(spool.replay(deliver, is_retryable), 1)
+        self.assertEqual(attempts, ["outage", "bad channel", "fine"])
+        self.assertEqual([record["message"] for _, record in spool.pending()], ["outage"])
+        self.assertEqual(spool.replay(deliver, is_retryable), 0)
+        self.assertEqual(attempts[3:], [])  # backing off
+        spool._attempts = {position: (attempts_so_far, 0.0) for position, (attempts_so_far, _) in spool._attempts.items()}
+        spool.replay(deliver, is_retryable)
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(spool.dead_lettered, 2)
+        with open(os.path.join(self.directory, "dead-letter.jsonl")) as f:
+            dead = [json.loads(line) for line in f]
+        self.assertEqual([(record["message"], record["attempts"]) for record in dead], [("bad channel", 1), ("outage", 2)])
+        spool.close()
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        from pycommonlog import metrics
+        metrics.get_metrics_registry().reset()
+
+    def tearDown(self):
+        from pycommonlog import metrics
+        metrics.enable_metrics(False)
+        metrics.get_metrics_registry().reset()
+
+    def _find(self, samples, name, **labels):
+        return [s for s in samples if s["name"] == name and all(s["labels"].get(k) == v for k, v in labels.items())]
+
+    def test_disabled_metrics_record_nothing(self):
+        from pycommonlog import metrics
+        self.assertIs(metrics.timer("commonlog_http_seconds", operation="x"), metrics._NOOP_TIMER)
+        metrics.incr("commonlog_alerts_total", provider="slack", outcome="success")
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = commonlog(config)
+        with patch.object(logger.provider, "_send_slack_webclient"):
+            logger.send(AlertLevel.ERROR, "not measured")
+        snapshot = metrics.get_metrics_snapshot()
+        self.assertEqual(snapshot["histograms"], [])
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_alerts_total"), [])
+
+    def test_send_latency_outcomes_and_prometheus_text(self):
+        from pycommonlog.metrics import get_metrics_snapshot, render_prometheus
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test", provider_config={"metrics": True})
+        logger = commonlog(config)
+        with patch.object(logger.provider, "_send_slack_webclient"):
+            logger.send(AlertLevel.ERROR, "ok")
+            logger.send(AlertLevel.ERROR, "ok again")
+        with patch.object(logger.provider, "_send_slack_webclient", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                logger.send(AlertLevel.ERROR, "fails")
+        snapshot = get_metrics_snapshot()
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_alerts_total", outcome="success")[0]["value"], 2)
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_alerts_total", outcome="failure")[0]["value"], 1)
+        self.assertEqual(self._find(snapshot["histograms"], "commonlog_send_seconds", provider="slack")[0]["count"], 3)
+        self.assertEqual(self._find(snapshot["histograms"], "commonlog_stage_seconds", stage="format")[0]["count"], 3)
+        text = render_prometheus(snapshot)
+        self.assertIn('commonlog_alerts_total{outcome="failure",provider="slack"} 1', text)
+        self.assertIn('commonlog_send_seconds_bucket{provider="slack",le="+Inf"} 3', text)
+        self.assertIn("# TYPE commonlog_send_seconds histogram", text)
+
+    def test_cache_hit_ratio_redis_fallbacks_and_http_attempts(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.metrics import enable_metrics, get_metrics_snapshot
+        from pycommonlog.providers.retry import get_retry_policy
+        from pycommonlog.providers.tiered_cache import TieredCache
+        enable_metrics()
+        cache = TieredCache(l1=InMemoryCache())
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT)
+        client = Mock()
+        client.pipeline.return_value.execute.return_value = ["t-cached", 3600]
+        with patch('pycommonlog.providers.tiered_cache.get_redis_client', return_value=client):
+            cache.get(config, "commonlog_k")  # L2 hit
+            cache.get(config, "commonlog_k")  # L1 hit
+        with patch('pycommonlog.providers.tiered_cache.get_redis_client', side_effect=ConnectionError("down")):
+            cache.get(config, "commonlog_other")
+            cache.set(config, "commonlog_other", "v")
+        policy = get_retry_policy(Config(provider="lark", send_method=SendMethod.WEBCLIENT, provider_config={"retry_base_delay": 0}))
+        policy.call(Mock(side_effect=[ConnectionError("reset"), "ok"]), operation="test.metrics")
+        snapshot = get_metrics_snapshot()
+        self.assertAlmostEqual(self._find(snapshot["gauges"], "commonlog_cache_hit_ratio")[0]["value"], 2 / 3)
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_redis_fallbacks_total", operation="get")[0]["value"], 1)
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_redis_fallbacks_total", operation="set")[0]["value"], 1)
+        self.assertEqual(self._find(snapshot["histograms"], "commonlog_http_seconds", operation="test.metrics")[0]["count"], 2)
+        self.assertEqual(self._find(snapshot["counters"], "commonlog_retry_retries_total", operation="test.metrics")[0]["value"], 1)
+
+    def test_statsd_sink_pushes_tagged_lines(self):
+        import socket
+        from pycommonlog.metrics import StatsDSink, enable_metrics, get_metrics_registry, incr, observe
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(2)
+        sink = StatsDSink("127.0.0.1", receiver.getsockname()[1])
+        get_metrics_registry().add_sink(sink)
+        try:
+            enable_metrics()
+            incr("commonlog_alerts_total", provider="lark", outcome="success")
+            observe("commonlog_send_seconds", 0.25, provider="lark")
+            self.assertEqual(receiver.recv(1024), b"commonlog.alerts_total:1|c|#provider:lark,outcome:success")
+            self.assertEqual(receiver.recv(1024), b"commonlog.send_seconds:250.0|ms|#provider:lark")
+        finally:
+            get_metrics_registry().remove_sink(sink)
+            sink.close()
+            receiver.close()
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        import contextlib
+        import contextvars
+        import types
+        current = contextvars.ContextVar("span", default=None)
+        self.spans = spans = []
+
+        class FakeSpan:
+            def __init__(self, name, attributes, parent):
+                self.name, self.attributes, self.parent = name, dict(attributes or {}), parent
+                self.error = None
+
+            def set_attribute(self, key, value):
+                self.attributes[key] = value
+
+            def is_recording(self):
+                return True
+
+        class FakeTracer:
+            @contextlib.contextmanager
+            def start_as_current_span(self, name, attributes=None):
+                span = FakeSpan(name, attributes, current.get())
+                spans.append(span)
+                token = current.set(span)
+                try:
+                    yield span
+                except Exception as e:
+                    span.error = e
+                    raise
+                finally:
+                    current.reset(token)
+
+        trace = types.SimpleNamespace(get_tracer=lambda name: FakeTracer(), get_current_span=current.get)
+        context = types.SimpleNamespace(get_current=current.get, attach=current.set, detach=current.reset)
+        otel = types.ModuleType("opentelemetry")
+        otel.trace, otel.context = trace, context
+        self.modules = patch.dict(sys.modules, {"opentelemetry": otel, "opentelemetry.trace": trace, "opentelemetry.context": context})
+        self.modules.start()
+        self._reset_tracing()
+
+    def tearDown(self):
+        self.modules.stop()
+        self._reset_tracing()
+        from pycommonlog.providers.registry import reset_providers
+        reset_providers()
+
+    def _reset_tracing(self):
+        from pycommonlog import tracing
+        tracing.enable_tracing(False)
+        tracing._tracer = tracing._otel_trace = tracing._otel_context = None
+
+    def _span(self, name):
+        return next(span for span in self.spans if span.name == name)
+
+    def test_disabled_tracing_never_imports_opentelemetry(self):
+        from pycommonlog import tracing
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test")
+        logger = commonlog(config)
+        with patch.object(logger.provider, "_send_slack_webclient"):
+            logger.send(AlertLevel.ERROR, "untraced")
+        self.assertIsNone(tracing._tracer)
+        self.assertEqual(self.spans, [])
+        self.assertIs(tracing.span("x"), tracing._NOOP_SPAN)
+
+    def test_lark_pipeline_spans_and_attributes(self):
+        from pycommonlog.cache import InMemoryCache
+        from pycommonlog.providers.tiered_cache import TieredCache
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, token="t-static", channel="alerts", provider_config={"tracing": True})
+        logger = commonlog(config)
+        response = Mock(status_code=200)
+        cache = TieredCache(l1=InMemoryCache())
+        cache.l1.set(logger.provider._chat_id_cache_key(config, "alerts"), "oc_1", 60)
+        with patch('pycommonlog.providers.lark.get_tiered_cache', return_value=cache), \
+                patch.object(logger.provider, "_get_transport") as transport:
+            transport.return_value.post.return_value = response
+            logger.send(AlertLevel.ERROR, "traced")
+        root = self._span("commonlog.send")
+        self.assertEqual(root.attributes, {"commonlog.provider": "lark", "commonlog.channel": "alerts", "commonlog.level": AlertLevel.ERROR})
+        send = self._span("lark.send")
+        self.assertIs(send.parent, root)
+        self.assertGreater(send.attributes["commonlog.payload_bytes"], 0)
+        self.assertEqual(self._span("lark.get_chat_id_from_channel_name").attributes["commonlog.cache.tier"], "l1")
+        http = self._span("lark.im.messages")
+        self.assertIs(http.parent, send)
+        self.assertEqual(http.attributes["http.status_code"], 200)
+
+    def test_failed_request_records_status_and_error(self):
+        from pycommonlog.providers.retry import ProviderHTTPError, RetryPolicy
+        from pycommonlog.tracing import enable_tracing
+
+        def post():
+            raise ProviderHTTPError("Slack WebClient response: 403", 403)
+
+        enable_tracing()
+        with self.assertRaises(ProviderHTTPError):
+            RetryPolicy(max_attempts=1).call(post, operation="slack.chat.postMessage")
+        span = self._span("slack.chat.postMessage")
+        self.assertEqual(span.attributes["http.status_code"], 403)
+        self.assertIsInstance(span.error, ProviderHTTPError)
+
+class TestCommonlogHandler(unittest.TestCase):
+    def _attach(self, handler):
+        import logging
+        log = logging.getLogger(f"test.handler.{id(handler)}")
+        log.addHandler(handler)
+        log.propagate = False
+        self.addCleanup(log.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return log
+
+    def test_levels_and_exc_info_trace(self):
+        from pycommonlog.handler import CommonlogHandler
+        alerts = Mock()
+        log = self._attach(CommonlogHandler(alerts))
+        log.info("not an alert")
+        log.warning("disk at %s%%", 91)
+        try:
+            raise ValueError("bad input")
+        except ValueError:
+            log.exception("request failed")
+        log.critical("down", stack_info=True)
+        log.handlers[0].close()
+        calls = alerts.send.call_args_list
+        self.assertEqual([c[0] for c in calls], [(AlertLevel.WARN, "disk at 91%"), (AlertLevel.ERROR, "request failed"), (AlertLevel.ERROR, "down")])
+        self.assertIn("ValueError: bad input", calls[1][1]["trace"])
+        self.assertNotIn("Traceback", calls[1][0][1])
+        self.assertIn("Stack (most recent call last)", calls[2][1]["trace"])
+        self.assertEqual(calls[0][1]["trace"], "")
+
+    def test_exit_hook_drains_handlers_before_dispatchers(self):
+        import threading
+        from pycommonlog.handler import CommonlogHandler
+        from pycommonlog.logger import _close_at_exit
+        alerts = commonlog(Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#test",
+                                  provider_config={"async_dispatch": True}))
+        release = threading.Event()
+        sent = []
+
+        def send(message, config):
+            release.wait(5)
+            sent.append(message)
+
+        log = self._attach(CommonlogHandler(alerts))
+        with patch.object(alerts.provider, "_send_slack_webclient", side_effect=send):
+            for i in range(5):
+                log.error("record %s", i)
+            release.set()
+            _close_at_exit()
+        self.assertEqual(sorted(sent), [f"record {i}" for i in range(5)])
+
+    def test_filters_and_sampling_run_before_formatting(self):
+        import logging
+        from pycommonlog.handler import CommonlogHandler
+        rendered = []
+
+        class Arg:
+            def __str__(self):
+                rendered.append(self)
+                return "arg"
+
+        alerts = Mock()
+        handler = CommonlogHandler(alerts, sample_rates={logging.WARNING: 0}, channel="#ops")
+        handler.addFilter(lambda record: record.msg != "filtered %s")
+        log = self._attach(handler)
+        log.warning("sampled out %s", Arg())
+        log.error("filtered %s", Arg())
+        log.error("kept %s", Arg())
+        handler.flush()
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(handler.sampled_out, 1)
+        alerts.send_to_channel.assert_called_once_with(AlertLevel.ERROR, "kept arg", trace="", channel="#ops")
+
+    def test_full_queue_drops_and_failures_do_not_loop(self):
+        import logging
+        import threading
+        from pycommonlog.handler import CommonlogHandler
+        release = threading.Event()
+
+        def send(level, message, trace=""):
+            release.wait(5)
+            logging.getLogger().error("Failed to send alert: boom")  # what commonlog logs on failure
+            raise RuntimeError("boom")
+
+        handler = CommonlogHandler(Mock(send=Mock(side_effect=send)), queue_size=1)
+        root = logging.getLogger()
+        root.addHandler(handler)
+        self.addCleanup(root.removeHandler, handler)
+        try:
+            for i in range(5):
+                root.error("burst %s", i)
+        finally:
+            release.set()
+        handler.close()
+        self.assertGreaterEqual(handler.dropped, 3)
+        self.assertEqual(handler.failed + handler.dropped, 5)
+        self.assertTrue(handler.queue.empty())
+
+class TestMessageTemplates(unittest.TestCase):
+    def test_json_template_matches_nested_json_dumps(self):
+        import json
+        from pycommonlog.templates import JsonTemplate, JsonString
+        template = JsonTemplate({"id": "{chat_id}", "n": 1, "content": JsonString({"title": "{title}", "rows": [["{{literal}} {text}"]]})})
+        title, text = 'svc "a" - é', 'line\n"quoted" \\ 错误 {not a field}'
+        expected = json.dumps({"id": "oc_1", "n": 1, "content": json.dumps({"title": title, "rows": [["{literal} " + text]]})})
+        self.assertEqual(template.render(chat_id="oc_1", title=title, text=text), expected)
+        with self.assertRaises(ValueError):
+            JsonTemplate({"text": "{unknown}"}, fields={"text"})
+
+    def test_compiled_templates_are_keyed_by_content_and_bounded(self):
+        from pycommonlog import templates
+        build = Mock(side_effect=lambda source: templates.JsonTemplate(source))
+        blocks = {"b": "{text}", "a": 1}
+        first = templates.get_template("test", blocks, build)
+        # The same object is found by identity, without serializing it per alert
+        with patch("pycommonlog.templates._template_key") as template_key:
+            self.assertIs(templates.get_template("test", blocks, build), first)
+        template_key.assert_not_called()
+        self.assertIs(templates.get_template("test", {"a": 1, "b": "{text}"}, build), first)
+        self.assertEqual(build.call_count, 1)
+        for i in range(templates.MAX_COMPILED_TEMPLATES + 1):
+            templates.get_template("test", f"{{text}} {i}", templates.TextTemplate)
+        self.assertEqual(len(templates._compiled), templates.MAX_COMPILED_TEMPLATES)
+        templates.get_template("test", {"a": 1, "b": "{text}"}, build)
+        self.assertEqual(build.call_count, 2)  # evicted, compiled again
+
+    def test_slack_message_template_and_blocks(self):
+        import json
+        from pycommonlog.providers.slack import slack_header
+        blocks = [
+            {"type": "header", "text": {"type": "plain_text", "text": "{title}"}},
+            {"type": "section", "text": {"type": "mrkdwn", "text": "{text}"}},
+        ]
+        config = Config(provider="slack", send_method=SendMethod.WEBCLIENT, token="dummy-token", channel="#ops",
+                        service_name="api", environment="prod",
+                        provider_config={"message_template": "[{level}] {message}{details}", "slack_blocks": blocks})
+        logger = commonlog(config)
+        transport = Mock()
+        transport.post.return_value = Mock(status_code=200, text="ok")
+        logger.provider.transport = transport
+        slack_header.cache_clear()
+        logger.send(AlertLevel.ERROR, 'Disk "full"', trace="line 1")
+        logger.send(AlertLevel.WARN, "Second")
+        self.assertGreaterEqual(slack_header.cache_info().hits, 1)
+        kwargs = transport.post.call_args_list[0][1]
+        self.assertNotIn("json", kwargs)
+        payload = json.loads(kwargs["data"])
+        self.assertEqual(payload["channel"], "#ops")
+        self.assertTrue(payload["text"].startswith('[ERROR] Disk "full"'))
+        self.assertIn("line 1", payload["text"])
+        self.assertEqual(payload["blocks"][0]["text"]["text"], "api - prod")
+        self.assertEqual(payload["blocks"][1]["text"]["text"], payload["text"])
+
+    def test_lark_card_template(self):
+        import json
+        from pycommonlog.providers import LarkProvider
+        card = {"header": {"title": {"tag": "plain_text", "content": "{title}"}}, "elements": [{"tag": "markdown", "content": "{text}"}]}
+        transport = Mock()
+        transport.post.return_value = Mock(status_code=200, text="ok")
+        provider = LarkProvider(transport=transport)
+        config = Config(provider="lark", send_method=SendMethod.WEBCLIENT, token="t-static", channel="alerts",
+                        service_name="billing", provider_config={"lark_card": card})
+        with patch.object(provider, "get_chat_id_from_channel_name", return_value="oc_9"):
+            provider.send(AlertLevel.ERROR, "Card alert", None, config)
+        body = json.loads(transport.post.call_args[1]["data"])
+        self.assertEqual((body["receive_id"], body["msg_type"]), ("oc_9", "interactive"))
+        content = json.loads(body["content"])
+        self.assertEqual(content["header"]["title"]["content"], "billing")
+        self.assertEqual(content["elements"][0]["content"], "Card alert")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file